@@ -1,21 +1,32 @@
+from startup import BackgroundInit, StartupTrace
 import tkinter as tk
-from tkinter import messagebox
+from tkinter import messagebox, simpledialog, ttk
 from pathlib import Path
 import subprocess
 import os
 import sys
-import time
 import logging
 import threading
-import platform
-import signal
 import socket
-from ctypes import POINTER, cast
-import comtypes
-from comtypes import CoInitialize
-from comtypes import CoUninitialize
-from pycaw.pycaw import AudioUtilities, IAudioEndpointVolume
 from datetime import datetime
+from stream_transport import (DEFAULT_PORT, TRANSPORTS, TRANSPORT_TCP, JITTER_TARGET_MS, JITTER_MIN_MS,
+                              JITTER_MAX_MS, idle_counters)
+from stream_format import CODECS
+from recording import RecordingStore
+from telemetry import Telemetry, metrics_logger, HEALTH_GOOD, HEALTH_DEGRADED, HEALTH_BAD
+from device_watcher import DeviceWatcher, EVENT_DEFAULT_CHANGED
+from volume_worker import VolumeWorker
+from log_pipeline import setup_logging, stop_logging
+from process_supervisor import default_supervisor, spawn
+from discovery import Beacon
+from ui_bus import (UiBus, EVENT_STATUS, EVENT_ERROR, EVENT_STOPPED, EVENT_METRICS, EVENT_VOLUME,
+                    EVENT_PLAYBACK_ENDED, EVENT_MIXER)
+from playback import PLAYBACK_TARGET_MS, PLAYBACK_TARGET_MIN_MS, PLAYBACK_TARGET_MAX_MS
+from audio_engine import (ReceiverEngine, RECEIVER_WAITING, RECEIVER_RECEIVING, RECEIVER_ERROR, RECEIVER_IDLE,
+                          OUTPUT_DEVICE, OUTPUT_FFPLAY)
+
+startup_trace = StartupTrace("Audio Receiver")
+startup_trace.mark("imports")
 
 # Use _MEIPASS to correctly set the path when bundled with PyInstaller
 if hasattr(sys, '_MEIPASS'):
@@ -34,66 +45,58 @@ icon_path = script_dir / 'icon' / 'icons8-stream-64.ico'
 # Define log file path within AppData\Local
 log_file_path = appdata_local_path / 'Audio_Receiver.log'
 
+# Rolling log of the stream health samples, one JSON object per line
+metrics_log_path = appdata_local_path / 'Audio_Receiver_metrics.jsonl'
+
 # Ensure the log file directory exists
 log_file_path.parent.mkdir(parents=True, exist_ok=True)
 
-# Set up logging to file
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
-                    handlers=[logging.FileHandler(log_file_path)])
+# Set up logging to file, written by a background thread and rotated by size
+setup_logging(log_file_path, logging.INFO, '%(asctime)s - %(levelname)s - %(message)s')
 
 # Construct full paths to 'ffmpeg.exe', 'ffplay.exe' and 'ffprobe.exe' using pathlib
 ffmpeg_path = script_dir / 'ffmpeg' / 'bin' / 'ffmpeg.exe'
 ffplay_path = script_dir / 'ffmpeg' / 'bin' / 'ffplay.exe'
 ffprobe_path = script_dir / 'ffmpeg' / 'bin' / 'ffprobe.exe'
 
-# Log path information for debugging
 logging.info("Application started")
-logging.info(f"Base path: {base_path}")
-logging.info(f"Script dir: {script_dir}")
-logging.info(f"Looking for ffplay at: {ffplay_path}")
-logging.info(f"ffplay.exe exists: {ffplay_path.exists()}")
-
-# Validate critical paths exist
-if not ffplay_path.exists():
-    logging.error(f"CRITICAL: ffplay.exe not found at {ffplay_path}")
-    # Try to find ffmpeg folder structure
-    ffmpeg_dir = script_dir / 'ffmpeg'
-    logging.info(f"ffmpeg directory exists: {ffmpeg_dir.exists()}")
-    if ffmpeg_dir.exists():
-        bin_dir = ffmpeg_dir / 'bin'
-        logging.info(f"bin directory exists: {bin_dir.exists()}")
-        if bin_dir.exists():
-            try:
-                bin_contents = list(bin_dir.iterdir())
-                logging.info(f"Contents of bin directory: {[f.name for f in bin_contents]}")
-            except Exception as e:
-                logging.error(f"Error listing bin directory: {e}")
-
-if not ffmpeg_path.exists():
-    logging.error(f"CRITICAL: ffmpeg.exe not found at {ffmpeg_path}")
-
-# Function to terminate processes by name
-def terminate_process(process_name):
-    if platform.system() == "Windows":
-        commands = ['taskkill', '/F', '/IM', f'{process_name}.exe', '/T']
-    else:
-        commands = ['pkill', '-f', process_name]
-
-    #logging.info(f"Attempting to terminate {process_name} processes.")
-    try:
-        subprocess.run(commands, stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=CREATE_NO_WINDOW)
-        #logging.info(f"Successfully terminated {process_name} processes.")
-    except Exception as e:
-        logging.error(f"Error terminating {process_name} processes: {e}")
 
-# Define CREATE_NO_WINDOW for Windows
-CREATE_NO_WINDOW = 0x08000000 if os.name == 'nt' else 0
+
+def check_binaries():
+    # Runs on a startup worker: probing a bundle on a slow or network drive shouldn't hold up the window
+    logging.info(f"Base path: {base_path}")
+    logging.info(f"Looking for ffplay at: {ffplay_path}")
+    logging.info(f"ffplay.exe exists: {ffplay_path.exists()}")
+    if not ffplay_path.exists():
+        logging.error(f"CRITICAL: ffplay.exe not found at {ffplay_path}")
+        # Try to find ffmpeg folder structure
+        ffmpeg_dir = script_dir / 'ffmpeg'
+        logging.info(f"ffmpeg directory exists: {ffmpeg_dir.exists()}")
+        if ffmpeg_dir.exists():
+            bin_dir = ffmpeg_dir / 'bin'
+            logging.info(f"bin directory exists: {bin_dir.exists()}")
+            if bin_dir.exists():
+                try:
+                    bin_contents = list(bin_dir.iterdir())
+                    logging.info(f"Contents of bin directory: {[f.name for f in bin_contents]}")
+                except Exception as e:
+                    logging.error(f"Error listing bin directory: {e}")
+    if not ffmpeg_path.exists():
+        logging.error(f"CRITICAL: ffmpeg.exe not found at {ffmpeg_path}")
+
+
+def import_audio_modules():
+    # comtypes and pycaw take a noticeable part of startup, so they are imported off the UI thread.
+    # numpy (through audio_mixer) is only needed for mixing but is warmed up here as well.
+    import comtypes
+    import pycaw.pycaw
+    import audio_mixer
 
 class FFplayGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("Audio Receiver")
-        self.root.geometry("400x475")
+        self.root.geometry("400x535")
         self.primary_button_font = ("Arial", 10, "bold")
         self.secondary_button_font = ("Arial", 9, "bold")
         # Window is already withdrawn from main block
@@ -109,33 +112,38 @@ class FFplayGUI:
         except Exception as e:
             logging.error('Failed to set icon: %s', e)
 
-        #self.volume = None
-        self.update_volume_control()  # Initialize volume control
+        # Owns the default speakers' volume once pycaw is loaded, see bind_audio_device
+        self.volume_worker = None
+        self.speakers_id = None
+        self.device_watcher = None
 
-        self.process = None
-        self.stream_thread = None
+        self.receiver = None  # The ReceiverEngine while receiving, see audio_engine
+        self.in_process_playback = False
+        self.playback_target_ms = PLAYBACK_TARGET_MS
         self.play_process = None
         self.is_muted = False
         self.is_recording_mode = False
         self.running = True  # Flag to control monitoring thread
         self.connection_status = "idle"  # Track connection health
+        self.telemetry = None
+        self.transport_mode = TRANSPORT_TCP
+        self.jitter_target_ms = JITTER_TARGET_MS
+        self.mix_mode = False
+        self.mixer_window = None
+        self.mixer_rows = {}
+        self.mixer_layout = None
 
         self.recordings_dir = script_dir / 'recordings'
-        self.recordings_dir.mkdir(exist_ok=True)
-
-        # Generate timestamped filename to avoid overwrites
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.recording_filename = self.recordings_dir / f"recording_{timestamp}.mp3"
+        # Segmented recordings with a time index, old segments are deleted by age and total size
+        self.recording_store = RecordingStore(str(self.recordings_dir))
 
-        self.local_ip = self.get_local_ip()
-        
-        # Remove bitrate monitoring - not needed in single-stream mode
+        self.local_ip = None  # Looked up in the background
 
         volume_frame = tk.Frame(root, bg="#e8e8e8", bd=2, relief="solid")
         volume_frame.place(x=20, y=10, width=90, height=280)
 
         self.volume_slider = tk.Scale(volume_frame, from_=100, to=0, orient=tk.VERTICAL, command=self.set_volume, bg="#e8e8e8", troughcolor="#d0d0d0", activebackground="#4CAF50")
-        self.volume_slider.set(self.get_current_volume())
+        self.volume_slider.set(0)  # The real level arrives with the first report from the volume worker
         self.volume_slider.place(x=20, y=20, height=220)
 
         self.volume_slider.bind("<MouseWheel>", self.on_mouse_wheel)
@@ -207,6 +215,10 @@ class FFplayGUI:
         self.status_message = tk.Label(self.status_container, text="Idle", font=("Arial", 14, "bold"), fg="blue", bg="#f0f0f0")
         self.status_message.pack(side=tk.TOP, fill=tk.X)
 
+        # Rates and buffer from the telemetry, or why the indicator isn't green
+        self.telemetry_label = tk.Label(self.status_container, text="", font=("Arial", 8), fg="#555555", bg="#f0f0f0")
+        self.telemetry_label.pack(side=tk.TOP, fill=tk.X)
+
         # Recording playback controls
         self.play_button = tk.Button(root, text="Play Recording", command=self.play_recording, 
                                    state=tk.DISABLED, width=12, height=2, 
@@ -225,16 +237,90 @@ class FFplayGUI:
         self.add_hover(self.stop_play_button, "#d32f2f", "#f44336")
         self.update_play_button_state()  # Initial update based on the presence of the recording file
 
-        self.ip_label = tk.Label(root, text=f"Local IP: {self.local_ip}")
-        self.ip_label.place(x=125, y=450)
+        # Transport selection (TCP stream or UDP/RTP with jitter buffer)
+        self.transport_label = tk.Label(root, text="Transport:", font=("Arial", 9))
+        self.transport_label.place(x=20, y=447)
+        self.transport_var = tk.StringVar(value=TRANSPORTS[TRANSPORT_TCP])
+        self.transport_dropdown = ttk.Combobox(root, textvariable=self.transport_var, values=list(TRANSPORTS.values()),
+                                               state="readonly", font=("Arial", 9))
+        self.transport_dropdown.place(x=90, y=445, width=105)
+
+        self.jitter_label = tk.Label(root, text="Jitter (ms):", font=("Arial", 9))
+        self.jitter_label.place(x=215, y=447)
+        self.jitter_spinbox = tk.Spinbox(root, from_=JITTER_MIN_MS, to=JITTER_MAX_MS, increment=5, font=("Arial", 9))
+        self.jitter_spinbox.delete(0, tk.END)
+        self.jitter_spinbox.insert(0, JITTER_TARGET_MS)
+        self.jitter_spinbox.place(x=290, y=446, width=55)
+
+        # Mixing mode takes several senders at once (TCP only, one connection each)
+        self.mix_var = tk.BooleanVar(value=False)
+        self.mix_checkbox = tk.Checkbutton(root, text="Mix senders", variable=self.mix_var, font=("Arial", 9))
+        self.mix_checkbox.place(x=16, y=475)
+        self.mixer_button = tk.Button(root, text="Mixer...", command=self.open_mixer_window, font=("Arial", 9), width=8)
+        self.mixer_button.place(x=120, y=474)
+
+        # Decode and play inside the app with a bounded buffer instead of ffplay, held at the given latency
+        self.playback_var = tk.BooleanVar(value=False)
+        self.playback_checkbox = tk.Checkbutton(root, text="Low latency", variable=self.playback_var,
+                                                font=("Arial", 9))
+        self.playback_checkbox.place(x=205, y=475)
+        self.latency_spinbox = tk.Spinbox(root, from_=PLAYBACK_TARGET_MIN_MS, to=PLAYBACK_TARGET_MAX_MS, increment=5,
+                                          font=("Arial", 9))
+        self.latency_spinbox.delete(0, tk.END)
+        self.latency_spinbox.insert(0, PLAYBACK_TARGET_MS)
+        self.latency_spinbox.place(x=300, y=476, width=45)
+        tk.Label(root, text="ms", font=("Arial", 9)).place(x=348, y=477)
+
+        self.ip_label = tk.Label(root, text="Local IP: ...")
+        self.ip_label.place(x=125, y=508)
 
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
-        self.monitor_thread = threading.Thread(target=self.monitor_audio_device_changes, daemon=True)
-        self.monitor_thread.start()
-        
+        # Worker threads never touch Tk: they post events here and the UI thread drains them on one timer
+        self.ui_bus = UiBus(self.root)
+        self.ui_bus.subscribe(EVENT_STATUS, self.update_status)
+        self.ui_bus.subscribe(EVENT_ERROR, self.show_error)
+        self.ui_bus.subscribe(EVENT_STOPPED, self.on_receiver_stopped)
+        self.ui_bus.subscribe(EVENT_METRICS, self.show_telemetry, latest_only=True)
+        self.ui_bus.subscribe(EVENT_MIXER, self.show_mixer, latest_only=True)
+        self.ui_bus.subscribe(EVENT_VOLUME, self.show_volume_state)
+        self.ui_bus.subscribe(EVENT_PLAYBACK_ENDED, self.on_playback_ended)
+        self.ui_bus.start()
+
+        # Answer the streamers' discovery probes with our name, codecs and load
+        self.beacon = None
+        self.start_beacon()
+
         # Show window now that all elements are positioned
         self.root.deiconify()
+        startup_trace.mark("first window")
+        self.start_background_init()
+
+    def start_background_init(self):
+        # The slow parts of startup finish after the window is up; results come back on the UI thread
+        self.background_init = BackgroundInit(startup_trace, self.ui_bus.call)
+        self.background_init.submit("audio modules", import_audio_modules, self.bind_audio_device)
+        self.background_init.submit("binaries", check_binaries)
+        self.background_init.submit("local ip", self.get_local_ip, self.show_local_ip)
+
+    def show_local_ip(self, ip):
+        self.local_ip = ip or '127.0.0.1'
+        self.ip_label.config(text=f"Local IP: {self.local_ip}")
+
+    def bind_audio_device(self, _):
+        with startup_trace.phase("audio device"):
+            from comtypes import CoInitialize
+            CoInitialize()  # comtypes was imported, and COM initialised, on a worker thread
+        # Volume and mute COM calls are made by the worker, never on the Tk thread
+        self.volume_worker = VolumeWorker(self.open_speakers_endpoint,
+                                          on_state=lambda state: self.ui_bus.post(EVENT_VOLUME, state))
+        self.volume_worker.start()
+        # Windows tells us when the default speakers change, nothing polls in between
+        self.device_watcher = DeviceWatcher(self.on_audio_device_event)
+        try:
+            self.device_watcher.start()
+        except Exception as e:
+            logging.error(f"Could not watch for audio device changes: {e}")
 
     def style_button(self, button, normal_color, hover_color, font):
         """Apply a consistent raised style with readable disabled text."""
@@ -273,59 +359,78 @@ class FFplayGUI:
         button.bind("<ButtonPress-1>", on_press)
         button.bind("<ButtonRelease-1>", on_release)
 
-    def update_volume_control(self):
+    def open_speakers_endpoint(self):
+        # Called on the volume worker's thread, so the endpoint lives in its COM apartment
+        import comtypes
+        from ctypes import POINTER, cast
+        from pycaw.pycaw import AudioUtilities, IAudioEndpointVolume
         # Support both legacy and newer pycaw AudioDevice APIs.
         devices = AudioUtilities.GetSpeakers()
+        self.speakers_id = getattr(devices, "id", None) or devices.GetId()
         endpoint_volume = getattr(devices, "EndpointVolume", None)
         if endpoint_volume is not None:
-            self.volume = endpoint_volume
-            return
+            return endpoint_volume
 
         interface = devices.Activate(
             IAudioEndpointVolume._iid_, comtypes.CLSCTX_INPROC_SERVER, None)
-        self.volume = cast(interface, POINTER(IAudioEndpointVolume))
+        return cast(interface, POINTER(IAudioEndpointVolume))
 
-    def monitor_audio_device_changes(self):
-        CoInitialize()
-        try:
-            # Get the ID once at the start
-            devices = AudioUtilities.GetSpeakers()
-            current_device = devices.GetId()
-            
-            while self.running:
-                # Instead of re-querying the whole object, 
-                # let's just wait longer between checks.
-                time.sleep(5)  # 5 seconds is plenty for hardware monitoring
-                
-                try:
-                    # Re-check the ID
-                    new_device = AudioUtilities.GetSpeakers().GetId()
-                    if new_device != current_device:
-                        logging.info(f"Audio device changed to: {new_device}")
-                        current_device = new_device
-                        self.update_volume_control()
-                        self.root.after(0, lambda: self.volume_slider.set(self.get_current_volume()))
-                        self.root.after(0, lambda: self.mute_button.config(text="🔊" if not self.is_muted else "🔇", 
-                                               bg="lightgreen" if not self.is_muted else "lightcoral"))
-                except Exception as e:
-                    # If a device is unplugged, GetSpeakers() might throw an error
-                    # We catch it here so the thread doesn't die.
-                    logging.error(f"Monitoring error: {e}")
-                    
-        finally:
-            CoUninitialize()
+    def on_audio_device_event(self, event):
+        # Called on a COM worker thread. Bursts (one event per role, state and default
+        # change for a single plug-in) are folded into one rebind by the volume worker.
+        if event.kind != EVENT_DEFAULT_CHANGED and event.device_id != self.speakers_id:
+            return
+        if self.volume_worker and self.running:
+            self.volume_worker.rebind()
+
+    def show_volume_state(self, state):
+        # What Windows reported after the volume worker's last calls
+        if state is None or not self.root.winfo_exists():
+            return  # The old device is gone and no new default has been picked yet; the next event retries
+        if state['rebound']:
+            logging.info(f"Using audio device: {self.speakers_id}")
+            self.volume_slider.set(round(state['volume'] * 100))
+        if state['muted'] != self.is_muted:
+            self.show_mute_state(state['muted'])
 
     def start_monitoring(self):
-        # Simplified monitoring - no bitrate display needed
+        # Samples the transport's counters once a second on its own thread
         self.start_button.config(state=tk.DISABLED)
         self.stop_button.config(state=tk.NORMAL)
+        self.stop_monitoring()
+        self.telemetry = Telemetry(self.transport_counters, logger=metrics_logger(metrics_log_path),
+                                   on_sample=lambda sample: self.ui_bus.post(EVENT_METRICS, sample))
+        self.telemetry.start()
         logging.info("Stream monitoring started")
 
     def stop_monitoring(self):
-        # Clean monitoring stop
-        logging.info("Stream monitoring stopped")
+        telemetry, self.telemetry = self.telemetry, None
+        if telemetry:
+            telemetry.stop()
+            logging.info("Stream monitoring stopped")
 
-    # Removed update_bitrate_label method - no longer needed
+    def transport_counters(self):
+        receiver = self.receiver
+        return receiver.counters() if receiver else idle_counters()
+
+    def show_telemetry(self, sample):
+        if not self.root.winfo_exists() or self.telemetry is None:
+            return
+        if not sample['connected']:
+            self.telemetry_label.config(text="")
+            return
+        buffer = f" · {sample['buffer_ms']:.0f} ms buffered" if sample['buffer_ms'] is not None else ""
+        drift = f" · {sample['drift_ppm']:+d} ppm" if sample.get('drift_ppm') is not None else ""
+        text = f"{sample['kbps']:.0f} kbps · {sample['packets_per_s']:.0f} pkt/s{buffer}{drift}"
+        if sample['health'] != HEALTH_GOOD and sample['reason']:
+            text = sample['reason']
+        self.telemetry_label.config(text=text)
+        # The indicator follows the measured health while a sender is connected, Muted keeps its own color
+        if self.connection_status == "connected":
+            fill, outline = {HEALTH_GOOD: ("#4CAF50", "#2E7D32"),
+                             HEALTH_DEGRADED: ("#ffc107", "#e6a100"),
+                             HEALTH_BAD: ("#f44336", "#d32f2f")}.get(sample['health'], ("#ffc107", "#e6a100"))
+            self.health_canvas.itemconfig(self.health_indicator, fill=fill, outline=outline)
 
     def get_local_ip(self):
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -339,217 +444,185 @@ class FFplayGUI:
             s.close()
         return ip
 
-    def get_current_volume(self):
-        if self.volume:
-            current_volume = self.volume.GetMasterVolumeLevelScalar()
-            return int(current_volume * 100)
-        return 0
+    def start_beacon(self):
+        try:
+            self.beacon = Beacon(socket.gethostname(), DEFAULT_PORT, list(CODECS), self.transport_mode,
+                                 load=self.beacon_load).start()
+        except OSError as e:
+            logging.warning(f"Streamers won't find this receiver on the network: {e}")
+
+    def beacon_load(self):
+        # Called on the beacon thread, so only attributes are read, no widgets
+        receiver = self.receiver
+        return receiver.load() if receiver else {'state': 'idle', 'senders': 0}
+
+    def read_transport_settings(self):
+        # Read the Tk widgets here, on the UI thread, before the receiver thread starts
+        selected = self.transport_var.get()
+        self.transport_mode = next((mode for mode, label in TRANSPORTS.items() if label == selected), TRANSPORT_TCP)
+        try:
+            target = int(self.jitter_spinbox.get())
+        except ValueError:
+            target = JITTER_TARGET_MS
+        self.jitter_target_ms = max(JITTER_MIN_MS, min(target, JITTER_MAX_MS))
+        self.mix_mode = self.mix_var.get()
+        self.in_process_playback = self.playback_var.get()
+        try:
+            target = int(self.latency_spinbox.get())
+        except ValueError:
+            target = PLAYBACK_TARGET_MS
+        self.playback_target_ms = max(PLAYBACK_TARGET_MIN_MS, min(target, PLAYBACK_TARGET_MAX_MS))
+        if self.mix_mode and self.transport_mode != TRANSPORT_TCP:
+            logging.warning("Mixing needs one TCP connection per sender, using TCP")
+            self.transport_mode = TRANSPORT_TCP
+        if self.beacon:
+            self.beacon.transport = self.transport_mode  # Announced to streamers from now on
+        self.transport_dropdown.config(state=tk.DISABLED)
+        self.jitter_spinbox.config(state=tk.DISABLED)
+        self.mix_checkbox.config(state=tk.DISABLED)
+        self.playback_checkbox.config(state=tk.DISABLED)
+        self.latency_spinbox.config(state=tk.DISABLED)
+
+    def on_receiver_state(self, receiver, state, detail):
+        # Called on the receiver's threads
+        if state == RECEIVER_WAITING:
+            self.ui_bus.post(EVENT_STATUS, "Waiting for sender", "#e6a100")
+        elif state == RECEIVER_RECEIVING:
+            if receiver.mix:
+                self.ui_bus.post(EVENT_STATUS, f"Receiving {detail} Sender{'s' if detail > 1 else ''}", "green")
+            elif self.is_recording_mode:
+                self.ui_bus.post(EVENT_STATUS, "Receiving & Recording", "orange")
+            else:
+                self.ui_bus.post(EVENT_STATUS, "Receiving Stream", "green")
+        elif state == RECEIVER_ERROR:
+            self.stop_monitoring()
+            self.ui_bus.post(EVENT_ERROR, detail)
+        elif state == RECEIVER_IDLE:
+            self.stop_monitoring()
+            self.ui_bus.post(EVENT_STOPPED, receiver, receiver.recording_store is not None)
+
+    def open_mixer_window(self):
+        if self.mixer_window is not None and self.mixer_window.winfo_exists():
+            self.mixer_window.lift()
+            return
+        self.mixer_window = tk.Toplevel(self.root)
+        self.mixer_window.title("Mixer")
+        self.mixer_window.geometry("380x230")
+        self.mixer_rows = {}
+        self.mixer_layout = None
+        # Shown once now; from then on the mixer posts its levels to the bus
+        mixer = self.receiver.mixer() if self.receiver else None
+        self.show_mixer(mixer, mixer.snapshot() if mixer else [])
+
+    def build_mixer_rows(self, mixer, sources):
+        from audio_mixer import MAX_GAIN
+        for child in self.mixer_window.winfo_children():
+            child.destroy()
+        self.mixer_rows = {}
+        if not sources:
+            text = "No senders connected" if mixer else "Start receiving with \"Mix senders\" checked"
+            tk.Label(self.mixer_window, text=text, font=("Arial", 9)).pack(pady=20)
+            return
+        for row, source in enumerate(sources):
+            name = source['name']
+            tk.Label(self.mixer_window, text=name, font=("Arial", 9), width=14, anchor="w").grid(row=row, column=0, padx=5, pady=4)
+            gain = tk.Scale(self.mixer_window, from_=0, to=int(MAX_GAIN * 100), orient=tk.HORIZONTAL, length=110,
+                            showvalue=False, command=lambda value, name=name: mixer.set_gain(name, int(value) / 100))
+            gain.set(int(source['gain'] * 100))
+            gain.grid(row=row, column=1)
+            meter = tk.Canvas(self.mixer_window, width=100, height=10, bg="#333333", highlightthickness=0)
+            meter.grid(row=row, column=2, padx=5)
+            bar = meter.create_rectangle(0, 0, 0, 10, fill="#4CAF50", width=0)
+            info = tk.Label(self.mixer_window, font=("Arial", 8), fg="#555555")
+            info.grid(row=row, column=3, sticky="w")
+            self.mixer_rows[name] = (meter, bar, info)
+
+    def show_mixer(self, mixer, sources):
+        from audio_mixer import LEVEL_FLOOR_DB
+        if self.mixer_window is None or not self.mixer_window.winfo_exists():
+            self.mixer_window = None
+            return
+        # Levels still queued from a receiver that has stopped since
+        if mixer is not None and (self.receiver is None or mixer is not self.receiver.mixer()):
+            return
+        layout = (mixer is not None, [source['name'] for source in sources])
+        if layout != self.mixer_layout:
+            self.mixer_layout = layout
+            self.build_mixer_rows(mixer, sources)
+        for source in sources:
+            meter, bar, info = self.mixer_rows[source['name']]
+            width = 100 * (source['level_db'] - LEVEL_FLOOR_DB) / -LEVEL_FLOOR_DB
+            color = "#f44336" if source['peak_db'] > -1 else "#ff9800" if source['peak_db'] > -6 else "#4CAF50"
+            meter.coords(bar, 0, 0, width, 10)
+            meter.itemconfig(bar, fill=color)
+            info.config(text=f"{source['buffer_ms']:.0f} ms {source['drift_ppm']:+d} ppm")
 
     def start_stream(self):
-        logging.info("Starting TCP stream reception...")
-        if self.process is None:
-            self.is_recording_mode = False
-            self.stream_thread = threading.Thread(target=self.run_receiver, daemon=True)
-            self.stream_thread.start()
-            self.start_button.config(state=tk.DISABLED)
-            self.stop_button.config(state=tk.NORMAL)
-            self.record_button.config(state=tk.DISABLED)
-            self.update_status("Receiving Stream", "green")
-            self.start_monitoring()
-            logging.info("TCP stream reception started successfully")
+        logging.info("Starting stream reception...")
+        self.start_receiver(recording=False)
 
     def start_recording(self):
-        logging.info("Starting TCP stream reception with recording...")
-        if self.process is None:
-            self.is_recording_mode = True
-            self.stream_thread = threading.Thread(target=self.run_receiver, daemon=True)
-            self.stream_thread.start()
-            self.start_button.config(state=tk.DISABLED)
-            self.stop_button.config(state=tk.NORMAL)
-            self.record_button.config(state=tk.DISABLED)
-            self.update_status("Receiving & Recording", "orange")
-            self.start_monitoring()
-            logging.info("TCP stream reception with recording started successfully")
-
-    def run_receiver(self):
-        if self.is_recording_mode:
-            logging.info("Starting ffmpeg TCP listener with recording on port 6005...")
-        else:
-            logging.info("Starting ffplay TCP listener on port 6005...")
-        
-        # Determine which executable and command to use
-        if self.is_recording_mode:
-            # Use ffmpeg with tee muxer for simultaneous playback and recording
-            if not ffmpeg_path.exists():
-                logging.error(f"ffmpeg.exe not found at {ffmpeg_path}")
-                self.root.after(0, self.update_button_states)
-                self.root.after(0, self.update_status, "Error: ffmpeg not found", "red")
-                return
-                
-            exe_path = str(ffmpeg_path.resolve())
-            logging.info(f"Using ffmpeg executable for recording at: {exe_path}")
-            
-            # FFmpeg command with dual output for Windows (DirectSound speakers + MP3 file)
-            cmd = [
-                exe_path,
-                '-hide_banner', '-loglevel', 'error',
-                '-f', 'mpegts',
-                '-i', 'tcp://0.0.0.0:6005?listen=1&tcp_nodelay=1',
-                # Output 1: To speakers via DirectSound
-                '-f', 'wav', '-acodec', 'pcm_s16le', 'pipe:1',
-                # Output 2: To MP3 file 
-                '-c:a', 'libmp3lame', '-b:a', '192k', str(self.recording_filename)
-            ]
-        else:
-            # Use ffplay for playback only (existing logic)
-            if not ffplay_path.exists():
-                logging.error(f"ffplay.exe not found at {ffplay_path}")
-                self.root.after(0, self.update_button_states)
-                self.root.after(0, self.update_status, "Error: ffplay not found", "red")
-                return
-                
-            exe_path = str(ffplay_path.resolve())
-            logging.info(f"Using ffplay executable at: {exe_path}")
-            
-            # Optimized ffplay command for low-latency TCP streaming
-            cmd = [
-                exe_path,
-                '-nodisp', 
-                '-autoexit',
-                '-loglevel', 'quiet',     # Silence all console output
-                '-nostats',               # Disable progress printouts in the pipe
-                '-fflags', 'nobuffer+fastseek', 
-                '-flags', 'low_delay', 
-                '-strict', 'experimental',
-                '-infbuf',
-                '-probesize', '32',
-                '-analyzeduration', '0', 
-                '-af', 'aresample=async=1',
-                '-f', 'mpegts', 
-                'tcp://0.0.0.0:6005?listen=1&tcp_nodelay=1'
-            ]
-        
-        logging.info(f"Command: {' '.join(cmd)}")
-        
-        try:
-            if self.is_recording_mode:
-                # For recording mode, ffmpeg outputs to both speakers and file
-                audio_cmd = [str(ffplay_path.resolve()), '-nodisp', '-autoexit', '-f', 'wav', '-i', 'pipe:0']
-                
-                # Start ffmpeg process with dual outputs
-                self.process = subprocess.Popen(
-                    cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.DEVNULL,
-                    creationflags=0x08000000 | 0x00000008  # Combine No Window and Detached Process
-                )
-                
-                # Start ffplay to handle the piped audio for speakers
-                self.audio_process = subprocess.Popen(
-                    audio_cmd,
-                    stdin=self.process.stdout,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
-                    creationflags=0x08000000 | 0x00000008  # Combine No Window and Detached Process
-                )
-                
-                # Close the stdout pipe in parent to avoid deadlock
-                self.process.stdout.close()
-                
-                logging.info("ffmpeg TCP listener active on port 6005 with recording...")
-                # Wait for ffmpeg process (it will handle both outputs)
-                self.process.wait()
-            else:
-                # Standard ffplay process for playback only
-                self.process = subprocess.Popen(
-                    cmd,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
-                    creationflags=0x08000000 | 0x00000008  # Combine No Window and Detached Process
-                )
-                logging.info("ffplay TCP listener active on port 6005, waiting for connections...")
-                # Wait for process completion
-                self.process.wait()
-            
-        except Exception as e:
-            logging.error(f"Failed to start TCP listener: {str(e)}")
-        finally:
-            logging.info("TCP listener stopped")
-            # Cleanup any remaining processes
-            if hasattr(self, 'audio_process') and self.audio_process:
-                try:
-                    self.audio_process.terminate()
-                    self.audio_process.wait(timeout=2)
-                except:
-                    try:
-                        self.audio_process.kill()
-                    except:
-                        pass
-                self.audio_process = None
-            
-            self.process = None
-            if self.root.winfo_exists():
-                self.root.after(0, self.update_button_states)
-                self.root.after(0, self.update_status, "Idle", "blue")
-                if self.is_recording_mode:
-                    self.root.after(0, self.update_play_button_state)
+        logging.info("Starting stream reception with recording...")
+        self.start_receiver(recording=True)
+
+    def start_receiver(self, recording):
+        if self.receiver is not None:
+            return
+        self.read_transport_settings()
+        self.is_recording_mode = recording
+        # Everything from the port to ffplay runs on the engine's own threads
+        self.receiver = ReceiverEngine(
+            str(ffmpeg_path.resolve()), str(ffplay_path.resolve()), DEFAULT_PORT, self.transport_mode,
+            self.jitter_target_ms, self.mix_mode, OUTPUT_DEVICE if self.in_process_playback else OUTPUT_FFPLAY,
+            self.playback_target_ms, self.recording_store if recording else None,
+            on_state=self.on_receiver_state,
+            on_mix=lambda mixer, sources: self.ui_bus.post(EVENT_MIXER, mixer, sources))
+        self.start_monitoring()
+        self.receiver.start()
+        self.start_button.config(state=tk.DISABLED)
+        self.stop_button.config(state=tk.NORMAL)
+        self.record_button.config(state=tk.DISABLED)
+        self.update_status("Waiting for sender", "#e6a100")
+        logging.info("Stream reception started successfully")
+
+    def on_receiver_stopped(self, receiver, recorded):
+        # A receiver that was already replaced by a newer one has nothing left to say
+        if receiver is not self.receiver:
+            return
+        self.receiver = None
+        self.show_mixer(None, [])
+        self.update_button_states()
+        self.update_status("Idle", "blue")
+        if recorded:
+            self.update_play_button_state()
+
+    def show_error(self, text):
+        # Only a receiver that could not start reports an error, and it has stopped again
+        if self.receiver is not None and self.receiver.state == RECEIVER_ERROR:
+            self.receiver = None
+            self.show_mixer(None, [])
+        self.update_button_states()
+        self.update_status(f"Error: {text}", "red")
 
     def stop_stream(self):
-        if self.process:
-            def terminate_process_thread():
-                try:
-                    # Terminate both processes if in recording mode
-                    if hasattr(self, 'audio_process') and self.audio_process:
-                        try:
-                            self.audio_process.terminate()
-                            self.audio_process.wait(timeout=2)
-                        except:
-                            try:
-                                self.audio_process.kill()
-                            except:
-                                pass
-                        self.audio_process = None
-                    
-                    # Terminate main process
-                    if platform.system() == "Windows":
-                        self.process.terminate()
-                        try:
-                            self.process.wait(timeout=3)
-                        except subprocess.TimeoutExpired:
-                            self.process.kill()
-                    else:
-                        os.killpg(os.getpgid(self.process.pid), signal.SIGTERM)
-                    
-                    terminate_process("ffprobe")  # Cleanup any ffprobe processes
-                except Exception as e:
-                    logging.error(f"Error terminating stream process: {e}")
-                finally:
-                    self.process = None
-                    self.update_stop_stream_ui()
-                    self.stop_monitoring()
-
-            terminate_thread = threading.Thread(target=terminate_process_thread, daemon=True)
-            terminate_thread.start()
+        receiver = self.receiver
+        if receiver:
+            # Waits for ffplay and the recording file, so not on the UI thread;
+            # the receiver reports back through on_receiver_state when it is done
+            threading.Thread(target=receiver.stop, daemon=True).start()
         else:
             self.update_stop_stream_ui()
             self.stop_monitoring()
+
     def update_stop_stream_ui(self):
         self.update_button_states()
         self.update_status("Idle", "blue")
 
-    def terminate_process(self, process):
-        if process:
-            try:
-                if platform.system() == "Windows":
-                    process.terminate()
-                else:
-                    os.killpg(os.getpgid(process.pid), signal.SIGTERM)
-            except Exception as e:
-                logging.error(f"Error terminating process: {e}")
-
     def set_volume(self, value):
-        volume_level = int(value) / 100.0
-        self.volume.SetMasterVolumeLevelScalar(volume_level, None)
+        if self.volume_worker is None:
+            return  # Not bound yet
+        # Only the latest value is applied if the slider moves faster than COM keeps up
+        self.volume_worker.set_volume(int(value) / 100.0)
 
     def on_mouse_wheel(self, event):
         if event.num == 4 or event.delta > 0:
@@ -558,27 +631,32 @@ class FFplayGUI:
             self.volume_slider.set(self.volume_slider.get() - 1)
 
     def mute(self, event=None):
-        if self.volume.GetMute() == 0:
-            self.volume.SetMute(1, None)
+        if self.volume_worker is None:
+            return
+        # Shown right away; the worker applies it and reports back if Windows disagrees
+        self.volume_worker.set_muted(not self.is_muted)
+        self.show_mute_state(not self.is_muted)
+        if self.is_muted:
+            self.update_status("Muted", "red")
+        elif self.receiver is not None:
+            self.update_status("Receiving Stream", "green")
+        else:
+            self.update_status("Idle", "blue")
+
+    def show_mute_state(self, muted):
+        self.is_muted = muted
+        if muted:
             self.mute_button.config(text="🔇", bg="lightcoral")
-            self.is_muted = True
             # Change volume slider trough to red when muted
             self.volume_slider.config(troughcolor="#ffcccb")
             # Update hover effect for muted state
             self.add_hover(self.mute_button, "#DC143C", "lightcoral")  # Much more vibrant crimson for hover
-            self.update_status("Muted", "red")
         else:
-            self.volume.SetMute(0, None)
             self.mute_button.config(text="🔊", bg="lightgreen")
-            self.is_muted = False
             # Restore normal volume slider color
             self.volume_slider.config(troughcolor="#d0d0d0")
             # Update hover effect for unmuted state  
             self.add_hover(self.mute_button, "#32CD32", "lightgreen")  # Much more vibrant lime green for hover
-            if self.process is not None:
-                self.update_status("Receiving Stream", "green")
-            else:
-                self.update_status("Idle", "blue")
 
     def update_status(self, text, color):
         if self.root.winfo_exists():
@@ -587,12 +665,19 @@ class FFplayGUI:
             if text == "Idle":
                 self.connection_status = "idle"
                 self.health_canvas.itemconfig(self.health_indicator, fill="#cccccc", outline="#999999")
+                self.telemetry_label.config(text="")
             elif "Receiving" in text:
+                # Green, amber or red comes from the telemetry, see show_telemetry
                 self.connection_status = "connected"
-                self.health_canvas.itemconfig(self.health_indicator, fill="#4CAF50", outline="#2E7D32")
+                if self.telemetry and self.telemetry.latest:
+                    self.show_telemetry(self.telemetry.latest)
             elif "Error" in text:
                 self.connection_status = "error"
                 self.health_canvas.itemconfig(self.health_indicator, fill="#f44336", outline="#d32f2f")
+                self.telemetry_label.config(text="")
+            elif "Waiting" in text:
+                self.connection_status = "waiting"
+                self.health_canvas.itemconfig(self.health_indicator, fill="#ffc107", outline="#e6a100")
             elif "Muted" in text:
                 self.connection_status = "muted"
                 self.health_canvas.itemconfig(self.health_indicator, fill="#ff9800", outline="#f57c00")
@@ -601,7 +686,12 @@ class FFplayGUI:
     def update_button_states(self):
         if self.root.winfo_exists():
             # Update buttons based on process state with explicit colors for better readability
-            if self.process is None:
+            if self.receiver is None:
+                self.transport_dropdown.config(state="readonly")
+                self.jitter_spinbox.config(state=tk.NORMAL)
+                self.mix_checkbox.config(state=tk.NORMAL)
+                self.playback_checkbox.config(state=tk.NORMAL)
+                self.latency_spinbox.config(state=tk.NORMAL)
                 self.start_button.config(state=tk.NORMAL, fg="white", font=("Arial", 10, "bold"))
                 self.stop_button.config(state=tk.DISABLED, fg="#111111", disabledforeground="#111111", font=("Arial", 10, "bold"))
                 self.record_button.config(state=tk.NORMAL, fg="white", font=("Arial", 10, "bold"))
@@ -611,51 +701,63 @@ class FFplayGUI:
                 self.record_button.config(state=tk.DISABLED, fg="#111111", disabledforeground="#111111", font=("Arial", 10, "bold"))
 
     def update_play_button_state(self):
-        if os.path.exists(self.recording_filename):
+        if self.recording_store.entries:
             self.play_button.config(state=tk.NORMAL)
         else:
             self.play_button.config(state=tk.DISABLED)
         # Always keep stop button disabled when not playing
         self.stop_play_button.config(state=tk.DISABLED)
 
-    def check_playback_status(self):
-        # Check if the process is still running
-        if self.play_process and self.play_process.poll() is None:
-            self.play_button.after(1000, self.check_playback_status)
-        else:
-            # If the process has finished, reset the button states
-            self.play_button.config(state=tk.NORMAL)
-            self.stop_play_button.config(state=tk.DISABLED)
-            self.play_process = None
+    def wait_for_playback(self, process):
+        # On its own thread, so nothing polls ffplay while it plays
+        process.wait()
+        self.ui_bus.post(EVENT_PLAYBACK_ENDED, process)
+
+    def on_playback_ended(self, process):
+        # A playback that was stopped, or replaced by a newer one, has already reset the buttons
+        if process is not self.play_process:
+            return
+        self.play_button.config(state=tk.NORMAL)
+        self.stop_play_button.config(state=tk.DISABLED)
+        self.play_process = None
 
     def play_recording(self):
-        # Start playing the recording
-        if os.path.exists(self.recording_filename):
-            self.play_process = subprocess.Popen([str(ffplay_path), '-nodisp', '-autoexit', '-loglevel', 'quiet', str(self.recording_filename)],
-                                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                                 creationflags=0x08000000 | 0x00000008)
-            # Update button states
-            self.play_button.config(state=tk.DISABLED)
-            self.stop_play_button.config(state=tk.NORMAL)
-            # Start monitoring playback
-            self.play_button.after(1000, self.check_playback_status)
+        # Play the recordings from a chosen time, by default from the start of the last session
+        start = self.recording_store.last_session_start()
+        if start is None:
+            return
+        answer = simpledialog.askstring("Play Recording", "Play from (YYYY-MM-DD HH:MM:SS):", parent=self.root,
+                                        initialvalue=datetime.fromtimestamp(start).strftime("%Y-%m-%d %H:%M:%S"))
+        if not answer:
+            return
+        try:
+            when = datetime.strptime(answer.strip(), "%Y-%m-%d %H:%M:%S").timestamp()
+        except ValueError:
+            messagebox.showerror("Play Recording", f"Not a valid time: {answer}")
+            return
+        playlist = self.recording_store.write_playlist(when)
+        if playlist is None:
+            messagebox.showinfo("Play Recording", "Nothing was recorded at or after that time.")
+            return
+        logging.info(f"Playing recordings from {answer}")
+        self.play_process = spawn([str(ffplay_path), '-nodisp', '-autoexit', '-loglevel', 'quiet',
+                                   '-f', 'concat', '-safe', '0', playlist], "ffplay playback",
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                  creationflags=0x08000000 | 0x00000008)
+        # Update button states
+        self.play_button.config(state=tk.DISABLED)
+        self.stop_play_button.config(state=tk.NORMAL)
+        # The buttons are reset when ffplay exits
+        threading.Thread(target=self.wait_for_playback, args=(self.play_process,), daemon=True).start()
     
     def stop_playing(self):
         # Stop playing the recording
         if self.play_process:
-            try:
-                self.play_process.terminate()
-                self.play_process.wait(timeout=2)
-            except:
-                try:
-                    self.play_process.kill()
-                except:
-                    pass
-            finally:
-                self.play_process = None
-                # Update button states
-                self.play_button.config(state=tk.NORMAL)
-                self.stop_play_button.config(state=tk.DISABLED)
+            process, self.play_process = self.play_process, None
+            default_supervisor().stop(process)
+            # Update button states
+            self.play_button.config(state=tk.NORMAL)
+            self.stop_play_button.config(state=tk.DISABLED)
 
     def on_closing(self):
         try:
@@ -663,19 +765,26 @@ class FFplayGUI:
             
             # Stop the monitoring loop flag
             self.running = False 
+            self.ui_bus.stop()
+            if self.beacon:
+                self.beacon.stop()
+            if self.device_watcher:
+                self.device_watcher.stop()
+            if self.volume_worker:
+                # Waits for the worker to release the endpoint and uninitialize COM
+                self.volume_worker.stop(timeout=0.5)
+            if self.receiver:
+                # Finishes the recording file; ffplay is stopped with the rest below
+                self.receiver.stop(timeout=1)
             
-            # Clean up FFmpeg/FFplay
-            if platform.system() == "Windows":
-                subprocess.run(['taskkill', '/F', '/IM', 'ffmpeg.exe', '/T'], creationflags=0x08000000 | 0x00000008)
-                subprocess.run(['taskkill', '/F', '/IM', 'ffplay.exe', '/T'], creationflags=0x08000000 | 0x00000008)
-                
-            # Give COM 200ms to uninitialize properly
-            time.sleep(0.2) 
+            # Stop the ffplay/ffmpeg processes this app started, and only those, all at once
+            default_supervisor().shutdown()
             
         except Exception as e:
             logging.error(f"Error during fast shutdown: {e}")
         finally:
             self.root.destroy()
+            stop_logging()  # os._exit skips atexit, so write out what is still queued
             os._exit(0)
 
 if __name__ == "__main__":
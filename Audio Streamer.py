@@ -1,3 +1,4 @@
+from startup import BackgroundInit, StartupTrace
 import sys
 from pathlib import Path
 import tkinter as tk
@@ -6,14 +7,27 @@ import subprocess
 import platform
 import logging
 import socket
-import threading
-import json
 import os
+import threading
+import time
 import ctypes
-from ctypes import POINTER, cast
-import comtypes
-from pycaw.pycaw import AudioUtilities, IAudioEndpointVolume
 from datetime import datetime
+from stream_transport import TRANSPORTS, TRANSPORT_TCP, TRANSPORT_MULTICAST, MULTICAST_GROUP
+from stream_format import CODECS, DEFAULT_CODEC, codec_for_label
+from capture import (CAPTURE_FFMPEG, CAPTURE_MODES, CAPTURE_PERIOD_MS, CAPTURE_PERIOD_MIN_MS, CAPTURE_PERIOD_MAX_MS,
+                     capture_available)
+from device_watcher import DeviceWatcher
+from preflight import PreflightCache, VB_CABLE_CAPTURE
+from playback_device import set_default_playback_with_fallback
+from ui_bus import UiBus, EVENT_STOPPED, EVENT_SESSION
+from log_pipeline import setup_logging
+from process_supervisor import default_supervisor
+from connection_store import ConnectionStore
+from discovery import ReceiverDiscovery, DISCOVERY_REFRESH_S, rank
+from audio_engine import sender_session
+
+startup_trace = StartupTrace("Audio Streamer")
+startup_trace.mark("imports")
 
 # Use _MEIPASS to correctly set the path when bundled with PyInstaller
 if hasattr(sys, '_MEIPASS'):
@@ -35,9 +49,8 @@ log_file_path = appdata_local_path / 'Audio_Streamer.log'
 # Ensure the log file directory exists
 log_file_path.parent.mkdir(parents=True, exist_ok=True)
 
-# Initialize logging correctly to the path in appdata_local_path
-logging.basicConfig(filename=log_file_path, level=logging.DEBUG,
-                    format='%(asctime)s %(levelname)s:%(message)s')
+# Records are written by a background thread and the file is rotated by size, see log_pipeline
+setup_logging(log_file_path, logging.DEBUG, '%(asctime)s %(levelname)s:%(message)s')
 
 logging.debug('Starting App...')
 
@@ -45,46 +58,37 @@ logging.debug('Starting App...')
 ffmpeg_path = script_dir / 'ffmpeg' / 'bin' / 'ffmpeg.exe'
 executable_path = script_dir / 'SetPlayBack' / 'SetPlayBack.exe'
 icon_path = script_dir / 'icon' / 'icons8-stream-64.ico'
-history_file = script_dir / 'ip_history.json'
+history_file = script_dir / 'ip_history.json'  # Where older versions kept the history, imported once
+connections_file = appdata_local_path / 'connections.json'
 vb_cable_dir = script_dir / 'VBCABLE_Driver_Pack43'
 
-# Log path information for debugging
-logging.debug(f"Base path: {script_dir}")
-logging.debug(f"Looking for ffmpeg at: {ffmpeg_path}")
-logging.debug(f"ffmpeg.exe exists: {ffmpeg_path.exists()}")
-logging.debug(f"SetPlayback.exe exists: {executable_path.exists()}")
-
-# Validate critical paths exist
-if not ffmpeg_path.exists():
-    logging.error(f"CRITICAL: ffmpeg.exe not found at {ffmpeg_path}")
-    # Try to find ffmpeg folder structure
-    ffmpeg_dir = script_dir / 'ffmpeg'
-    logging.debug(f"ffmpeg directory exists: {ffmpeg_dir.exists()}")
-    if ffmpeg_dir.exists():
-        bin_dir = ffmpeg_dir / 'bin'
-        logging.debug(f"bin directory exists: {bin_dir.exists()}")
-        if bin_dir.exists():
-            try:
-                bin_contents = list(bin_dir.iterdir())
-                logging.debug(f"Contents of bin directory: {[f.name for f in bin_contents]}")
-            except Exception as e:
-                logging.error(f"Error listing bin directory: {e}")
+
+def check_binaries():
+    # Runs on a startup worker: probing a bundle on a slow or network drive shouldn't hold up the window
+    logging.debug(f"Base path: {script_dir}")
+    logging.debug(f"Looking for ffmpeg at: {ffmpeg_path}")
+    logging.debug(f"ffmpeg.exe exists: {ffmpeg_path.exists()}")
+    logging.debug(f"SetPlayback.exe exists: {executable_path.exists()}")
+    if not ffmpeg_path.exists():
+        logging.error(f"CRITICAL: ffmpeg.exe not found at {ffmpeg_path}")
+        # Try to find ffmpeg folder structure
+        ffmpeg_dir = script_dir / 'ffmpeg'
+        logging.debug(f"ffmpeg directory exists: {ffmpeg_dir.exists()}")
+        if ffmpeg_dir.exists():
+            bin_dir = ffmpeg_dir / 'bin'
+            logging.debug(f"bin directory exists: {bin_dir.exists()}")
+            if bin_dir.exists():
+                try:
+                    bin_contents = list(bin_dir.iterdir())
+                    logging.debug(f"Contents of bin directory: {[f.name for f in bin_contents]}")
+                except Exception as e:
+                    logging.error(f"Error listing bin directory: {e}")
 
 vb_cable_path_x64 = vb_cable_dir / 'VBCABLE_Setup_x64.exe'
 vb_cable_path_x86 = vb_cable_dir / 'VBCABLE_Setup.exe'
 
-# Load IP history
-ip_history = []
-
-def load_ip_history():
-    global ip_history
-    if history_file.exists():
-        with open(history_file, 'r') as file:
-            ip_history = json.load(file)
-
-def save_ip_history():
-    with open(history_file, 'w') as file:
-        json.dump(ip_history, file)
+# Saved receivers with what worked for each of them, see connection_store
+connection_store = ConnectionStore(connections_file, legacy_path=history_file)
 
 # Duplicate _MEIPASS logic removed - already defined above
 
@@ -141,16 +145,11 @@ def install_vb_cable():
         messagebox.showerror("Error", "Failed to install VB-CABLE due to an unexpected error.")
         return False
 
-def delete_ip_history():
-    global ip_history
-    ip_history = []
-    save_ip_history()
-
 class FFMPEGSenderGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("Audio Streamer")
-        self.root.geometry("450x400")
+        self.root.geometry("450x475")
         self.root.resizable(False, False)
         self.primary_button_font = ("Arial", 10, "bold")
         self.secondary_button_font = ("Arial", 9, "bold")
@@ -167,7 +166,7 @@ class FFMPEGSenderGUI:
 
         # Connection Details Section
         connection_frame = tk.LabelFrame(root, text="Connection Details", font=("Arial", 10, "bold"))
-        connection_frame.place(x=20, y=20, width=410, height=90)
+        connection_frame.place(x=20, y=20, width=410, height=150)
 
         self.ip_label = tk.Label(connection_frame, text="Receiver IP:", font=("Arial", 10))
         self.ip_label.place(x=15, y=15)
@@ -179,11 +178,49 @@ class FFMPEGSenderGUI:
         self.name_entry = tk.Entry(connection_frame, font=("Arial", 10))
         self.name_entry.place(x=120, y=43, width=260)
 
+        self.transport_label = tk.Label(connection_frame, text="Transport:", font=("Arial", 10))
+        self.transport_label.place(x=15, y=75)
+        self.transport_var = tk.StringVar(value=TRANSPORTS[TRANSPORT_TCP])
+        self.transport_dropdown = ttk.Combobox(connection_frame, textvariable=self.transport_var, font=("Arial", 9),
+                                               values=list(TRANSPORTS.values()), state="readonly")
+        self.transport_dropdown.place(x=120, y=73, width=110, height=23)
+
+        self.codec_label = tk.Label(connection_frame, text="Codec:", font=("Arial", 10))
+        self.codec_label.place(x=240, y=75)
+        self.codec_var = tk.StringVar(value=CODECS[DEFAULT_CODEC].label)
+        self.codec_dropdown = ttk.Combobox(connection_frame, textvariable=self.codec_var, font=("Arial", 9),
+                                           values=[profile.label for profile in CODECS.values()], state="readonly")
+        self.codec_dropdown.place(x=290, y=73, width=90, height=23)
+
+        self.capture_label = tk.Label(connection_frame, text="Capture:", font=("Arial", 10))
+        self.capture_label.place(x=15, y=105)
+        self.capture_var = tk.StringVar(value=CAPTURE_MODES[CAPTURE_FFMPEG])
+        self.capture_dropdown = ttk.Combobox(connection_frame, textvariable=self.capture_var, font=("Arial", 9),
+                                             values=list(CAPTURE_MODES.values()), state="readonly")
+        self.capture_dropdown.place(x=120, y=103, width=110, height=23)
+        self.capture_dropdown.bind("<<ComboboxSelected>>", lambda event: self.update_capture_period_state())
+
+        # Only Python capture can go below the 50 ms dshow buffer
+        self.capture_period_label = tk.Label(connection_frame, text="Period:", font=("Arial", 10))
+        self.capture_period_label.place(x=240, y=105)
+        self.capture_period_spinbox = tk.Spinbox(connection_frame, from_=CAPTURE_PERIOD_MIN_MS,
+                                                 to=CAPTURE_PERIOD_MAX_MS, increment=1, font=("Arial", 9))
+        self.capture_period_spinbox.delete(0, tk.END)
+        self.capture_period_spinbox.insert(0, CAPTURE_PERIOD_MS)
+        self.capture_period_spinbox.place(x=290, y=104, width=45, height=22)
+        tk.Label(connection_frame, text="ms", font=("Arial", 9)).place(x=338, y=106)
+        self.update_capture_period_state()
+
         # History Management Section
         history_frame = tk.LabelFrame(root, text="Saved Connections", font=("Arial", 10, "bold"))
-        history_frame.place(x=20, y=130, width=410, height=140)
+        history_frame.place(x=20, y=190, width=410, height=140)
 
         tk.Label(history_frame, text="Select:", font=("Arial", 10)).place(x=15, y=15)
+        # Saved receivers plus the ones that answered discovery, see show_connections
+        self.dropdown_entries = {}
+        self.discovered = {}
+        self.discovery = None
+        self.discovery_started = 0.0
         self.ip_var = tk.StringVar()
         self.ip_dropdown = ttk.Combobox(history_frame, textvariable=self.ip_var, font=("Arial", 9), 
                                        postcommand=self.update_ip_dropdown, state="readonly")
@@ -192,20 +229,28 @@ class FFMPEGSenderGUI:
 
         # History management buttons in a row with better spacing
         self.delete_selected_button = tk.Button(history_frame, text="Delete Selected", 
-                                              command=self.delete_selected_ip, width=16, 
+                                              command=self.delete_selected_ip, width=13, 
                                               font=self.secondary_button_font)
         self.style_button(self.delete_selected_button, normal_color="#f0f0f0", hover_color="#e0e0e0", text_color="#111111")
-        self.delete_selected_button.place(x=80, y=80)
+        self.delete_selected_button.place(x=15, y=80)
 
         self.clear_history_button = tk.Button(history_frame, text="Clear All", 
-                                            command=self.clear_ip_history, width=16, 
+                                            command=self.clear_ip_history, width=13, 
                                             font=self.secondary_button_font)
         self.style_button(self.clear_history_button, normal_color="#f0f0f0", hover_color="#e0e0e0", text_color="#111111")
-        self.clear_history_button.place(x=220, y=80)
+        self.clear_history_button.place(x=140, y=80)
+
+        # Extra receivers get the same encoded stream (fan-out)
+        self.extra_targets = []
+        self.targets_button = tk.Button(history_frame, text="Also Send To...", 
+                                      command=self.open_targets_dialog, width=13, 
+                                      font=self.secondary_button_font)
+        self.style_button(self.targets_button, normal_color="#f0f0f0", hover_color="#e0e0e0", text_color="#111111")
+        self.targets_button.place(x=265, y=80)
 
         # Stream Controls Section
         controls_frame = tk.LabelFrame(root, text="Stream Control", font=("Arial", 10, "bold"))
-        controls_frame.place(x=20, y=290, width=410, height=90)
+        controls_frame.place(x=20, y=350, width=410, height=105)
 
         self.start_button = tk.Button(controls_frame, text="Start Stream", command=self.start_stream, 
                                     width=15, height=2, font=self.primary_button_font)
@@ -218,13 +263,41 @@ class FFMPEGSenderGUI:
         self.stop_button.place(x=220, y=10)
         self.stop_button.config(state=tk.DISABLED)
 
-        self.process = None
-        self.output_thread = None
-        self.error_thread = None  
+        self.session_label = tk.Label(controls_frame, text="Not streaming", font=("Arial", 9), fg="#555555")
+        self.session_label.place(x=15, y=60)
+
+        self.session = None
+        # Whether VB-Cable is there and set as the default output, kept until a device changes
+        self.preflight = PreflightCache()
+        self.device_watcher = None
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
-        # Load IP history on startup
-        load_ip_history()
+        # Results from worker threads reach Tk through the bus, never through a Tk call on the worker
+        self.ui_bus = UiBus(self.root)
+        self.ui_bus.subscribe(EVENT_STOPPED, self.on_stream_stopped)
+        self.ui_bus.subscribe(EVENT_SESSION, self.show_session_status, latest_only=True)
+        self.ui_bus.start()
+
+        # Load the saved connections on startup
+        connection_store.load()
+        startup_trace.mark("first window")
+        self.start_background_init()
+
+    def start_background_init(self):
+        # pycaw/COM and the device list are only needed once Start is pressed, so they load behind the window
+        self.background_init = BackgroundInit(startup_trace, self.ui_bus.call)
+        self.background_init.submit("binaries", check_binaries)
+        self.background_init.submit("audio devices", self.preflight.check, self.start_device_watcher)
+        self.start_discovery()
+
+    def start_device_watcher(self, _):
+        from comtypes import CoInitialize
+        CoInitialize()  # comtypes was imported, and COM initialised, on a worker thread
+        self.device_watcher = DeviceWatcher(self.preflight.invalidate)
+        try:
+            self.device_watcher.start()
+        except Exception as e:
+            logging.error('Could not watch for audio device changes: %s', e)
 
     def style_button(self, button, normal_color, hover_color, text_color="white"):
         """Apply consistent visual style and interaction feedback to buttons."""
@@ -265,170 +338,314 @@ class FFMPEGSenderGUI:
         if button["state"] != tk.DISABLED:
             button.config(relief="raised")
 
+    def start_discovery(self):
+        # Receivers on the network answer on the discovery thread and are added to the list one by one
+        if self.discovery is not None and (not self.discovery.done.is_set()
+                                           or time.monotonic() - self.discovery_started < DISCOVERY_REFRESH_S):
+            return
+        self.discovery_started = time.monotonic()
+        self.discovery = ReceiverDiscovery(on_found=lambda receiver: self.ui_bus.call(self.on_receiver_found, receiver),
+                                           on_done=self.on_discovery_done).start()
+
+    def on_receiver_found(self, receiver):
+        known = self.discovered.get(receiver['ip'])
+        if known is None or receiver['rtt_ms'] < known['rtt_ms']:
+            self.discovered[receiver['ip']] = receiver
+            self.show_connections()
+
+    def on_discovery_done(self, receivers):
+        # On the discovery thread, so saving the round trips stays off the UI thread
+        for receiver in receivers:
+            connection_store.record_rtt(receiver['ip'], receiver['rtt_ms'])
+        self.ui_bus.call(self.on_discovery_finished, receivers)
+
+    def on_discovery_finished(self, receivers):
+        # Receivers that didn't answer this round are gone; ranked, so the first per address is the best
+        self.discovered = {}
+        for receiver in receivers:
+            self.discovered.setdefault(receiver['ip'], receiver)
+        self.show_connections()
+
     def update_ip_dropdown(self):
-        self.ip_dropdown['values'] = [f"{name}: {ip}" for ip, name in ip_history]
+        # Also runs when the list is opened, which looks for receivers again
+        self.start_discovery()
+        self.show_connections()
+
+    def show_connections(self):
+        # Receivers found on the network first, fastest idle ones on top, then the other saved ones
+        saved = {entry['ip']: entry for entry in connection_store.entries()}
+        self.dropdown_entries = {}
+        for receiver in rank(self.discovered.values()):
+            ip = receiver['ip']
+            name = saved[ip]['name'] if ip in saved else receiver['name']
+            busy = ", busy" if receiver['load'].get('senders') else ""
+            self.dropdown_entries[f"{name}: {ip} ({receiver['rtt_ms']:.1f} ms{busy})"] = (ip, name)
+        for ip, entry in saved.items():
+            if ip not in self.discovered:
+                self.dropdown_entries[f"{entry['name']}: {ip}"] = (ip, entry['name'])
+        self.ip_dropdown['values'] = list(self.dropdown_entries)
 
     def on_ip_selected(self, event):
-        selected_text = self.ip_dropdown.get()
-        name, ip = selected_text.split(": ")
+        selected = self.dropdown_entries.get(self.ip_dropdown.get())
+        if selected is None:
+            return
+        ip, name = selected
         self.ip_entry.delete(0, tk.END)
         self.ip_entry.insert(0, ip)
         self.name_entry.delete(0, tk.END)
         self.name_entry.insert(0, name)
-
-    def check_audio_device(self, device_name):
-        logging.debug('Checking for audio device: %s', device_name)
-        try:
-            # Get all audio devices
-            devices = AudioUtilities.GetAllDevices()
-            for device in devices:
-                if device.FriendlyName == device_name:
-                    logging.debug('Audio device found: %s', device_name)
-                    return True
-            
-            logging.debug('Audio device not found: %s', device_name)
-            return False
-        except Exception as e:
-            logging.error('Error checking for audio device: %s', e)
+        if not self.apply_preferred_settings(ip) and ip in self.discovered:
+            # Never connected yet: use the transport the receiver says it is listening on
+            transport = self.discovered[ip]['transport']
+            if transport in TRANSPORTS:
+                self.transport_var.set(TRANSPORTS[transport])
+
+    def apply_preferred_settings(self, ip):
+        # Offer the codec and transport that last worked for this receiver
+        settings = connection_store.preferred_settings(ip)
+        if settings is None:
             return False
-
-    def handle_output(self, pipe):
-        for line in iter(pipe.readline, b''):
-            logging.debug('[FFmpeg stdout] %s', line.decode().strip())
-        pipe.close()
-
-    def handle_error(self, pipe):
-        for line in iter(pipe.readline, b''):
-            logging.error('[FFmpeg stderr] %s', line.decode().strip())
-        pipe.close()
+        codec, transport = settings
+        if codec in CODECS:
+            self.codec_var.set(CODECS[codec].label)
+        if transport in TRANSPORTS:
+            self.transport_var.set(TRANSPORTS[transport])
+        logging.debug('Using the last working settings for %s: %s over %s', ip, codec, transport)
+        return True
 
     def add_ip_to_history(self, ip, name):
-        # Check for an existing entry and update it if found
-        for index, (existing_ip, existing_name) in enumerate(ip_history):
-            if existing_ip == ip:
-                ip_history[index] = (ip, name)
-                break
-        else:
-            # Add new entry if not found
-            ip_history.insert(0, (ip, name))
-            if len(ip_history) > 10:
-                ip_history.pop()
-
-        save_ip_history()
+        connection_store.remember(ip, name)
+
+    def open_targets_dialog(self):
+        # Pick saved receivers that get the stream in addition to the one entered above
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Also Send To")
+        dialog.resizable(False, False)
+        dialog.transient(self.root)
+        tk.Label(dialog, text="Send the same stream to these saved receivers too:",
+                 font=("Arial", 9)).pack(anchor="w", padx=10, pady=(10, 5))
+        selected = {}
+        entries = connection_store.entries()
+        for entry in entries:
+            ip = entry['ip']
+            selected[ip] = tk.BooleanVar(value=ip in self.extra_targets)
+            tk.Checkbutton(dialog, text=f"{entry['name']}: {ip}", variable=selected[ip],
+                           font=("Arial", 9)).pack(anchor="w", padx=20)
+        if not entries:
+            tk.Label(dialog, text="No saved connections yet.", font=("Arial", 9), fg="#555555").pack(padx=20)
+
+        def apply():
+            self.extra_targets = [ip for ip, var in selected.items() if var.get()]
+            count = len(self.extra_targets)
+            self.targets_button.config(text=f"Also Send To ({count})" if count else "Also Send To...")
+            dialog.destroy()
+
+        tk.Button(dialog, text="OK", command=apply, width=10).pack(pady=10)
+
+    def get_targets(self, ip_address):
+        if self.get_transport_mode() == TRANSPORT_MULTICAST:
+            # Every receiver listening on the group gets the one stream
+            return [MULTICAST_GROUP]
+        targets = [ip_address]
+        for ip in self.extra_targets:
+            if ip not in targets:
+                targets.append(ip)
+        return targets
 
     def start_stream(self):
         logging.debug('Starting stream...')
 
         # Check if already streaming and stop gracefully
-        if self.process:
+        if self.session:
             self.stop_stream()
 
         ip_address = self.ip_entry.get()
         name = self.name_entry.get()
+        multicast = self.get_transport_mode() == TRANSPORT_MULTICAST
         try:
             socket.inet_aton(ip_address)
         except socket.error:
-            logging.error('Invalid IP address format')
-            messagebox.showerror("Error", "Invalid IP address format.")
-            return
+            if not multicast:
+                logging.error('Invalid IP address format')
+                messagebox.showerror("Error", "Invalid IP address format.")
+                return
+            ip_address = None  # Not needed for multicast
 
-        audio_device = "CABLE Output (VB-Audio Virtual Cable)"
-        if not self.check_audio_device(audio_device):
+        audio_device = VB_CABLE_CAPTURE
+        capture_mode = self.get_capture_mode()
+        if not capture_available(capture_mode):
+            logging.error('Capture mode %s is not available', capture_mode)
+            messagebox.showerror("Error", f"{CAPTURE_MODES[capture_mode]} capture needs the pyaudiowpatch package.")
+            return
+        preflight_started = time.perf_counter()
+        # Answered from the cache unless a device changed since the last check
+        if not self.preflight.capture_present():
             if messagebox.askyesno("Audio Device Not Found", "VB-Audio Virtual Cable is required. Do you want to install it now?"):
                 if not install_vb_cable():
                     return
+                self.preflight.invalidate()
             else:
                 return
 
-        if self.process is None:
-            # Verify that SetPlayBack.exe exists
-            if not executable_path.exists():
-                logging.error('SetPlayBack.exe not found at path: %s', executable_path)
-                messagebox.showerror("Error", f"SetPlayBack.exe not found at path:\n{executable_path}")
-                return
-
-            # Set the working directory to where SetPlayBack.exe is located
-            playback_work_dir = executable_path.parent
-
-            # Call SetPlayBack.exe to configure the audio environment
-            try:
-                logging.debug('Running SetPlayBack.exe to configure the audio environment')
-                # Use resolved absolute path for subprocess call
-                setplayback_exe = str(executable_path.resolve())
-                subprocess.run([setplayback_exe], cwd=playback_work_dir, check=True, creationflags=subprocess.CREATE_NO_WINDOW)
-                logging.debug('SetPlayBack.exe executed successfully')
-            except subprocess.CalledProcessError as e:
-                logging.error('Failed to execute SetPlayBack.exe: %s', e)
-                messagebox.showerror("Error", "Failed to configure audio environment.")
+        if self.session is None:
+            if self.preflight.playback_ready():
+                logging.debug('CABLE Input is already the default output, nothing to set')
+            elif not self.run_setplayback():
                 return
+            logging.debug('Audio pre-flight took %.0f ms', (time.perf_counter() - preflight_started) * 1000)
 
-            # Ensure ffmpeg path exists and resolve any path issues  
+            # Ensure ffmpeg path exists and resolve any path issues
             if not ffmpeg_path.exists():
                 logging.error(f"ffmpeg.exe not found at {ffmpeg_path}")
                 messagebox.showerror("Error", f"ffmpeg.exe not found at:\n{ffmpeg_path}")
                 return
-                
+
             # Use absolute path and ensure proper string conversion
             ffmpeg_exe = str(ffmpeg_path.resolve())
             logging.debug(f"Using ffmpeg executable at: {ffmpeg_exe}")
 
-            # Optimized FFmpeg command for low-latency TCP streaming
-            command = [
-                ffmpeg_exe,  # Use resolved absolute path
-                '-hide_banner', '-loglevel', 'error',  # Clean logs
-                '-f', 'dshow',
-                '-audio_buffer_size', '50',           # Small buffer for low latency
-                '-i', f'audio={audio_device}',
-                '-codec:a', 'libmp3lame',             # MP3 faster than AAC
-                '-b:a', '192k',
-                '-f', 'mpegts',
-                '-flush_packets', '1',                # Force immediate packet transmission
-                # Single TCP connection with optimizations
-                f'tcp://{ip_address}:6005?timeout=5000000&tcp_nodelay=1'
-            ]
-            logging.debug('Running ffmpeg command: %s', ' '.join(command))
-            self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=subprocess.CREATE_NO_WINDOW)
+            if ip_address:
+                # Saved before the first connection, so that connection is counted
+                self.add_ip_to_history(ip_address, name)
+                self.show_connections()
+
+            # The session relaunches ffmpeg and reconnects on its own from here on
+            targets = self.get_targets(ip_address)
+            codec = codec_for_label(self.codec_var.get())
+            transport_mode = self.get_transport_mode()
+            on_connected = lambda address, rtt_ms: connection_store.record_connection(address, codec,
+                                                                                      transport_mode, rtt_ms)
+            self.session = sender_session(targets, codec, transport_mode, capture_mode, ffmpeg_exe, audio_device,
+                                          on_connected=on_connected, capture_period_ms=self.get_capture_period_ms(),
+                                          on_status=lambda session, status: self.ui_bus.post(EVENT_SESSION,
+                                                                                             session, status))
+            self.session.start()
+            logging.info('Streaming to %s', ', '.join(targets))
 
-            self.output_thread = threading.Thread(target=self.handle_output, args=(self.process.stdout,))
-            self.output_thread.start()
+            self.start_button.config(state=tk.DISABLED)
+            self.stop_button.config(state=tk.NORMAL)
+            self.transport_dropdown.config(state=tk.DISABLED)
+            self.codec_dropdown.config(state=tk.DISABLED)
+            self.capture_dropdown.config(state=tk.DISABLED)
+            self.capture_period_spinbox.config(state=tk.DISABLED)
+            self.targets_button.config(state=tk.DISABLED)
+            self.show_session_status(self.session, self.session.status())
+            logging.debug('Stream started successfully: %s over %s', self.session.header.profile.label, self.get_transport_mode())
+
+    def run_setplayback(self):
+        # In-process first; SetPlayBack.exe (PowerShell) only when the native call is unavailable or fails
+        started = time.perf_counter()
+        ok, device_id = set_default_playback_with_fallback(self.run_setplayback_exe)
+        if ok:
+            logging.debug('Default playback device set in %.0f ms', (time.perf_counter() - started) * 1000)
+            self.preflight.mark_playback_set(device_id)
+        return ok
+
+    def run_setplayback_exe(self):
+        # Verify that SetPlayBack.exe exists
+        if not executable_path.exists():
+            logging.error('SetPlayBack.exe not found at path: %s', executable_path)
+            messagebox.showerror("Error", f"SetPlayBack.exe not found at path:\n{executable_path}")
+            return False
 
-            self.error_thread = threading.Thread(target=self.handle_error, args=(self.process.stderr,))
-            self.error_thread.start()
+        # Set the working directory to where SetPlayBack.exe is located
+        playback_work_dir = executable_path.parent
 
-            self.add_ip_to_history(ip_address, name)
-            self.update_ip_dropdown()
+        # Call SetPlayBack.exe to configure the audio environment
+        try:
+            logging.debug('Running SetPlayBack.exe to configure the audio environment')
+            # Use resolved absolute path for subprocess call
+            setplayback_exe = str(executable_path.resolve())
+            subprocess.run([setplayback_exe], cwd=playback_work_dir, check=True, creationflags=subprocess.CREATE_NO_WINDOW)
+            logging.debug('SetPlayBack.exe executed successfully')
+        except subprocess.CalledProcessError as e:
+            logging.error('Failed to execute SetPlayBack.exe: %s', e)
+            messagebox.showerror("Error", "Failed to configure audio environment.")
+            return False
+        return True
 
-            self.start_button.config(state=tk.DISABLED)
-            self.stop_button.config(state=tk.NORMAL)
-            logging.debug('Stream started successfully')
+    def get_transport_mode(self):
+        selected = self.transport_var.get()
+        for mode, label in TRANSPORTS.items():
+            if label == selected:
+                return mode
+        return TRANSPORT_TCP
+
+    def get_capture_mode(self):
+        selected = self.capture_var.get()
+        for mode, label in CAPTURE_MODES.items():
+            if label == selected:
+                return mode
+        return CAPTURE_FFMPEG
+
+    def get_capture_period_ms(self):
+        try:
+            period = int(self.capture_period_spinbox.get())
+        except ValueError:
+            period = CAPTURE_PERIOD_MS
+        return max(CAPTURE_PERIOD_MIN_MS, min(period, CAPTURE_PERIOD_MAX_MS))
+
+    def update_capture_period_state(self):
+        # dshow captures in its own 50 ms buffers, the period only applies to Python capture
+        state = tk.DISABLED if self.get_capture_mode() == CAPTURE_FFMPEG else tk.NORMAL
+        self.capture_period_spinbox.config(state=state)
+
+    def show_session_status(self, session, status):
+        # The session reports itself every half second, so reconnects and recovery time stay visible
+        if session is not self.session:
+            return
+        total = len(status['targets'])
+        if status['state'] == "streaming":
+            text, color = "Streaming" if total == 1 else f"Streaming to {total} receivers", "green"
+        elif status['state'] == "partial":
+            text, color = f"Streaming to {status['connected']}/{total} receivers", "#e65100"
+        elif status['state'] == "reconnecting":
+            text, color = f"Reconnecting... ({status['recovering_s']:.1f} s)", "#e65100"
+        elif status['state'] == "error":
+            text, color = "Stream error, see log", "red"
+        else:
+            text, color = "Connecting...", "#e65100"
+        if status['reconnects']:
+            text += f" | {status['reconnects']} reconnects, {status['recovery_total_s']:.1f} s recovering"
+        # Python capture counts what its ring dropped; with dshow ffmpeg reports the overruns
+        overruns = status['capture']['overruns'] if status['capture'] else status['encoder']['xruns']
+        if overruns:
+            text += f" | {overruns} capture overruns"
+        self.session_label.config(text=text, fg=color)
 
     def stop_stream(self):
         logging.debug('Stopping stream...')
-        if self.process:
-            try:
-                # Try to stop FFmpeg gracefully by sending 'q'
-                self.process.stdin.write(b'q')
-                self.process.stdin.flush()
-                self.process.wait(timeout=3)
-                logging.debug('Stream terminated gracefully with q command')
-            except Exception as e:
-                logging.warning(f'Graceful stop failed, forcing kill: {e}')
-                try:
-                    self.process.kill()
-                    self.process.wait()  # Wait for the kill to complete
-                    logging.debug('Stream process killed')
-                except Exception as kill_error:
-                    logging.error(f'Error killing process: {kill_error}')
-            finally:
-                self.process = None
-                self.start_button.config(state=tk.NORMAL)
-                self.stop_button.config(state=tk.DISABLED)
-                logging.debug('Stream stopped successfully')
+        if self.session:
+            session, self.session = self.session, None
+            self.session_label.config(text="Stopping...", fg="#555555")
+            self.start_button.config(state=tk.DISABLED)
+            self.stop_button.config(state=tk.DISABLED)
+            # Waits for ffmpeg and the connections to close, so not on the UI thread
+            threading.Thread(target=self.stop_session, args=(session,), daemon=True).start()
+
+    def stop_session(self, session):
+        try:
+            session.stop()
+        except Exception as e:
+            logging.error(f"Error while stopping the stream: {e}")
+        self.ui_bus.post(EVENT_STOPPED, session, False)
+
+    def on_stream_stopped(self, session, _recorded):
+        if self.session is None:
+            self.start_button.config(state=tk.NORMAL)
+            self.stop_button.config(state=tk.DISABLED)
+            self.transport_dropdown.config(state="readonly")
+            self.codec_dropdown.config(state="readonly")
+            self.capture_dropdown.config(state="readonly")
+            self.update_capture_period_state()
+            self.targets_button.config(state=tk.NORMAL)
+            self.session_label.config(text="Not streaming", fg="#555555")
+        logging.debug('Stream stopped successfully')
 
     def clear_ip_history(self):
         if messagebox.askyesno("Clear History", "Are you sure you want to clear the IP history?"):
-            delete_ip_history()
-            self.update_ip_dropdown()
+            connection_store.clear()
+            self.show_connections()
             self.ip_entry.delete(0, tk.END)
             self.name_entry.delete(0, tk.END)
             self.ip_dropdown.set('')
@@ -440,30 +657,21 @@ class FFMPEGSenderGUI:
             messagebox.showwarning("No Selection", "Please select an IP record to delete from the dropdown.")
             return
         
-        # Parse the selected text to get the IP and name
-        try:
-            name, ip = selected_text.split(": ")
-        except ValueError:
+        # Look up the IP and name behind the selected text
+        selected = self.dropdown_entries.get(selected_text)
+        if selected is None:
             messagebox.showerror("Error", "Invalid selection format.")
             return
+        ip, name = selected
         
         # Confirm deletion
         if messagebox.askyesno("Delete Record", f"Are you sure you want to delete the record:\n{name}: {ip}?"):
-            # Find and remove the record from ip_history
-            global ip_history
-            for index, (existing_ip, existing_name) in enumerate(ip_history):
-                if existing_ip == ip and existing_name == name:
-                    ip_history.pop(index)
-                    break
-            else:
+            if not connection_store.remove(ip):
                 messagebox.showerror("Error", "Record not found in history.")
                 return
             
-            # Save updated history
-            save_ip_history()
-            
             # Update dropdown
-            self.update_ip_dropdown()
+            self.show_connections()
             
             # Clear the entries if they match the deleted record
             current_ip = self.ip_entry.get()
@@ -480,7 +688,13 @@ class FFMPEGSenderGUI:
 
     def on_closing(self):
         logging.debug('Closing application')
-        self.stop_stream()
+        session, self.session = self.session, None
+        if session:
+            session.stop()  # The window is going away, so waiting here freezes nothing
+        if self.device_watcher:
+            self.device_watcher.stop()
+        self.preflight.stop()
+        default_supervisor().shutdown()
         self.root.destroy()
 
 if __name__ == "__main__":
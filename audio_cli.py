@@ -0,0 +1,314 @@
+"""Run Audio Receivers and Audio Streamer senders without a window.
+
+    python audio_cli.py receive --port 5000 --output device --latency-ms 60 --record recordings
+    python audio_cli.py send 192.168.1.20 --codec opus20 --transport udp
+    python audio_cli.py status
+    python audio_cli.py stop
+
+``receive`` and ``send`` run until Ctrl-C, SIGTERM or ``stop``. Each serves
+its state as JSON on ``http://127.0.0.1:<status port>/status`` (6007 for
+receivers, 6008 for senders, 0 picks a free one) and stops on a POST to
+``/stop``; ``status`` and ``stop`` are the client side of that. The endpoint
+only listens on localhost.
+
+``--instances N`` runs N receivers on consecutive ports, or N senders to the
+receivers on those ports, in one process. With ``--output null`` and
+``--capture synthetic --codec pcm`` no sound hardware, ffmpeg or ffplay is
+needed, so a load test of twenty pairs is::
+
+    python audio_cli.py receive --port 7000 --instances 20 --output null --status-port 0
+    python audio_cli.py send 127.0.0.1 --port 7000 --instances 20 --capture synthetic --codec pcm --status-port 0
+
+The sender captures and streams only: unlike the streamer's window it does
+not install VB-CABLE or change the default playback device.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import signal
+import socket
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from audio_engine import OUTPUT_FFPLAY, OUTPUTS, RECEIVER_ERROR, ReceiverEngine, sender_session
+from capture import (CAPTURE_BUFFER_MS, CAPTURE_FFMPEG, CAPTURE_FILE, CAPTURE_PERIOD_MAX_MS, CAPTURE_PERIOD_MIN_MS,
+                     CAPTURE_PERIOD_MS, CAPTURE_PULSE, CAPTURE_SYNTHETIC, CAPTURE_WASAPI, capture_available)
+from discovery import DISCOVERY_PORT, Beacon
+from log_pipeline import setup_logging
+from playback import PLAYBACK_TARGET_MS
+from preflight import VB_CABLE_CAPTURE
+from process_supervisor import default_supervisor
+from recording import RecordingStore
+from stream_format import CODECS, DEFAULT_CODEC
+from stream_transport import DEFAULT_PORT, JITTER_TARGET_MS, TRANSPORT_TCP, TRANSPORTS
+
+RECEIVER_STATUS_PORT = 6007       # After DISCOVERY_PORT
+SENDER_STATUS_PORT = 6008
+STATUS_HOST = '127.0.0.1'
+START_TIMEOUT = 5.0               # For every receiver to bind its port or give up
+
+if hasattr(sys, '_MEIPASS'):
+    base_path = Path(sys._MEIPASS)
+else:
+    base_path = Path(__file__).parent.resolve()
+
+
+def find_tool(name):
+    """Prefer the bundled ffmpeg build, fall back to one on PATH."""
+    bundled = base_path / 'ffmpeg' / 'bin' / (f'{name}.exe' if platform.system() == 'Windows' else name)
+    if bundled.exists():
+        return str(bundled)
+    return shutil.which(name)
+
+
+class StatusServer:
+    """``GET /status`` returns ``status()`` as JSON, ``POST /stop`` sets ``stop_event``; localhost only."""
+
+    def __init__(self, status, stop_event, port, host=STATUS_HOST):
+        self.status = status
+        self.stop_event = stop_event
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = None
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') in ('', '/status'):
+                    self._reply(200, server.status())
+                else:
+                    self._reply(404, {'error': 'not found'})
+
+            def do_POST(self):
+                if self.path.rstrip('/') == '/stop':
+                    server.stop_event.set()
+                    self._reply(200, {'stopping': True})
+                else:
+                    self._reply(404, {'error': 'not found'})
+
+            def _reply(self, code, body):
+                data = json.dumps(body, indent=1).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logging.debug('Status request: %s', format % args)
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='status-server', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def wait_for_stop(stop_event):
+    # Short waits, so Ctrl-C gets through on Windows as well
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    try:
+        while not stop_event.wait(0.5):
+            pass
+    except KeyboardInterrupt:
+        pass
+
+
+def stop_in_parallel(items):
+    threads = [threading.Thread(target=item.stop, daemon=True) for item in items]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_receivers(args):
+    ffmpeg_exe = args.ffmpeg or find_tool('ffmpeg')
+    ffplay_exe = args.ffplay or find_tool('ffplay')
+    name = args.name or socket.gethostname()
+    receivers, beacons = [], []
+    for index in range(args.instances):
+        port = args.port + index
+        store = None
+        if args.record:
+            directory = args.record if args.instances == 1 else os.path.join(args.record, str(port))
+            store = RecordingStore(directory)
+        receivers.append(ReceiverEngine(ffmpeg_exe, ffplay_exe, port, args.transport, args.jitter_ms, args.mix,
+                                        args.output, args.latency_ms, store).start())
+    deadline = time.monotonic() + START_TIMEOUT
+    for receiver in receivers:
+        receiver.listening.wait(max(0.0, deadline - time.monotonic()))
+    failed = [receiver for receiver in receivers if receiver.state == RECEIVER_ERROR]
+    if failed:
+        for receiver in failed:
+            print(f'Receiver on port {receiver.port}: {receiver.detail}', file=sys.stderr)
+        stop_in_parallel(receivers)
+        return 1
+
+    if not args.no_beacon:
+        for receiver in receivers:
+            beacon_name = name if args.instances == 1 else f'{name}:{receiver.port}'
+            try:
+                beacons.append(Beacon(beacon_name, receiver.port, list(CODECS), args.transport, load=receiver.load,
+                                      port=args.discovery_port).start())
+            except OSError as e:
+                logging.warning("Streamers won't find the receiver on port %s: %s", receiver.port, e)
+
+    started = time.monotonic()
+    status = lambda: {'role': 'receiver', 'name': name, 'pid': os.getpid(),
+                      'uptime_s': round(time.monotonic() - started, 1),
+                      'instances': [receiver.status() for receiver in receivers]}
+    return serve(status, args.status_port, receivers + beacons, f'{len(receivers)} receiver(s) on port '
+                 f'{receivers[0].port}' + (f'-{receivers[-1].port}' if len(receivers) > 1 else ''))
+
+
+def run_senders(args):
+    if not capture_available(args.capture):
+        print(f'Capture mode {args.capture} is not available here', file=sys.stderr)
+        return 1
+    if args.capture == CAPTURE_FILE and not args.file:
+        print('--capture file needs --file', file=sys.stderr)
+        return 1
+    if not CAPTURE_PERIOD_MIN_MS <= args.capture_period_ms <= CAPTURE_PERIOD_MAX_MS:
+        print(f'--capture-period-ms must be {CAPTURE_PERIOD_MIN_MS} to {CAPTURE_PERIOD_MAX_MS}', file=sys.stderr)
+        return 1
+    if args.capture_buffer_ms < 2 * args.capture_period_ms:
+        print('--capture-buffer-ms must hold at least two periods', file=sys.stderr)
+        return 1
+    device = args.device
+    if device is None and args.capture in (CAPTURE_FFMPEG, CAPTURE_WASAPI):
+        device = VB_CABLE_CAPTURE
+    ffmpeg_exe = args.ffmpeg or find_tool('ffmpeg')
+    sessions = []
+    for index in range(args.instances):
+        session = sender_session(args.targets, args.codec, args.transport, args.capture, ffmpeg_exe, device,
+                                 args.file, args.port + index,
+                                 on_connected=lambda address, connect_ms: logging.info('Streaming to %s', address),
+                                 capture_period_ms=args.capture_period_ms, capture_buffer_ms=args.capture_buffer_ms)
+        if session.command is not None and not ffmpeg_exe:
+            print('ffmpeg not found, use --ffmpeg or --capture synthetic with --codec pcm', file=sys.stderr)
+            return 1
+        session.start()
+        sessions.append(session)
+
+    started = time.monotonic()
+    status = lambda: {'role': 'sender', 'pid': os.getpid(), 'uptime_s': round(time.monotonic() - started, 1),
+                      'codec': args.codec, 'transport': args.transport, 'capture': args.capture,
+                      'instances': [dict(session.status(), port=session.port) for session in sessions]}
+    return serve(status, args.status_port, sessions, f'{len(sessions)} sender(s) to {", ".join(args.targets)}')
+
+
+def serve(status, status_port, running, description):
+    stop_event = threading.Event()
+    server = None
+    try:
+        server = StatusServer(status, stop_event, status_port).start()
+    except OSError as e:
+        logging.warning('No status endpoint on port %s: %s', status_port, e)
+    endpoint = f'http://{STATUS_HOST}:{server.port}/status' if server else 'none'
+    print(f'Running {description}, status on {endpoint}', file=sys.stderr)
+    wait_for_stop(stop_event)
+    print('Stopping...', file=sys.stderr)
+    if server:
+        server.stop()
+    stop_in_parallel(running)
+    default_supervisor().shutdown()
+    return 0
+
+
+def request(port, method):
+    path = '/stop' if method == 'POST' else '/status'
+    try:
+        with urllib.request.urlopen(urllib.request.Request(f'http://{STATUS_HOST}:{port}{path}', method=method,
+                                                           data=b'' if method == 'POST' else None),
+                                    timeout=5) as response:
+            print(json.dumps(json.load(response), indent=2))
+    except (urllib.error.URLError, OSError) as e:
+        print(f'Nothing answers on port {port}: {e}', file=sys.stderr)
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run Audio Streamer senders and receivers without a window.')
+    parser.add_argument('--log', help='log to this file, rotated by size, instead of stderr')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    receive = commands.add_parser('receive', help='listen for senders and play what they send')
+    receive.add_argument('--port', type=int, default=DEFAULT_PORT, help='stream port (the first one with --instances)')
+    receive.add_argument('--transport', choices=list(TRANSPORTS), default=TRANSPORT_TCP)
+    receive.add_argument('--jitter-ms', type=int, default=JITTER_TARGET_MS, help='jitter buffer target for UDP')
+    receive.add_argument('--output', choices=OUTPUTS, default=OUTPUT_FFPLAY,
+                         help='ffplay, in-process playback on the default device, or paced playback into nothing')
+    receive.add_argument('--latency-ms', type=int, default=PLAYBACK_TARGET_MS,
+                         help='playback latency target for --output device or null')
+    receive.add_argument('--mix', action='store_true', help='mix several TCP senders')
+    receive.add_argument('--record', metavar='DIR', help='also record everything received here')
+    receive.add_argument('--name', help='announced to streamers (default: host name)')
+    receive.add_argument('--no-beacon', action='store_true', help="don't answer discovery probes")
+    receive.add_argument('--discovery-port', type=int, default=DISCOVERY_PORT)
+    receive.add_argument('--instances', type=int, default=1)
+    receive.add_argument('--status-port', type=int, default=RECEIVER_STATUS_PORT)
+    receive.add_argument('--ffmpeg', help='path to ffmpeg (default: bundled or PATH)')
+    receive.add_argument('--ffplay', help='path to ffplay (default: bundled or PATH)')
+
+    send = commands.add_parser('send', help='capture, encode and stream to one or more receivers')
+    send.add_argument('targets', nargs='+', metavar='TARGET', help='receiver address, or the multicast group')
+    send.add_argument('--port', type=int, default=DEFAULT_PORT, help='receiver port (the first one with --instances)')
+    send.add_argument('--codec', choices=list(CODECS), default=DEFAULT_CODEC)
+    send.add_argument('--transport', choices=list(TRANSPORTS), default=TRANSPORT_TCP)
+    send.add_argument('--capture', default=CAPTURE_FFMPEG if platform.system() == 'Windows' else CAPTURE_PULSE,
+                      choices=[CAPTURE_FFMPEG, CAPTURE_WASAPI, CAPTURE_PULSE, CAPTURE_FILE, CAPTURE_SYNTHETIC])
+    send.add_argument('--device', help='capture device (default: the VB-CABLE output for dshow and wasapi)')
+    send.add_argument('--file', help='audio file to loop with --capture file')
+    send.add_argument('--capture-period-ms', type=int, default=CAPTURE_PERIOD_MS,
+                      help='capture period in Python capture modes (dshow is fixed at 50)')
+    send.add_argument('--capture-buffer-ms', type=int, default=CAPTURE_BUFFER_MS,
+                      help='capture buffer; audio beyond it is dropped and counted as an overrun')
+    send.add_argument('--instances', type=int, default=1)
+    send.add_argument('--status-port', type=int, default=SENDER_STATUS_PORT)
+    send.add_argument('--ffmpeg', help='path to ffmpeg (default: bundled or PATH)')
+
+    for name, help_text in (('status', 'print the status of a running receive or send'),
+                            ('stop', 'stop a running receive or send')):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('--status-port', type=int, default=RECEIVER_STATUS_PORT,
+                             help=f'{RECEIVER_STATUS_PORT} for a receiver, {SENDER_STATUS_PORT} for a sender')
+
+    args = parser.parse_args(argv)
+    level = logging.DEBUG if args.verbose else logging.INFO
+    if args.log:
+        setup_logging(args.log, level, '%(asctime)s - %(levelname)s - %(message)s')
+    else:
+        logging.basicConfig(level=level, format='%(asctime)s %(levelname)s:%(message)s')
+    if getattr(args, 'instances', 1) < 1:
+        parser.error('--instances must be at least 1')
+
+    if args.command == 'receive':
+        if args.mix and args.transport != TRANSPORT_TCP:
+            parser.error('--mix needs one TCP connection per sender, use --transport tcp')
+        return run_receivers(args)
+    if args.command == 'send':
+        return run_senders(args)
+    return request(args.status_port, 'POST' if args.command == 'stop' else 'GET')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,673 @@
+"""The streaming core of Audio Streamer and Audio Receiver, without any UI.
+
+:class:`SenderSession` captures and encodes once and keeps one or more
+receivers fed, relaunching ffmpeg and reconnecting on its own;
+:func:`sender_session` builds one from the settings the streamer's window
+offers. :class:`ReceiverEngine` listens for senders and plays what they send
+through ffplay or the in-process :mod:`playback` engine, optionally mixing
+several senders and recording what arrives.
+
+Both windows drive these classes, and ``audio_cli.py`` runs them headless.
+Nothing here touches Tk or Windows' audio settings, and the port is a
+parameter, so many engines can share one machine.
+"""
+import logging
+import os
+import random
+import subprocess
+import threading
+import time
+
+from capture import CAPTURE_BUFFER_MS, CAPTURE_FFMPEG, CAPTURE_PERIOD_MS, CaptureStream, backend_for, feed_encoder
+from log_pipeline import FfmpegLog
+from playback import PLAYBACK_TARGET_MS
+from process_supervisor import default_supervisor, spawn
+from recording import RecordingTap
+from stream_format import CODEC_PCM, StreamHeader
+from stream_transport import (CONNECT_TIMEOUT, DEFAULT_PORT, JITTER_TARGET_MS, TRANSPORT_TCP, TRANSPORTS,
+                              LiveSource, RtpSender, StandbyReceiver, StreamSender, idle_counters)
+
+# Children get no console window; decoders are detached from ours as well. Both are 0 outside Windows.
+CREATE_NO_WINDOW = getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+DECODER_CREATIONFLAGS = CREATE_NO_WINDOW | getattr(subprocess, 'DETACHED_PROCESS', 0)
+
+# Reconnect policy: attempts start 50 ms apart and never wait more than 0.5 s,
+# so a receiver that comes back is picked up in well under a second.
+RECONNECT_BASE_DELAY = 0.05
+RECONNECT_MAX_DELAY = 0.5
+RETRY_CONNECT_TIMEOUT = 1.0
+STATUS_INTERVAL = 0.5             # How often a session reports its status to on_status
+
+
+def reconnect_delay(attempt):
+    # Bounded exponential backoff with "equal jitter" so several senders
+    # that lost the same receiver don't retry in lockstep.
+    # The exponent is capped: a receiver that stays away for hours would
+    # otherwise make 2 ** attempt too large for a float.
+    delay = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * (2 ** min(attempt, 32)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _send_quit(process):
+    # ffmpeg reading its input from dshow stops cleanly on 'q'
+    process.stdin.write(b'q')
+    process.stdin.flush()
+
+
+def _no_signal(process):
+    # Its input has already ended, only wait for it
+    pass
+
+
+class SenderTarget:
+    """One receiver fed by a SenderSession, with its own connection and reconnect state."""
+
+    def __init__(self, address):
+        self.address = address
+        self.transport = None
+        self.subscription = None
+        self.state = "connecting"
+        self.attempt = 0
+        self.retry_at = 0.0
+        self.connect_timeout = CONNECT_TIMEOUT
+        self.reconnects = 0
+        self.recovering_since = None
+        self.recovery_total = 0.0
+        self.last_recovery = None
+
+    def begin_recovery(self):
+        if self.recovering_since is None:
+            self.recovering_since = time.monotonic()
+        self.state = "reconnecting"
+
+    def end_recovery(self):
+        elapsed = time.monotonic() - self.recovering_since
+        self.recovering_since = None
+        self.reconnects += 1
+        self.last_recovery = elapsed
+        self.recovery_total += elapsed
+        logging.info('Reconnected to %s after %.3f s (reconnect #%d)', self.address, elapsed, self.reconnects)
+
+    def status(self):
+        recovering = time.monotonic() - self.recovering_since if self.recovering_since is not None else 0.0
+        return {
+            'address': self.address,
+            'state': self.state,
+            'reconnects': self.reconnects,
+            'recovering_s': round(recovering, 3),
+            'recovery_total_s': round(self.recovery_total + recovering, 3),
+            'last_recovery_s': round(self.last_recovery, 3) if self.last_recovery is not None else None,
+            'chunks_dropped': self.subscription.dropped if self.subscription else 0,
+        }
+
+
+class SenderSession:
+    """Keep a stream to one or more receivers alive until stop() is called.
+
+    The one-time setup (VB-CABLE check, default playback device) is done by
+    the caller before the session starts. The session only supervises
+    ffmpeg and the connections: if ffmpeg exits it is relaunched,
+    if a connection drops it is re-established, with bounded exponential
+    backoff between attempts. While disconnected ffmpeg keeps running and its
+    output is discarded, so a reconnect resumes with live audio.
+
+    Audio is captured and encoded once. Every target reads the encoded stream
+    through its own bounded LiveSource subscription, so a slow receiver loses
+    its oldest chunks instead of holding up the others.
+
+    With ``open_capture`` (returning a started capture.CaptureStream) the
+    audio is captured in Python and piped into ffmpeg's stdin instead of
+    ffmpeg capturing through dshow; without a ``command`` the captured PCM is
+    sent as it is. A capture that fails is restarted like a crashed ffmpeg.
+    ``on_connected(address, connect_ms)`` is called on the session thread
+    whenever a target (re)connects, and ``on_status(session, status)`` every
+    ``STATUS_INTERVAL`` and once more when the session has ended; a Tk app
+    should post it to its :class:`ui_bus.UiBus` instead of polling
+    :meth:`status`.
+    """
+
+    def __init__(self, command, targets, header, transport_mode, open_capture=None, on_connected=None,
+                 port=DEFAULT_PORT, on_status=None):
+        self.command = command
+        self.port = port
+        self.on_connected = on_connected
+        self.on_status = on_status
+        self.open_capture = open_capture
+        self.capture = None
+        self.targets = [SenderTarget(address) for address in targets]
+        self.header = header
+        self.transport_mode = transport_mode
+        self.process = None
+        self.encoder_log = FfmpegLog('encoder')  # Counts overruns and the bitrate across restarts
+        self.source = None
+        self.encoder_attempt = 0
+        self.state = "connecting"
+        self.stop_event = threading.Event()
+        self.wake = threading.Event()
+        self.thread = None
+        self._status_at = 0.0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._supervise, name='sender-session', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=6):
+        self.stop_event.set()
+        self.wake.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def status(self):
+        targets = [target.status() for target in self.targets]
+        return {
+            'state': self.state,
+            'connected': sum(target['state'] == "streaming" for target in targets),
+            'reconnects': sum(target['reconnects'] for target in targets),
+            'recovering_s': max(target['recovering_s'] for target in targets),
+            'recovery_total_s': round(sum(target['recovery_total_s'] for target in targets), 3),
+            'capture': self.capture.stats() if self.capture else None,
+            'encoder': self.encoder_log.stats(),
+            'targets': targets,
+        }
+
+    def _report_status(self, now=None):
+        if self.on_status is None:
+            return
+        if now is not None:
+            if now < self._status_at:
+                return
+            self._status_at = now + STATUS_INTERVAL
+        try:
+            self.on_status(self, self.status())
+        except Exception as e:
+            logging.error('Reporting the sender status failed: %s', e)
+
+    def _launch_encoder(self):
+        if self.open_capture is not None:
+            self.capture = self.open_capture()
+        if self.command is None:
+            # PCM straight from the capture ring, there is nothing to encode
+            output = self.capture
+        else:
+            logging.debug('Running ffmpeg command: %s', ' '.join(self.command))
+            self.process = spawn(self.command, 'ffmpeg encoder', stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=CREATE_NO_WINDOW)
+            self.encoder_log.start(self.process.stderr)
+            if self.capture is not None:
+                feed_encoder(self.capture, self.process.stdin)
+            output = self.process.stdout
+        # Drain ffmpeg's stdout continuously so it never blocks on a dead connection.
+        # Ogg header pages are replayed to receivers that join later.
+        profile = self.header.profile
+        self.source = LiveSource(output, align=profile.align, ogg_pages=profile.ogg_pages)
+        self.source.on_eof = lambda source: self.wake.set()
+        self.source.start()
+
+    def _stop_encoder(self):
+        process, self.process = self.process, None
+        capture, self.capture = self.capture, None
+        if capture is not None:
+            # End of input stops ffmpeg the same way 'q' does; stdin carries audio now
+            capture.close()
+            logging.debug('Capture stats: %s', capture.stats())
+        if process is None:
+            return
+        # With a capture the feeder closes stdin, otherwise 'q' stops ffmpeg gracefully; killed after 3 s
+        code = default_supervisor().stop(process, graceful=_no_signal if capture is not None else _send_quit, timeout=3)
+        logging.debug('Encoder stopped with code %s', code)
+
+    def _reap_encoder(self):
+        process, self.process = self.process, None
+        capture, self.capture = self.capture, None
+        if capture is not None:
+            capture.close()
+        if process is None:
+            logging.warning('Audio capture stopped, restarting it')
+            return
+        # stdout closed; ffmpeg still hanging around after a second is killed
+        code = default_supervisor().stop(process, graceful=_no_signal, timeout=1)
+        logging.warning('ffmpeg exited with code %s, restarting it', code)
+
+    def _connect(self, target):
+        target.subscription = self.source.subscribe()
+        on_closed = lambda transport, error: self._on_transport_closed(target, transport, error)
+        if self.transport_mode == TRANSPORT_TCP:
+            target.transport = StreamSender(target.address, self.port, on_closed=on_closed,
+                                            header=self.header, connect_timeout=target.connect_timeout)
+        else:
+            target.transport = RtpSender(target.address, self.port, on_closed=on_closed, header=self.header)
+        target.transport.start(target.subscription)
+
+    def _drop_transport(self, target):
+        if target.subscription:
+            target.subscription.close()
+            target.subscription = None
+        if target.transport:
+            target.transport.stop(timeout=0)
+            target.transport = None
+
+    def _on_transport_closed(self, target, transport, error):
+        if error is not None and not self.stop_event.is_set():
+            if transport.connected.is_set():
+                logging.warning('Connection to receiver %s lost: %s', target.address, error)
+            elif target.recovering_since is None:
+                # Log the first failed attempt only, retries fail the same way
+                logging.warning('Could not connect to receiver %s: %s, retrying', target.address, error)
+        self.wake.set()
+
+    def _supervise_target(self, target, now):
+        transport = target.transport
+        if transport is None:
+            if now >= target.retry_at:
+                self._connect(target)
+        elif transport.closed.is_set():
+            target.begin_recovery()
+            self._drop_transport(target)
+            target.retry_at = now + reconnect_delay(target.attempt)
+            target.attempt += 1
+            target.connect_timeout = RETRY_CONNECT_TIMEOUT
+        elif transport.connected.is_set():
+            if target.recovering_since is not None:
+                target.end_recovery()
+            if target.state != "streaming" and self.on_connected:
+                self.on_connected(target.address, getattr(transport, 'connect_ms', None))
+            target.attempt = 0
+            target.state = "streaming"
+            self.encoder_attempt = 0
+
+    def _supervise(self):
+        try:
+            while not self.stop_event.is_set():
+                if self.source is None or self.source.eof.is_set():
+                    if self.source is not None:
+                        self._reap_encoder()
+                        for target in self.targets:
+                            target.begin_recovery()
+                            self._drop_transport(target)
+                        if self.stop_event.wait(reconnect_delay(self.encoder_attempt)):
+                            break
+                        self.encoder_attempt += 1
+                    self._launch_encoder()
+
+                now = time.monotonic()
+                for target in self.targets:
+                    self._supervise_target(target, now)
+                states = {target.state for target in self.targets}
+                if "reconnecting" in states:
+                    self.state = "reconnecting"
+                elif states == {"streaming"}:
+                    self.state = "streaming"
+                elif "streaming" in states:
+                    self.state = "partial"
+                self._report_status(now)
+                retries = [target.retry_at - now for target in self.targets if target.transport is None]
+                self.wake.wait(max(0.0, min(retries + [0.1])))
+                self.wake.clear()
+        except Exception as e:
+            logging.error('Sender session failed: %s', e)
+            self.state = "error"
+        finally:
+            # Stop ffmpeg first so the transports can flush what they already got
+            self._stop_encoder()
+            for target in self.targets:
+                if target.transport:
+                    target.transport.stop()
+                    logging.debug('Transport stats for %s: %s', target.address, target.transport.stats.snapshot())
+                self._drop_transport(target)
+                target.recovering_since = None
+            if self.state != "error":
+                self.state = "stopped"
+            logging.debug('Sender session ended: %s', self.status())
+            self._report_status()
+
+
+def encoder_command(ffmpeg_exe, header, audio_device=None):
+    """ffmpeg encoding to stdout from the dshow ``audio_device``, or from raw PCM on stdin without one."""
+    if audio_device is not None:
+        input_args = [
+            '-f', 'dshow',
+            '-audio_buffer_size', '50',           # Small buffer for low latency
+            '-i', f'audio={audio_device}',
+        ]
+    else:
+        # Captured in Python (see capture.py) and piped in as raw PCM
+        input_args = ['-f', 's16le', '-ar', str(header.sample_rate), '-ac', str(header.channels), '-i', 'pipe:0']
+    # Optimized FFmpeg command for low-latency streaming. The encoded
+    # stream goes to stdout and our own transport owns the socket.
+    return [
+        ffmpeg_exe,
+        '-hide_banner', '-loglevel', 'warning',  # Overrun and timestamp warnings, see log_pipeline
+        '-stats', '-stats_period', '1',       # One progress line a second for the bitrate
+        *input_args,
+        *header.profile.encoder_output_args(),  # PCM, Opus or MP3, see stream_format
+        '-flush_packets', '1',                # Force immediate packet transmission
+        'pipe:1'
+    ]
+
+
+def sender_session(targets, codec, transport_mode, capture_mode=CAPTURE_FFMPEG, ffmpeg_exe=None, audio_device=None,
+                   capture_path=None, port=DEFAULT_PORT, on_connected=None, on_status=None,
+                   capture_period_ms=CAPTURE_PERIOD_MS, capture_buffer_ms=CAPTURE_BUFFER_MS):
+    """An unstarted :class:`SenderSession` for ``targets``.
+
+    ``audio_device`` is the dshow device with ``CAPTURE_FFMPEG`` and the
+    device name for the other capture modes; ``capture_path`` is the file
+    played by ``CAPTURE_FILE``. PCM captured in Python needs no ffmpeg.
+    ``capture_period_ms`` and ``capture_buffer_ms`` size the
+    :class:`capture.CaptureStream`; dshow has its own 50 ms buffer.
+    """
+    header = StreamHeader(codec)
+    open_capture = None
+    if capture_mode != CAPTURE_FFMPEG:
+        open_capture = lambda: CaptureStream(backend_for(capture_mode, audio_device, capture_path),
+                                             header.sample_rate, header.channels,
+                                             capture_period_ms, capture_buffer_ms).start()
+    if open_capture is not None and codec == CODEC_PCM:
+        command = None  # Captured PCM is already what goes on the wire
+    else:
+        command = encoder_command(ffmpeg_exe, header, audio_device if open_capture is None else None)
+    return SenderSession(command, targets, header, transport_mode, open_capture, on_connected, port, on_status)
+
+
+RECEIVER_IDLE = 'idle'            # Not started yet, or stopped
+RECEIVER_WAITING = 'waiting'      # Listening, no sender connected
+RECEIVER_RECEIVING = 'receiving'
+RECEIVER_ERROR = 'error'          # Could not start, the detail says why
+
+OUTPUT_FFPLAY = 'ffplay'
+OUTPUT_DEVICE = 'device'          # In-process playback on the default device, ffplay without pyaudio
+OUTPUT_NULL = 'null'              # In-process playback into nothing, paced like a sound card
+OUTPUTS = (OUTPUT_FFPLAY, OUTPUT_DEVICE, OUTPUT_NULL)
+
+
+def ffplay_command(ffplay_exe, header):
+    """ffplay playing the stream ``header`` describes from stdin."""
+    # Input options come from the stream header, so nothing has to be probed
+    input_args = header.profile.decoder_input_args(header)
+    # Optimized ffplay command for low-latency streaming
+    return [
+        ffplay_exe,
+        '-nodisp',
+        '-autoexit',
+        '-loglevel', 'quiet',     # Silence all console output
+        '-nostats',               # Disable progress printouts in the pipe
+        '-fflags', 'nobuffer+fastseek',
+        '-flags', 'low_delay',
+        '-strict', 'experimental',
+        '-infbuf',
+        # Timestamps follow the samples: a sender that reconnects to the warm
+        # decoder jumps ahead in time and aresample would pad that with silence
+        '-af', 'asetpts=N/SR/TB',
+        *input_args,
+        'pipe:0'
+    ]
+
+
+class ReceiverEngine:
+    """Listen on ``port`` and play every sender that connects, until :meth:`stop`.
+
+    ``on_state(engine, state, detail)`` is called on the engine's threads
+    whenever :attr:`state` changes, and while mixing whenever the number of
+    senders does; ``detail`` is that number while receiving and the reason
+    after ``RECEIVER_ERROR``. With a ``recording_store`` everything received
+    is recorded as well, as it arrives. While mixing, ``on_mix(mixer, sources)``
+    gets the mixer's snapshot from the mixer thread, see :class:`audio_mixer.Mixer`.
+    """
+
+    def __init__(self, ffmpeg_exe=None, ffplay_exe=None, port=DEFAULT_PORT, transport_mode=TRANSPORT_TCP,
+                 jitter_target_ms=JITTER_TARGET_MS, mix=False, output=OUTPUT_FFPLAY,
+                 playback_target_ms=PLAYBACK_TARGET_MS, recording_store=None, on_state=None,
+                 creationflags=DECODER_CREATIONFLAGS, on_mix=None):
+        self.ffmpeg_exe = ffmpeg_exe
+        self.ffplay_exe = ffplay_exe
+        self.port = port
+        self.transport_mode = transport_mode
+        self.jitter_target_ms = jitter_target_ms
+        self.mix = mix
+        self.output = output
+        self.playback_target_ms = playback_target_ms
+        self.recording_store = recording_store
+        self.on_state = on_state
+        self.on_mix = on_mix
+        self.creationflags = creationflags
+        self.state = RECEIVER_IDLE
+        self.detail = None
+        self.header = None        # Of the stream being decoded
+        self.transport = None
+        self.process = None
+        self.recording_tap = None
+        self.playback = None      # In-process playback engine, replaces ffplay
+        self.playback_input = None
+        self.listening = threading.Event()  # Set once the port is bound, or starting failed
+        self.thread = None
+        self._stopping = False
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name=f'receiver-{self.port}', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        """Close the port, end playback and finish the recording, then wait for the engine thread."""
+        self._stopping = True
+        # Close the listener/connection first so no new decoder is started
+        transport = self.transport
+        if transport:
+            transport.stop()
+        # Ends ffplay and finishes the recording file
+        self.close_decoder()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+    def _set_state(self, state, detail=None):
+        self.state = state
+        self.detail = detail
+        if self.on_state:
+            self.on_state(self, state, detail)
+
+    def _fail(self, reason):
+        logging.error('Receiver on port %s could not start: %s', self.port, reason)
+        self._set_state(RECEIVER_ERROR, reason)
+
+    def _run(self):
+        logging.info('Starting %s listener%s on port %s...', self.transport_mode.upper(),
+                     ' with recording' if self.recording_store else '', self.port)
+        try:
+            if not self._check_output():
+                return
+            # The transport owns the listening socket and feeds the decoder's stdin
+            try:
+                transport = self.create_transport()
+                self.port = transport.listen()
+            except OSError as e:
+                logging.error('Failed to listen on port %s: %s', self.port, e)
+                self._fail(f'port {self.port} busy')
+                return
+            self.transport = transport
+            self.listening.set()
+            if self._stopping:
+                return
+            # The decoder is started once the first sender has announced its codec
+            # and then kept warm for the senders that follow, until stop()
+            if self.mix:
+                # The mixer always produces PCM, so its decoder is started right away
+                transport.start(self.open_decoder(StreamHeader(CODEC_PCM)))
+            else:
+                transport.start(self.open_decoder)
+            self._set_state(RECEIVER_WAITING)
+            logging.info('%s listener active on port %s, waiting for connections...',
+                         self.transport_mode.upper(), self.port)
+            transport.closed.wait()
+        except Exception as e:
+            logging.error('Failed to start listener: %s', e)
+        finally:
+            logging.info('Listener on port %s stopped', self.port)
+            transport, self.transport = self.transport, None
+            if transport:
+                transport.stop()
+            self.close_decoder()
+            self.stop_playback()
+            self.listening.set()
+            if self.state != RECEIVER_ERROR:
+                self._set_state(RECEIVER_IDLE)
+
+    def _check_output(self):
+        # Everything the output needs has to be there before the port is taken
+        if self.output != OUTPUT_FFPLAY and not self.start_playback():
+            self._fail('no audio output')
+            return False
+        # Mixing and in-process playback decode with ffmpeg, otherwise playback and recording only need ffplay
+        if self.mix and not (self.ffmpeg_exe and os.path.exists(self.ffmpeg_exe)):
+            self._fail('ffmpeg not found')
+            self.stop_playback()
+            return False
+        if self.playback is not None and not (self.ffmpeg_exe and os.path.exists(self.ffmpeg_exe)):
+            logging.warning('ffmpeg not found, only PCM senders can be played')
+        if self.playback is None and not (self.ffplay_exe and os.path.exists(self.ffplay_exe)):
+            self._fail('ffplay not found')
+            return False
+        return True
+
+    def create_transport(self):
+        if self.mix:
+            # Every sender is decoded inside the mixer, the mix goes to one decoder
+            from audio_mixer import MixingReceiver
+            return MixingReceiver(self.ffmpeg_exe, self.port, on_session=self._on_mix_sessions_changed,
+                                  on_session_end=self._on_mix_sessions_changed, creationflags=self.creationflags,
+                                  on_snapshot=self.on_mix)
+        # Stays on the port across sender sessions and keeps the decoder running in between
+        options = {}
+        if self.transport_mode != TRANSPORT_TCP:
+            logging.info('Using %s transport with %s ms jitter buffer', TRANSPORTS[self.transport_mode],
+                         self.jitter_target_ms)
+            options['target_ms'] = self.jitter_target_ms
+        return StandbyReceiver(self.transport_mode, self.port, on_session=self._on_session_started,
+                               on_session_end=self._on_session_ended, sink_alive=self.decoder_alive, **options)
+
+    def _on_session_started(self, transport, header):
+        playback = self.playback
+        if playback is not None:
+            # The decoder may be reused for this sender, but its clock is not the last one's
+            playback.new_session()
+        self._set_state(RECEIVER_RECEIVING, 1)
+
+    def _on_session_ended(self, transport, error):
+        if not self._stopping and self.transport is not None and not self.transport.closed.is_set():
+            self._set_state(RECEIVER_WAITING)
+
+    def _on_mix_sessions_changed(self, receiver, *args):
+        transport = self.transport
+        if transport is None or transport.closed.is_set():
+            return
+        count = len(transport.transport.sessions)
+        if count:
+            self._set_state(RECEIVER_RECEIVING, count)
+        else:
+            self._set_state(RECEIVER_WAITING)
+
+    def start_playback(self):
+        # On the engine thread; False if no output device could be opened
+        from playback import NullSink, PlaybackEngine, default_sink
+        sink = NullSink() if self.output == OUTPUT_NULL else default_sink()
+        if sink is None:
+            logging.warning('Low-latency output needs the pyaudio package, using ffplay')
+            return True
+        try:
+            self.playback = PlaybackEngine(sink, target_ms=self.playback_target_ms).start()
+        except Exception as e:
+            logging.error('Could not open the audio output: %s', e)
+            return False
+        return True
+
+    def stop_playback(self):
+        playback, self.playback = self.playback, None
+        if playback:
+            playback.stop()
+
+    def decoder_alive(self):
+        if self.playback_input is not None:
+            return self.playback_input.alive()
+        return self.process is not None and self.process.poll() is None
+
+    def close_decoder(self):
+        tap, self.recording_tap = self.recording_tap, None
+        if tap:
+            try:
+                tap.close()  # Also finishes the recording file
+            except OSError:
+                pass
+        playback_input, self.playback_input = self.playback_input, None
+        if playback_input:
+            try:
+                playback_input.close()
+            except OSError:
+                pass
+        process, self.process = self.process, None
+        # End of input stops ffplay, it is killed if it doesn't within the timeout
+        default_supervisor().stop(process)
+
+    def open_decoder(self, header):
+        # Called on the transport thread when a sender connects with a format
+        # the running decoder can't take, so that decoder is replaced
+        self.close_decoder()
+        self.header = header
+        if self.playback:
+            logging.info('Decoding %s in-process', header.profile.label)
+            self.playback_input = self.playback.input(header, self.ffmpeg_exe, creationflags=self.creationflags)
+            sink = self.playback_input
+        else:
+            cmd = ffplay_command(self.ffplay_exe, header)
+            logging.info('Decoding %s: %s', header.profile.label, ' '.join(cmd))
+            self.process = spawn(cmd, 'ffplay', stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                 stderr=subprocess.DEVNULL, creationflags=self.creationflags)
+            sink = self.process.stdin
+        if self.recording_store is not None:
+            # Record the received bytes as they are: no second decoder, no re-encode
+            self.recording_tap = RecordingTap(sink, self.recording_store, header)
+            return self.recording_tap
+        return sink
+
+    def mixer(self):
+        return getattr(self.transport, 'mixer', None)
+
+    def senders(self):
+        transport = self.transport
+        if transport is None or transport.closed.is_set():
+            return 0
+        if self.mix:
+            return len(transport.transport.sessions)
+        return int(transport.counters()['connected'])
+
+    def counters(self):
+        # The transport is created on the engine thread and replaced on restart
+        transport = self.transport
+        counters = transport.counters() if transport else idle_counters()
+        playback = self.playback
+        if playback is not None:
+            # Unlike ffplay's, the in-process buffer can be seen
+            counters['buffer_ms'] = playback.buffer_ms()
+            counters['underruns'] += playback.underruns
+            counters['drift_ppm'] = playback.drift.ppm()
+        return counters
+
+    def load(self):
+        """What the discovery beacon announces, see discovery.Beacon."""
+        transport = self.transport
+        if transport is None or transport.closed.is_set():
+            return {'state': 'idle', 'senders': 0}
+        senders = self.senders()
+        return {'state': 'receiving' if senders else 'listening', 'senders': senders}
+
+    def status(self):
+        return {
+            'state': self.state,
+            'detail': self.detail,
+            'port': self.port,
+            'transport': self.transport_mode,
+            'mix': self.mix,
+            'output': self.output,
+            'in_process': self.playback is not None,  # False for OUTPUT_DEVICE without pyaudio, ffplay plays
+            'recording': self.recording_store is not None,
+            'codec': self.header.codec if self.header else None,
+            'senders': self.senders(),
+            'counters': self.counters(),
+        }
@@ -0,0 +1,435 @@
+"""Mix several senders into one output for Audio Receiver's "Mix senders" mode.
+
+Every sender keeps its own TCP connection (see
+:class:`stream_transport.MultiReceiver`). Its stream is decoded to 48 kHz
+stereo s16le by its own ffmpeg (PCM senders are used as they are), buffered
+per source and mixed in 10 ms blocks into a single output, normally the stdin
+of the receiver's ffplay. Each sender runs on its own sound card clock, so
+every source is resampled by a fraction of a percent to hold its buffer at a
+fixed fill level instead of slowly drifting into underruns or extra latency.
+
+numpy is used for mixing when it is installed. Without it the mixer falls back
+to the array module, working on whole blocks through ``map`` rather than
+sample by sample, which is fine for a handful of sources.
+"""
+import array
+import logging
+import math
+import operator
+import subprocess
+import sys
+import threading
+import time
+from itertools import repeat
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from log_pipeline import FfmpegLog
+from playback import stretch_block
+from process_supervisor import default_supervisor, spawn
+from stream_format import CHANNELS, CODEC_PCM, SAMPLE_RATE
+from stream_transport import DEFAULT_PORT, MAX_SENDERS, MultiReceiver
+
+MIX_BLOCK_MS = 10
+SNAPSHOT_INTERVAL_MS = 200         # How often the mixer reports levels and buffers to on_snapshot
+FRAME_BYTES = CHANNELS * 2         # s16le
+SOURCE_TARGET_MS = 60              # Buffer each source tries to keep, absorbs network and decoder bursts
+SOURCE_MAX_MS = 300                # Beyond this a source skips ahead instead of adding latency
+MAX_RATE_ADJUST = 0.005            # +/-0.5 % resampling, far below what anyone can hear
+FILL_SMOOTHING = 0.02              # Per block, so the rate follows the fill level over about half a second
+LEVEL_FLOOR_DB = -60.0
+PEAK_DECAY_DB = 0.5                # Per block, how fast the peak meter falls back
+MAX_GAIN = 2.0
+
+
+def _dbfs(value):
+    return max(LEVEL_FLOOR_DB, 20 * math.log10(value)) if value > 0 else LEVEL_FLOOR_DB
+
+
+class MixerSource:
+    """Decoded PCM from one sender, waiting to be mixed.
+
+    ``name`` is unique in the mixer, ``sender`` the name it was added under
+    (two connections from one sender share it). ``write`` is called by the
+    transport or the decoder thread, ``read_block`` by the mixer thread.
+    """
+
+    def __init__(self, name, header=None, gain=1.0, target_ms=SOURCE_TARGET_MS, max_ms=SOURCE_MAX_MS, sender=None):
+        self.name = name
+        self.sender = sender or name
+        self.header = header
+        self.gain = gain
+        self.muted = False
+        self.target_frames = SAMPLE_RATE * target_ms // 1000
+        self.max_frames = SAMPLE_RATE * max_ms // 1000
+        self.ratio = 1.0
+        self.level_db = LEVEL_FLOOR_DB
+        self.peak_db = LEVEL_FLOOR_DB
+        self.underruns = 0
+        self.frames_skipped = 0
+        self.ended = False
+        self.primed = False
+        self._buffer = bytearray()
+        self._fill = float(self.target_frames)
+        self._phase = 0.0  # Fractional input frames carried over to the next block
+        self._lock = threading.Lock()
+
+    def write(self, data):
+        with self._lock:
+            self._buffer += data
+            excess = len(self._buffer) // FRAME_BYTES - self.max_frames
+            if excess > 0:
+                # Far behind (a stalled connection caught up at once): skip back to the target
+                skip = len(self._buffer) // FRAME_BYTES - self.target_frames
+                del self._buffer[:skip * FRAME_BYTES]
+                self.frames_skipped += skip
+                self._fill = float(self.target_frames)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.ended = True
+
+    def buffered_frames(self):
+        return len(self._buffer) // FRAME_BYTES
+
+    def read_block(self, frames):
+        """Take about ``frames`` frames, or None while there is nothing to play.
+
+        Returns ``(data, taken)`` where ``taken`` is the number of input frames
+        in ``data``; the mixer stretches them to ``frames``.
+        """
+        with self._lock:
+            available = len(self._buffer) // FRAME_BYTES
+            if not self.primed:
+                # Start (and restart after an underrun) with a full buffer
+                if available < self.target_frames and not (self.ended and available):
+                    return None
+                self.primed = True
+            self._fill += FILL_SMOOTHING * (available - self._fill)
+            error = (self._fill - self.target_frames) / self.target_frames
+            self.ratio = 1.0 + max(-MAX_RATE_ADJUST, min(MAX_RATE_ADJUST, error * MAX_RATE_ADJUST))
+            wanted = frames * self.ratio + self._phase
+            taken = int(wanted)
+            self._phase = wanted - taken
+            if available < taken:
+                if not self.ended:
+                    self.underruns += 1
+                self.primed = False
+                self._phase = 0.0
+                data = bytes(self._buffer[:available * FRAME_BYTES]) + bytes((frames - available) * FRAME_BYTES)
+                del self._buffer[:available * FRAME_BYTES]
+                return data, frames
+            data = bytes(self._buffer[:taken * FRAME_BYTES])
+            del self._buffer[:taken * FRAME_BYTES]
+        return data, taken
+
+    def update_level(self, rms, peak):
+        self.level_db = _dbfs(rms)
+        self.peak_db = max(_dbfs(peak), self.peak_db - PEAK_DECAY_DB)
+
+    def snapshot(self):
+        return {
+            'name': self.name,
+            'codec': self.header.codec if self.header else None,
+            'gain': self.gain,
+            'muted': self.muted,
+            'level_db': round(self.level_db, 1),
+            'peak_db': round(self.peak_db, 1),
+            'buffer_ms': round(self.buffered_frames() * 1000 / SAMPLE_RATE, 1),
+            'drift_ppm': round((self.ratio - 1.0) * 1e6),
+            'underruns': self.underruns,
+            'frames_skipped': self.frames_skipped,
+        }
+
+
+def _mix_numpy(blocks, frames):
+    mix = numpy.zeros(frames * CHANNELS, dtype=numpy.float32)
+    for source, data, taken, gain in blocks:
+        samples = numpy.frombuffer(data, dtype='<i2').astype(numpy.float32)
+        if taken != frames:
+            # Linear interpolation from ``taken`` input frames onto ``frames`` output frames
+            frames_in = samples.reshape(-1, CHANNELS)
+            positions = numpy.arange(frames) * (taken / frames)
+            index = numpy.arange(taken)
+            samples = numpy.stack([numpy.interp(positions, index, frames_in[:, channel])
+                                   for channel in range(CHANNELS)], axis=1).ravel().astype(numpy.float32)
+        samples *= gain
+        source.update_level(float(numpy.sqrt(numpy.mean(samples * samples))) / 32768,
+                            float(numpy.max(numpy.abs(samples))) / 32768)
+        mix += samples
+    numpy.clip(mix, -32768, 32767, out=mix)
+    return mix.astype('<i2').tobytes()
+
+
+def _mix_array(blocks, frames):
+    # Whole blocks through map() and the builtins, so the per-sample work stays in C
+    mix = None
+    for source, data, taken, gain in blocks:
+        if not gain:
+            source.update_level(0, 0)
+            continue
+        if taken != frames:
+            # Repeat or drop single frames; coarser than interpolation but cheap without numpy
+            data = stretch_block(data, taken, frames, FRAME_BYTES)
+        samples = array.array('h', data)
+        if sys.byteorder == 'big':
+            samples.byteswap()
+        samples = samples.tolist()
+        # Levels from the samples as received, scaled by the gain afterwards
+        energy = sum(map(operator.mul, samples, samples))
+        peak = max(max(samples), -min(samples))
+        source.update_level(math.sqrt(energy / len(samples)) * gain / 32768, peak * gain / 32768)
+        if gain != 1:
+            samples = list(map(int, map(float(gain).__mul__, samples)))
+        mix = samples if mix is None else list(map(operator.add, mix, samples))
+    if mix is None:
+        return bytes(frames * FRAME_BYTES)
+    if max(mix) > 32767 or min(mix) < -32768:
+        mix = map(max, repeat(-32768), map(min, repeat(32767), mix))
+    out = array.array('h', mix)
+    if sys.byteorder == 'big':
+        out.byteswap()
+    return out.tobytes()
+
+
+class Mixer:
+    """Mix all sources into ``output`` in fixed blocks, paced by the clock.
+
+    Silence is written while no source has audio, so the output keeps running
+    between senders. Gains are remembered by sender name (not by the
+    " (2)" names given to a second connection from the same sender), so a
+    sender that reconnects keeps the gain it had. ``on_snapshot(mixer,
+    sources)`` is called from the mixer thread every ``snapshot_ms`` with
+    :meth:`snapshot`, for a meter that needn't poll.
+    """
+
+    def __init__(self, output, block_ms=MIX_BLOCK_MS, on_snapshot=None, snapshot_ms=SNAPSHOT_INTERVAL_MS):
+        self.output = output
+        self.on_snapshot = on_snapshot
+        self.snapshot_blocks = max(1, snapshot_ms // block_ms)
+        self.block_frames = SAMPLE_RATE * block_ms // 1000
+        self.sources = []
+        self.gains = {}
+        self.backend = 'numpy' if numpy is not None else 'array'
+        self.blocks = 0
+        self.late_blocks = 0
+        self.error = None
+        self.closed = threading.Event()
+        self._stopping = False
+        self._lock = threading.Lock()
+        self._mix = _mix_numpy if numpy is not None else _mix_array
+
+    def add_source(self, name, header=None):
+        with self._lock:
+            names = {source.name for source in self.sources}
+            unique, counter = name, 2
+            while unique in names:
+                unique = f'{name} ({counter})'
+                counter += 1
+            source = MixerSource(unique, header, gain=self.gains.get(name, 1.0), sender=name)
+            self.sources.append(source)
+        logging.info('Mixer source added: %s (%s)', unique, header)
+        return source
+
+    def set_gain(self, name, gain):
+        """Set the gain of the source called ``name`` and remember it for its sender."""
+        gain = max(0.0, min(MAX_GAIN, gain))
+        with self._lock:
+            sender = name
+            for source in self.sources:
+                if source.name == name:
+                    source.gain = gain
+                    sender = source.sender
+            self.gains[sender] = gain
+
+    def set_muted(self, name, muted):
+        with self._lock:
+            for source in self.sources:
+                if source.name == name:
+                    source.muted = muted
+
+    def snapshot(self):
+        with self._lock:
+            return [source.snapshot() for source in self.sources]
+
+    def start(self):
+        logging.info('Mixer running in %d ms blocks using %s', self.block_frames * 1000 // SAMPLE_RATE, self.backend)
+        threading.Thread(target=self._run, name='mixer', daemon=True).start()
+
+    def _next_blocks(self):
+        blocks = []
+        with self._lock:
+            for source in list(self.sources):
+                if source.ended and source.buffered_frames() == 0:
+                    self.sources.remove(source)
+                    logging.info('Mixer source removed: %s %s', source.name, source.snapshot())
+                    continue
+                block = source.read_block(self.block_frames)
+                if block is None:
+                    source.update_level(0, 0)
+                    continue
+                blocks.append((source, block[0], block[1], 0.0 if source.muted else source.gain))
+        return blocks
+
+    def _run(self):
+        block_s = self.block_frames / SAMPLE_RATE
+        silence = bytes(self.block_frames * FRAME_BYTES)
+        deadline = time.monotonic()
+        try:
+            while not self._stopping:
+                blocks = self._next_blocks()
+                data = self._mix(blocks, self.block_frames) if blocks else silence
+                self.output.write(data)
+                self.output.flush()
+                self.blocks += 1
+                if self.on_snapshot and self.blocks % self.snapshot_blocks == 0:
+                    self._report_snapshot()
+                deadline += block_s
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                elif delay < -5 * block_s:
+                    # Fell well behind (machine suspended, output blocked); don't burst to catch up
+                    self.late_blocks += 1
+                    deadline = time.monotonic()
+        except (OSError, ValueError) as e:
+            if not self._stopping:
+                self.error = e
+                logging.error('Mixer output failed: %s', e)
+        finally:
+            self.closed.set()
+
+    def _report_snapshot(self):
+        try:
+            self.on_snapshot(self, self.snapshot())
+        except Exception as e:
+            logging.error('Reporting the mixer levels failed: %s', e)
+
+    def stop(self):
+        self._stopping = True
+
+
+def decoder_command(ffmpeg_exe, header):
+    """ffmpeg command that turns one sender's stream into the mixer's PCM format."""
+    return [
+        ffmpeg_exe,
+        '-hide_banner', '-loglevel', 'error',
+        '-fflags', 'nobuffer', '-flags', 'low_delay',
+        *header.profile.decoder_input_args(header),
+        '-i', 'pipe:0',
+        '-f', 's16le', '-ar', str(SAMPLE_RATE), '-ac', str(CHANNELS),
+        'pipe:1'
+    ]
+
+
+class DecoderSink:
+    """Feeds one sender into its own ffmpeg and the decoded PCM into ``source``.
+
+    Also used by :mod:`playback` for compressed streams.
+    """
+
+    def __init__(self, ffmpeg_exe, header, source, creationflags=0):
+        self.source = source
+        self.process = spawn(decoder_command(ffmpeg_exe, header), 'decoder', stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=creationflags)
+        FfmpegLog('decoder').start(self.process.stderr)
+        self.thread = threading.Thread(target=self._read_loop, name='mixer-decoder', daemon=True)
+        self.thread.start()
+
+    def _read_loop(self):
+        try:
+            while True:
+                data = self.process.stdout.read1(FRAME_BYTES * 480)
+                if not data:
+                    break
+                self.source.write(data)
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.source.close()
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def write(self, data):
+        self.process.stdin.write(data)
+
+    def flush(self):
+        self.process.stdin.flush()
+
+    def close(self):
+        # End of input, then a kill if ffmpeg hasn't exited within the timeout
+        default_supervisor().stop(self.process)
+
+
+class MixingReceiver:
+    """Accept up to ``max_senders`` senders at once and play them through one :class:`Mixer`.
+
+    Used like the other receivers: :meth:`listen`, :meth:`start`, wait for
+    ``closed``, :meth:`stop`. ``output`` is the binary writable the mix goes
+    to; ``ffmpeg_exe`` decodes compressed senders.
+    """
+
+    def __init__(self, ffmpeg_exe, port=DEFAULT_PORT, max_senders=MAX_SENDERS,
+                 on_session=None, on_session_end=None, creationflags=0, on_snapshot=None):
+        self.ffmpeg_exe = ffmpeg_exe
+        self.creationflags = creationflags
+        self.on_snapshot = on_snapshot  # Passed on to the Mixer
+        self.mixer = None
+        self.transport = MultiReceiver(port, max_sessions=max_senders, on_session=on_session,
+                                       on_session_end=on_session_end, on_closed=self._on_transport_closed)
+        self.closed = threading.Event()
+
+    @property
+    def stats(self):
+        return {'senders': len(self.transport.sessions), 'mixer_blocks': self.mixer.blocks if self.mixer else 0,
+                'late_blocks': self.mixer.late_blocks if self.mixer else 0}
+
+    def counters(self):
+        """The senders' transport counters, with the buffer level and underruns taken from the mixer."""
+        counters = self.transport.counters()
+        mixer = self.mixer
+        sources = mixer.snapshot() if mixer else []
+        if sources:
+            counters['buffer_ms'] = min(source['buffer_ms'] for source in sources)
+            counters['underruns'] += sum(source['underruns'] for source in sources)
+        if mixer:
+            counters['late'] += mixer.late_blocks
+        return counters
+
+    def listen(self):
+        return self.transport.listen()
+
+    def start(self, output):
+        self.mixer = Mixer(output, on_snapshot=self.on_snapshot)
+        self.mixer.start()
+        threading.Thread(target=self._watch_mixer, name='mixer-watch', daemon=True).start()
+        self.transport.start(self._open_source)
+
+    def _open_source(self, receiver, header):
+        source = self.mixer.add_source(receiver.peer[0], header)
+        if header.codec == CODEC_PCM and header.sample_rate == SAMPLE_RATE and header.channels == CHANNELS:
+            return source  # Already in the mixer's format, no decoder needed
+        try:
+            return DecoderSink(self.ffmpeg_exe, header, source, self.creationflags)
+        except OSError:
+            source.close()
+            raise
+
+    def _watch_mixer(self):
+        # The output going away (ffplay closed) ends the whole receiver
+        self.mixer.closed.wait()
+        self.transport.stop()
+
+    def _on_transport_closed(self, transport, error):
+        if self.mixer:
+            self.mixer.stop()
+        self.closed.set()
+
+    def stop(self):
+        self.transport.stop()
@@ -0,0 +1,457 @@
+"""Audio capture in Python for Audio Streamer, instead of ffmpeg's dshow input.
+
+With ``-f dshow -audio_buffer_size 50`` ffmpeg decides when captured audio
+moves on, and 50 ms is as low as dshow goes. :class:`CaptureStream` reads
+s16le PCM in short periods (10 ms by default) from a pluggable backend on
+its own thread and puts it in a preallocated :class:`RingBuffer`. From there
+it is either piped to the ffmpeg encoder's stdin (see :func:`feed_encoder`)
+or, for the PCM codec, read directly by the stream's ``LiveSource``, so no
+encoder process is needed at all.
+
+Backends:
+
+* :class:`WasapiBackend` -- the VB-Cable capture device (or a render
+  device's loopback) through WASAPI, using the optional ``pyaudiowpatch``.
+* :class:`PulseMonitorBackend` -- a PulseAudio/PipeWire source through
+  ``parec``, normally the monitor of the default output.
+* :class:`FileBackend` and :class:`SyntheticBackend` -- a WAV/raw file or a
+  sine tone, paced in real time, for machines without the sound setup.
+
+The capture thread never waits for the consumer: when the ring is full the
+newest audio is dropped and counted as an overrun.
+"""
+import array
+import logging
+import math
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import wave
+
+from process_supervisor import default_supervisor, spawn
+from stream_format import CHANNELS, SAMPLE_RATE
+
+CAPTURE_PERIOD_MS = 10
+CAPTURE_PERIOD_MIN_MS = 2
+CAPTURE_PERIOD_MAX_MS = 50        # What dshow gives anyway
+CAPTURE_BUFFER_MS = 200           # Ring depth, how far the consumer may fall behind before audio is dropped
+SAMPLE_BYTES = 2                  # s16le
+OVERRUN_LOG_INTERVAL = 5.0        # Seconds between overrun warnings
+READ_TIMEOUT = 0.5
+
+CAPTURE_FFMPEG = 'dshow'
+CAPTURE_WASAPI = 'wasapi'
+CAPTURE_PULSE = 'pulse'
+CAPTURE_FILE = 'file'
+CAPTURE_SYNTHETIC = 'synthetic'
+CAPTURE_MODES = {CAPTURE_FFMPEG: 'ffmpeg (dshow)', CAPTURE_WASAPI: 'WASAPI'}  # What the streamer offers
+
+
+class RingBuffer:
+    """A fixed-size byte ring for exactly one writer thread and one reader thread.
+
+    The writer only moves ``write_pos`` and the reader only ``read_pos``; both
+    count bytes since the start and each is published after the copy it
+    covers, so neither side needs a lock. An Event wakes a waiting reader.
+    Writes and reads are whole multiples of ``align`` bytes (one PCM frame).
+    """
+
+    def __init__(self, capacity, align=1):
+        self.align = align
+        self.capacity = max(capacity - capacity % align, align)
+        self.buffer = bytearray(self.capacity)
+        self.view = memoryview(self.buffer)
+        self.write_pos = 0
+        self.read_pos = 0
+        self.overruns = 0
+        self.dropped_bytes = 0
+        self.max_fill = 0
+        self.readable = threading.Event()
+
+    def fill(self):
+        return self.write_pos - self.read_pos
+
+    def write(self, data):
+        """Copy as much of ``data`` as fits and return the number of bytes taken."""
+        free = self.capacity - self.fill()
+        size = len(data) - len(data) % self.align
+        if size > free:
+            self.overruns += 1
+            self.dropped_bytes += size - free
+            size = free
+        if size:
+            start = self.write_pos % self.capacity
+            first = min(size, self.capacity - start)
+            self.view[start:start + first] = data[:first]
+            if first < size:
+                self.view[:size - first] = data[first:size]
+            self.write_pos += size
+            self.max_fill = max(self.max_fill, self.fill())
+        self.readable.set()
+        return size
+
+    def read(self, max_bytes):
+        """Return up to ``max_bytes`` of what is buffered, possibly nothing."""
+        size = min(self.fill(), max_bytes)
+        size -= size % self.align
+        if not size:
+            return b''
+        start = self.read_pos % self.capacity
+        first = min(size, self.capacity - start)
+        data = bytes(self.view[start:start + first])
+        if first < size:
+            data += bytes(self.view[:size - first])
+        self.read_pos += size
+        return data
+
+    def discard(self, max_bytes):
+        """Drop up to ``max_bytes`` of the oldest audio; reader side, like :meth:`read`."""
+        size = min(self.fill(), max_bytes)
+        size -= size % self.align
+        self.read_pos += size
+        return size
+
+    def wait(self, timeout):
+        # Clear first and check again, so a write between the two can't be missed
+        self.readable.clear()
+        if self.fill():
+            return True
+        return self.readable.wait(timeout)
+
+
+class _PacedBackend:
+    # Generated audio is handed out no faster than a sound card would deliver it
+
+    def open(self, sample_rate, channels, period_frames):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.period_frames = period_frames
+        self.next_at = time.monotonic()
+
+    def read(self):
+        self.next_at += self.period_frames / self.sample_rate
+        delay = self.next_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return self._period()
+
+    def close(self):
+        pass
+
+
+class SyntheticBackend(_PacedBackend):
+    """A continuous sine tone."""
+
+    name = 'synthetic'
+
+    def __init__(self, frequency=440.0, amplitude=0.25):
+        self.frequency = frequency
+        self.amplitude = amplitude
+        self.phase = 0
+
+    def _period(self):
+        step = 2 * math.pi * self.frequency / self.sample_rate
+        peak = int(32767 * self.amplitude)
+        samples = array.array('h')
+        for i in range(self.period_frames):
+            samples.extend([int(peak * math.sin((self.phase + i) * step))] * self.channels)
+        self.phase = (self.phase + self.period_frames) % self.sample_rate
+        if sys.byteorder == 'big':
+            samples.byteswap()
+        return samples.tobytes()
+
+
+class FileBackend(_PacedBackend):
+    """A WAV file, or raw s16le at the stream's rate, played in a loop unless ``loop`` is false."""
+
+    name = 'file'
+
+    def __init__(self, path, loop=True):
+        self.path = path
+        self.loop = loop
+        self.wav = None
+        self.file = None
+
+    def open(self, sample_rate, channels, period_frames):
+        super().open(sample_rate, channels, period_frames)
+        try:
+            self.wav = wave.open(self.path, 'rb')
+        except wave.Error:
+            self.file = open(self.path, 'rb')  # Not a WAV, raw s16le
+            return
+        params = (self.wav.getframerate(), self.wav.getnchannels(), self.wav.getsampwidth())
+        if params != (sample_rate, channels, SAMPLE_BYTES):
+            self.close()
+            raise ValueError(f'{self.path} is {params[0]} Hz, {params[1]} channels, {params[2] * 8} bit; '
+                             f'need {sample_rate} Hz, {channels} channels, 16 bit')
+
+    def _read(self, frames):
+        if self.wav is not None:
+            return self.wav.readframes(frames)
+        return self.file.read(frames * self.channels * SAMPLE_BYTES)
+
+    def _rewind(self):
+        if self.wav is not None:
+            self.wav.rewind()
+        else:
+            self.file.seek(0)
+
+    def _period(self):
+        data = self._read(self.period_frames)
+        missing = self.period_frames - len(data) // (self.channels * SAMPLE_BYTES)
+        if missing and self.loop:
+            self._rewind()
+            data += self._read(missing)  # An empty file stays empty and ends the capture
+        return data
+
+    def close(self):
+        for file in (self.wav, self.file):
+            if file is not None:
+                file.close()
+        self.wav = self.file = None
+
+
+class PulseMonitorBackend:
+    """A PulseAudio or PipeWire source through ``parec``; the default output's monitor unless told otherwise."""
+
+    name = 'parec'
+
+    @staticmethod
+    def available():
+        return shutil.which('parec') is not None
+
+    def __init__(self, source='@DEFAULT_MONITOR@'):
+        self.source = source
+        self.process = None
+
+    def open(self, sample_rate, channels, period_frames):
+        self.period_bytes = period_frames * channels * SAMPLE_BYTES
+        latency_ms = max(1, period_frames * 1000 // sample_rate)
+        command = ['parec', '--raw', '--format=s16le', f'--rate={sample_rate}', f'--channels={channels}',
+                   f'--latency-msec={latency_ms}', f'--device={self.source}']
+        logging.debug('Running capture command: %s', ' '.join(command))
+        self.process = spawn(command, 'parec', stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def read(self):
+        return self.process.stdout.read(self.period_bytes)
+
+    def close(self):
+        process, self.process = self.process, None
+        if process is not None:
+            default_supervisor().stop(process, timeout=1)
+            process.stdout.close()
+
+
+class WasapiBackend:
+    """A WASAPI input through ``pyaudiowpatch``, the PyAudio fork that can also open loopback devices.
+
+    ``device_name`` is matched against the start of the device names WASAPI
+    reports. With ``loopback`` the named render device's loopback is opened
+    instead, which captures whatever plays on it.
+    """
+
+    name = 'WASAPI'
+
+    @staticmethod
+    def available():
+        try:
+            import pyaudiowpatch
+        except ImportError:
+            return False
+        return True
+
+    def __init__(self, device_name, loopback=False):
+        self.device_name = device_name
+        self.loopback = loopback
+        self.audio = None
+        self.stream = None
+
+    def _find_device(self, pyaudio, channels):
+        host_api = self.audio.get_host_api_info_by_type(pyaudio.paWASAPI)['index']
+        for index in range(self.audio.get_device_count()):
+            info = self.audio.get_device_info_by_index(index)
+            if (info['hostApi'] == host_api and info['name'].startswith(self.device_name)
+                    and bool(info.get('isLoopbackDevice')) == self.loopback
+                    and info['maxInputChannels'] >= channels):
+                return info
+        raise OSError(f'WASAPI device {self.device_name!r} not found')
+
+    def open(self, sample_rate, channels, period_frames):
+        import pyaudiowpatch as pyaudio
+        self.audio = pyaudio.PyAudio()
+        try:
+            info = self._find_device(pyaudio, channels)
+            self.period_frames = period_frames
+            # Shared mode: sample_rate must match the device format set in the Sound control panel
+            self.stream = self.audio.open(format=pyaudio.paInt16, channels=channels, rate=sample_rate, input=True,
+                                          input_device_index=info['index'], frames_per_buffer=period_frames)
+        except Exception:
+            self.close()
+            raise
+        logging.info('Capturing from %s through WASAPI', info['name'])
+
+    def read(self):
+        return self.stream.read(self.period_frames, exception_on_overflow=False)
+
+    def close(self):
+        if self.stream is not None:
+            try:
+                self.stream.stop_stream()
+                self.stream.close()
+            except Exception as e:
+                logging.debug('Closing the WASAPI stream failed: %s', e)
+            self.stream = None
+        if self.audio is not None:
+            self.audio.terminate()
+            self.audio = None
+
+
+def backend_for(mode, device_name=None, path=None):
+    """The backend for a ``CAPTURE_*`` mode other than ``CAPTURE_FFMPEG``."""
+    if mode == CAPTURE_WASAPI:
+        return WasapiBackend(device_name)
+    if mode == CAPTURE_PULSE:
+        return PulseMonitorBackend(device_name) if device_name else PulseMonitorBackend()
+    if mode == CAPTURE_FILE:
+        return FileBackend(path)
+    if mode == CAPTURE_SYNTHETIC:
+        return SyntheticBackend()
+    raise ValueError(f'Unknown capture mode {mode!r}')
+
+
+def capture_available(mode):
+    if mode == CAPTURE_WASAPI:
+        return WasapiBackend.available()
+    if mode == CAPTURE_PULSE:
+        return PulseMonitorBackend.available()
+    return True
+
+
+class CaptureStream:
+    """Capture ``period_ms`` periods from ``backend`` into a ring of ``buffer_ms``.
+
+    Behaves like a readable pipe: :meth:`read` and :meth:`read1` block until
+    audio is there and return b'' once the capture has ended (closed, or the
+    backend failed or ran out), so it can stand in for an encoder's stdout.
+    The backend is opened on the capture thread; a failure to open ends the
+    stream the same way, so the caller's restart logic covers both.
+    """
+
+    def __init__(self, backend, sample_rate=SAMPLE_RATE, channels=CHANNELS,
+                 period_ms=CAPTURE_PERIOD_MS, buffer_ms=CAPTURE_BUFFER_MS):
+        self.backend = backend
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.period_ms = period_ms
+        self.frame_bytes = channels * SAMPLE_BYTES
+        self.period_frames = max(1, sample_rate * period_ms // 1000)
+        # At least two periods, so one can be read while the next is captured
+        self.ring = RingBuffer(self.frame_bytes * max(sample_rate * buffer_ms // 1000, 2 * self.period_frames),
+                               self.frame_bytes)
+        self.frames_captured = 0
+        self.eof = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._overruns_logged = 0
+        self._overrun_logged_at = 0.0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='capture', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            self.backend.open(self.sample_rate, self.channels, self.period_frames)
+            logging.info('Capturing %d ms periods using %s, %d ms buffer', self.period_ms, self.backend.name,
+                         self.buffer_ms())
+            while not self._stop.is_set():
+                data = self.backend.read()
+                if not data:
+                    logging.info('Capture source ended')
+                    break
+                self.ring.write(data)
+                self.frames_captured += len(data) // self.frame_bytes
+                if self.ring.overruns != self._overruns_logged:
+                    self._log_overruns()
+        except Exception as e:
+            if not self._stop.is_set():
+                logging.error('Audio capture failed: %s', e)
+        finally:
+            self.eof.set()
+            self.ring.readable.set()
+            try:
+                self.backend.close()
+            except Exception as e:
+                logging.debug('Closing the capture backend failed: %s', e)
+
+    def _log_overruns(self):
+        now = time.monotonic()
+        if now - self._overrun_logged_at < OVERRUN_LOG_INTERVAL:
+            return
+        logging.warning('Capture buffer overrun: %d so far, %.0f ms of audio dropped', self.ring.overruns,
+                        self._ms(self.ring.dropped_bytes))
+        self._overruns_logged = self.ring.overruns
+        self._overrun_logged_at = now
+
+    def _ms(self, size):
+        return size / self.frame_bytes * 1000 / self.sample_rate
+
+    def buffer_ms(self):
+        return round(self._ms(self.ring.capacity))
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.ring.capacity
+        while True:
+            data = self.ring.read(size)
+            if data or self.eof.is_set() and not self.ring.fill():
+                return data
+            self.ring.wait(READ_TIMEOUT)
+
+    read1 = read
+
+    def close(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(1.0)
+        self.eof.set()
+        self.ring.readable.set()
+
+    def stats(self):
+        return {
+            'backend': self.backend.name,
+            'period_ms': self.period_ms,
+            'buffer_ms': self.buffer_ms(),
+            'captured_s': round(self.frames_captured / self.sample_rate, 3),
+            'fill_ms': round(self._ms(self.ring.fill()), 1),
+            'max_fill_ms': round(self._ms(self.ring.max_fill), 1),
+            'overruns': self.ring.overruns,
+            'dropped_ms': round(self._ms(self.ring.dropped_bytes), 1),
+        }
+
+
+def feed_encoder(capture, pipe):
+    """Copy ``capture`` into ``pipe`` (an encoder's stdin) on a new thread; close ``pipe`` when capture ends."""
+    def run():
+        try:
+            while True:
+                data = capture.read(capture.ring.capacity)
+                if not data:
+                    break
+                pipe.write(data)
+                pipe.flush()
+        except (OSError, ValueError) as e:
+            logging.debug('Encoder input closed: %s', e)
+            capture.close()  # The encoder is gone, stop capturing for it
+        finally:
+            try:
+                pipe.close()
+            except OSError:
+                pass
+    thread = threading.Thread(target=run, name='capture-feed', daemon=True)
+    thread.start()
+    return thread
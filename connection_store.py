@@ -0,0 +1,174 @@
+"""Saved receivers for Audio Streamer.
+
+The connection history used to be ``ip_history.json`` next to the program,
+which in the packaged app is the read-only PyInstaller bundle, so it was
+lost or could not be written at all. :class:`ConnectionStore` keeps it in
+AppData, indexed by address, and writes it atomically: the new contents go
+to a temporary file that replaces the old one only once it is complete, so
+a crash mid-write leaves the previous version intact.
+
+Besides the name, every entry remembers what worked last time: the codec
+and transport of the last successful connection, how often it connected and
+the last measured round-trip time, so the sender can offer those settings
+again without probing.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+STORE_VERSION = 1
+MAX_CONNECTIONS = 10              # Most recently used first, the oldest is dropped
+
+
+def _new_entry(ip, name):
+    return {
+        'ip': ip,
+        'name': name,
+        'connections': 0,
+        'last_codec': None,
+        'last_transport': None,
+        'rtt_ms': None,
+        'last_connected': None,
+    }
+
+
+class ConnectionStore:
+    """Saved receivers keyed by IP address, most recently used first.
+
+    Safe to use from several threads; every change is written out at once.
+    ``legacy_path`` is an old ``ip_history.json`` (a list of ``[ip, name]``)
+    imported when the store does not exist yet.
+    """
+
+    def __init__(self, path, max_entries=MAX_CONNECTIONS, legacy_path=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.legacy_path = legacy_path
+        self._entries = {}        # ip -> entry, least recently used first
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            self._entries = {}
+            try:
+                with open(self.path, 'r', encoding='utf-8') as file:
+                    data = json.load(file)
+                for entry in reversed(data.get('connections', [])):  # Saved most recent first
+                    merged = _new_entry(entry['ip'], entry.get('name', ''))
+                    merged.update(entry)
+                    self._entries[merged['ip']] = merged
+            except FileNotFoundError:
+                self._import_legacy()
+            except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                # Keep the damaged file for inspection and start over
+                logging.error('Could not read %s, starting with no saved connections: %s', self.path, e)
+                try:
+                    os.replace(self.path, f'{self.path}.corrupt')
+                except OSError:
+                    pass
+        return self
+
+    def _import_legacy(self):
+        if not self.legacy_path or not os.path.exists(self.legacy_path):
+            return
+        try:
+            with open(self.legacy_path, 'r') as file:
+                history = json.load(file)
+            # ip_history.json kept the most recent first
+            for ip, name in reversed(history):
+                self._entries[ip] = _new_entry(ip, name)
+        except (OSError, ValueError, TypeError) as e:
+            logging.warning('Could not import %s: %s', self.legacy_path, e)
+            return
+        logging.info('Imported %d saved connections from %s', len(self._entries), self.legacy_path)
+        self._save()
+
+    def _save(self):
+        # Under the lock. Write a temporary file in the same directory, then swap it in.
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        data = {'version': STORE_VERSION, 'connections': list(reversed(self._entries.values()))}
+        fd, temp_path = tempfile.mkstemp(prefix='.connections-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump(data, file, indent=1)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logging.error('Could not save connections to %s: %s', self.path, e)
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def entries(self):
+        """Copies of all entries, most recently used first."""
+        with self._lock:
+            return [dict(entry) for entry in reversed(self._entries.values())]
+
+    def get(self, ip):
+        with self._lock:
+            entry = self._entries.get(ip)
+            return dict(entry) if entry else None
+
+    def _touch(self, ip, name=None):
+        # Under the lock: move ip to the most recent end, creating it if needed
+        entry = self._entries.pop(ip, None) or _new_entry(ip, name or '')
+        if name is not None:
+            entry['name'] = name
+        self._entries[ip] = entry
+        while len(self._entries) > self.max_entries:
+            del self._entries[next(iter(self._entries))]
+        return entry
+
+    def remember(self, ip, name):
+        """Save ``ip`` under ``name`` as the most recently used receiver."""
+        with self._lock:
+            self._touch(ip, name)
+            self._save()
+
+    def record_connection(self, ip, codec, transport, rtt_ms=None):
+        """Note a successful connection to a saved receiver and the settings it used."""
+        with self._lock:
+            if ip not in self._entries:
+                return  # Only receivers the user saved are remembered
+            entry = self._entries[ip]
+            entry['connections'] += 1
+            entry['last_codec'] = codec
+            entry['last_transport'] = transport
+            entry['last_connected'] = round(time.time())
+            if rtt_ms is not None:
+                entry['rtt_ms'] = round(rtt_ms, 1)
+            self._save()
+
+    def record_rtt(self, ip, rtt_ms):
+        with self._lock:
+            entry = self._entries.get(ip)
+            if entry is None:
+                return
+            entry['rtt_ms'] = round(rtt_ms, 1)
+            self._save()
+
+    def preferred_settings(self, ip):
+        """``(codec, transport)`` of the last successful connection to ``ip``, or None."""
+        with self._lock:
+            entry = self._entries.get(ip)
+            if entry is None or entry['last_codec'] is None or entry['last_transport'] is None:
+                return None
+            return entry['last_codec'], entry['last_transport']
+
+    def remove(self, ip):
+        with self._lock:
+            if self._entries.pop(ip, None) is None:
+                return False
+            self._save()
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._save()
@@ -0,0 +1,215 @@
+"""Audio device change notifications for Audio Streamer and Audio Receiver.
+
+Instead of asking Windows for the default speakers every few seconds,
+:class:`DeviceWatcher` registers an IMMNotificationClient with the
+MMDevice enumerator and is called back the moment a device is plugged in,
+removed or made the default. Nothing runs while nothing changes.
+
+The backend is pluggable: :class:`MMNotificationBackend` on Windows,
+:class:`PollingBackend` where pycaw is too old to have notification callbacks,
+and :class:`FakeBackend`, which only reports what it is told to, so the
+watcher and its users can be exercised on any platform.
+"""
+import collections
+import logging
+import threading
+
+EVENT_DEFAULT_CHANGED = 'default_changed'
+EVENT_ADDED = 'added'
+EVENT_REMOVED = 'removed'
+EVENT_STATE_CHANGED = 'state_changed'
+
+FLOW_RENDER = 0                   # EDataFlow.eRender
+ROLE_MULTIMEDIA = 1               # ERole.eMultimedia, the role AudioUtilities.GetSpeakers() follows
+POLL_INTERVAL = 5.0
+
+DeviceEvent = collections.namedtuple('DeviceEvent', 'kind device_id')
+
+
+def _audio_utilities():
+    # pycaw pulls in comtypes and initialises COM, so it is only imported once needed
+    try:
+        from pycaw.pycaw import AudioUtilities
+    except ImportError:  # Not Windows
+        return None
+    return AudioUtilities
+
+
+def speakers_id():
+    """Id of the default speakers, from either pycaw's AudioDevice or a bare IMMDevice."""
+    device = _audio_utilities().GetSpeakers()
+    device_id = getattr(device, 'id', None)
+    return device_id if device_id is not None else device.GetId()
+
+
+_client_class = None
+
+
+def _notification_client(emit):
+    global _client_class
+    if _client_class is None:
+        from pycaw.callbacks import MMNotificationClient
+
+        class NotificationClient(MMNotificationClient):
+            # Called on a COM worker thread: only hand the event on, never block or call back into COM here
+            def __init__(self, emit):
+                super().__init__()
+                self.emit = emit
+
+            def on_default_device_changed(self, flow, flow_id, role, role_id, default_device_id):
+                if flow_id == FLOW_RENDER and role_id == ROLE_MULTIMEDIA:
+                    self.emit(DeviceEvent(EVENT_DEFAULT_CHANGED, default_device_id))
+
+            def on_device_added(self, added_device_id):
+                self.emit(DeviceEvent(EVENT_ADDED, added_device_id))
+
+            def on_device_removed(self, removed_device_id):
+                self.emit(DeviceEvent(EVENT_REMOVED, removed_device_id))
+
+            def on_device_state_changed(self, device_id, new_state, new_state_id):
+                self.emit(DeviceEvent(EVENT_STATE_CHANGED, device_id))
+
+            def on_property_value_changed(self, device_id, property_struct, fmtid, pid):
+                pass  # Fires constantly (levels, formats) and never changes which device plays
+
+        _client_class = NotificationClient
+    return _client_class(emit)
+
+
+class MMNotificationBackend:
+    """Push notifications from the Windows MMDevice API."""
+
+    name = 'IMMNotificationClient'
+
+    @staticmethod
+    def available():
+        try:
+            import pycaw.callbacks
+        except ImportError:  # Not Windows, or pycaw older than its notification callbacks
+            return False
+        return True
+
+    def __init__(self):
+        self.enumerator = None
+        self.client = None
+
+    def start(self, emit):
+        self.enumerator = _audio_utilities().GetDeviceEnumerator()
+        self.client = _notification_client(emit)
+        self.enumerator.RegisterEndpointNotificationCallback(self.client)
+
+    def stop(self):
+        if self.enumerator is not None and self.client is not None:
+            try:
+                self.enumerator.UnregisterEndpointNotificationCallback(self.client)
+            except Exception as e:
+                logging.debug('Unregistering the device notification callback failed: %s', e)
+        self.enumerator = self.client = None
+
+
+class PollingBackend:
+    """Compare the default device id every ``interval`` seconds, like the app used to."""
+
+    name = 'polling'
+
+    def __init__(self, get_default_id, interval=POLL_INTERVAL):
+        self.get_default_id = get_default_id
+        self.interval = interval
+        self._stop = threading.Event()
+
+    def start(self, emit):
+        threading.Thread(target=self._run, args=(emit,), name='device-poll', daemon=True).start()
+
+    def _run(self, emit):
+        from comtypes import CoInitialize, CoUninitialize
+        CoInitialize()
+        try:
+            try:
+                current = self.get_default_id()
+            except Exception as e:
+                logging.error('Monitoring error: %s', e)
+                current = None
+            while not self._stop.wait(self.interval):
+                try:
+                    device_id = self.get_default_id()
+                except Exception as e:
+                    # GetSpeakers() fails for a moment while a device is being removed
+                    logging.error('Monitoring error: %s', e)
+                    continue
+                if device_id != current:
+                    current = device_id
+                    emit(DeviceEvent(EVENT_DEFAULT_CHANGED, device_id))
+        finally:
+            CoUninitialize()
+
+    def stop(self):
+        self._stop.set()
+
+
+class FakeBackend:
+    """A backend that only reports what :meth:`fire` is told to."""
+
+    name = 'fake'
+
+    def __init__(self):
+        self.emit = None
+
+    def start(self, emit):
+        self.emit = emit
+
+    def stop(self):
+        self.emit = None
+
+    def fire(self, kind, device_id=None):
+        if self.emit is not None:
+            self.emit(DeviceEvent(kind, device_id))
+
+
+def default_backend():
+    if MMNotificationBackend.available():
+        return MMNotificationBackend()
+    if _audio_utilities() is not None:
+        return PollingBackend(speakers_id)
+    return FakeBackend()
+
+
+class DeviceWatcher:
+    """Call ``on_change(event)`` with a :data:`DeviceEvent` whenever an audio endpoint changes.
+
+    ``on_change`` runs on whatever thread the backend reports from; a Tk app
+    should hand the event to its :class:`ui_bus.UiBus` with
+    :meth:`~ui_bus.UiBus.post` or :meth:`~ui_bus.UiBus.call`, never touch Tk
+    there. A failure to register falls back to polling so the app still
+    notices a new device, just later.
+    """
+
+    def __init__(self, on_change, backend=None):
+        self.on_change = on_change
+        self.backend = backend or default_backend()
+        self.running = False
+
+    def start(self):
+        self.running = True
+        try:
+            self.backend.start(self._emit)
+        except Exception as e:
+            if _audio_utilities() is None or isinstance(self.backend, PollingBackend):
+                self.running = False
+                raise
+            logging.warning('Device notifications unavailable (%s), polling instead', e)
+            self.backend = PollingBackend(speakers_id)
+            self.backend.start(self._emit)
+        logging.info('Watching audio devices using %s', self.backend.name)
+
+    def _emit(self, event):
+        if not self.running:
+            return
+        logging.info('Audio device event: %s %s', event.kind, event.device_id)
+        try:
+            self.on_change(event)
+        except Exception as e:
+            logging.error('Device change handler failed: %s', e)
+
+    def stop(self):
+        self.running = False
+        self.backend.stop()
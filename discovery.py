@@ -0,0 +1,217 @@
+"""Find Audio Receivers on the local network and measure the round trip to each.
+
+A receiver runs a :class:`Beacon`: a small UDP responder on
+``DISCOVERY_PORT`` that answers every probe with its name, stream port,
+supported codecs, transport and current load. :class:`ReceiverDiscovery`
+broadcasts a few probes from the streamer and times each answer against the
+probe it echoes, so every answer doubles as a round-trip measurement; the
+best of the rounds is kept. Answers are reported as they arrive, on the
+discovery thread, so a slow subnet only means late entries, never a
+frozen window.
+
+Both sides take the addresses and ports to use, so several receivers can be
+tested on loopback with a port each.
+"""
+import itertools
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+DISCOVERY_PORT = 6006             # Next to the stream port, DEFAULT_PORT
+DISCOVERY_VERSION = 1
+DISCOVERY_APP = 'audio-streamer'
+BROADCAST_TARGETS = (('<broadcast>', DISCOVERY_PORT),)
+PROBE_ROUNDS = 3                  # The fastest answer of these counts as the round trip
+PROBE_INTERVAL = 0.1
+DISCOVERY_TIMEOUT = 1.0           # Waiting for late answers after the last probe
+DISCOVERY_REFRESH_S = 10.0        # Minimum time between two rounds started by the UI
+MAX_DATAGRAM = 2048
+
+MESSAGE_PROBE = 'probe'
+MESSAGE_ANNOUNCE = 'announce'
+
+
+def _pack(message):
+    return json.dumps(dict(message, app=DISCOVERY_APP, v=DISCOVERY_VERSION)).encode()
+
+
+def _unpack(data):
+    try:
+        message = json.loads(data.decode())
+    except (UnicodeDecodeError, ValueError):
+        return None
+    if not isinstance(message, dict) or message.get('app') != DISCOVERY_APP:
+        return None
+    return message
+
+
+def rank(receivers):
+    """Idle receivers before busy ones, then by round trip."""
+    return sorted(receivers, key=lambda receiver: (receiver['load'].get('senders', 0) > 0,
+                                                   receiver['rtt_ms'] if receiver['rtt_ms'] is not None else 1e9))
+
+
+class Beacon:
+    """Answer discovery probes for one receiver.
+
+    ``load()`` is called for every answer, on the beacon thread, and should
+    return a small dict such as ``{'state': 'receiving', 'senders': 1}``.
+    """
+
+    def __init__(self, name, stream_port, codecs, transport, load=None, port=DISCOVERY_PORT, host=''):
+        self.name = name
+        self.stream_port = stream_port
+        self.codecs = list(codecs)
+        self.transport = transport
+        self.load = load or (lambda: {})
+        self.port = port
+        self.host = host
+        self.instance = os.urandom(4).hex()  # Tells two receivers on one host apart
+        self.answered = 0
+        self.sock = None
+        self.thread = None
+
+    def start(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        self.port = sock.getsockname()[1]
+        self.sock = sock
+        self.thread = threading.Thread(target=self._run, name='discovery-beacon', daemon=True)
+        self.thread.start()
+        logging.debug('Discovery beacon answering on UDP port %s', self.port)
+        return self
+
+    def _run(self):
+        sock = self.sock  # stop() clears the attribute while an answer may be on its way
+        while True:
+            try:
+                data, address = sock.recvfrom(MAX_DATAGRAM)
+            except ConnectionResetError:
+                continue  # Windows reports an earlier answer that went nowhere
+            except OSError:
+                break  # Closed by stop()
+            message = _unpack(data)
+            if message is None or message.get('type') != MESSAGE_PROBE:
+                continue
+            try:
+                load = self.load()
+            except Exception as e:
+                logging.debug('Discovery beacon could not read the load: %s', e)
+                load = {}
+            answer = {'type': MESSAGE_ANNOUNCE, 'id': message.get('id'), 'seq': message.get('seq'),
+                      'instance': self.instance, 'name': self.name, 'port': self.stream_port,
+                      'codecs': self.codecs, 'transport': self.transport, 'load': load}
+            try:
+                sock.sendto(_pack(answer), address)
+                self.answered += 1
+            except OSError as e:
+                logging.debug('Discovery beacon could not answer %s: %s', address, e)
+
+    def stop(self):
+        sock, self.sock = self.sock, None
+        if sock is not None:
+            sock.close()
+
+
+class ReceiverDiscovery:
+    """One discovery round: probe ``targets``, collect and time the answers.
+
+    ``on_found(receiver)`` is called on the discovery thread whenever a
+    receiver answers for the first time or with a faster round trip;
+    ``on_done(receivers)`` gets the ranked list at the end. A receiver is a
+    dict with ``ip``, ``name``, ``port``, ``codecs``, ``transport``,
+    ``load`` and ``rtt_ms``.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, on_found=None, on_done=None, targets=BROADCAST_TARGETS, rounds=PROBE_ROUNDS,
+                 interval=PROBE_INTERVAL, timeout=DISCOVERY_TIMEOUT):
+        self.on_found = on_found
+        self.on_done = on_done
+        self.targets = list(targets)
+        self.rounds = rounds
+        self.interval = interval
+        self.timeout = timeout
+        self.id = f'{os.getpid()}-{next(self._ids)}'
+        self.receivers = {}       # (ip, instance) -> receiver
+        self.done = threading.Event()
+        self._stop = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='discovery', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def results(self):
+        return rank(list(self.receivers.values()))
+
+    def _run(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            sock.bind(('', 0))
+            sent = {}             # seq -> monotonic send time
+            next_probe = time.monotonic()
+            deadline = None
+            seq = 0
+            while not self._stop.is_set():
+                now = time.monotonic()
+                if seq < self.rounds and now >= next_probe:
+                    sent[seq] = now
+                    self._probe(sock, seq)
+                    seq += 1
+                    next_probe = now + self.interval
+                    if seq == self.rounds:
+                        deadline = now + self.timeout
+                if deadline is not None and now >= deadline:
+                    break
+                wait_until = next_probe if seq < self.rounds else deadline
+                sock.settimeout(max(0.001, wait_until - now))
+                try:
+                    data, address = sock.recvfrom(MAX_DATAGRAM)
+                except (socket.timeout, ConnectionResetError):
+                    continue  # Windows reports probes to closed ports as resets
+                self._answer(_unpack(data), address[0], sent, time.monotonic())
+        except OSError as e:
+            logging.warning('Receiver discovery failed: %s', e)
+        finally:
+            sock.close()
+            self.done.set()
+        receivers = self.results()
+        logging.debug('Discovery found %d receivers', len(receivers))
+        if self.on_done:
+            self.on_done(receivers)
+
+    def _probe(self, sock, seq):
+        probe = _pack({'type': MESSAGE_PROBE, 'id': self.id, 'seq': seq})
+        for target in self.targets:
+            try:
+                sock.sendto(probe, target)
+            except OSError as e:
+                # No broadcast route on this interface, say; other targets may still answer
+                logging.debug('Could not send a discovery probe to %s: %s', target, e)
+
+    def _answer(self, message, ip, sent, received):
+        if (message is None or message.get('type') != MESSAGE_ANNOUNCE or message.get('id') != self.id
+                or message.get('seq') not in sent):
+            return
+        rtt_ms = (received - sent[message['seq']]) * 1000
+        key = (ip, message.get('instance'))
+        receiver = self.receivers.get(key)
+        if receiver is not None and receiver['rtt_ms'] <= rtt_ms:
+            return
+        receiver = {'ip': ip, 'name': message.get('name') or ip, 'port': message.get('port'),
+                    'codecs': message.get('codecs') or [], 'transport': message.get('transport'),
+                    'load': message.get('load') or {}, 'rtt_ms': round(rtt_ms, 2)}
+        self.receivers[key] = receiver
+        if self.on_found:
+            self.on_found(dict(receiver))
@@ -0,0 +1,347 @@
+"""Loopback latency benchmark for the Audio Streamer pipeline.
+
+Runs a sender and a receiver in one process, connected over 127.0.0.1, and
+needs no sound hardware. A generator writes paced PCM containing a short
+1 kHz tone burst every ``--interval`` ms into the encoder in place of the
+``CABLE Output`` capture; the receiver decodes to PCM in place of the
+speakers and a detector timestamps every tone onset it finds. Because both
+ends share one clock the difference is the end-to-end latency of
+encoder -> transport -> decoder.
+
+    python latency_bench.py --codec pcm --transport udp --duration 20 --json result.json
+    python latency_bench.py --codec mp3 --baseline result.json --max-regression-ms 5
+
+``--direct`` skips ffmpeg and sends the raw PCM through the transport only,
+which is handy where no ffmpeg binary is available. Results are written as
+JSON (stdout or ``--json``); with ``--baseline`` the run fails with exit code
+1 when p95 latency regressed by more than ``--max-regression-ms``.
+"""
+import argparse
+import array
+import json
+import logging
+import math
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from stream_format import CODECS, CODEC_PCM, CHANNELS, SAMPLE_RATE, StreamHeader
+from stream_transport import (RtpReceiver, RtpSender, StreamReceiver, StreamSender,
+                              TRANSPORT_TCP, TRANSPORT_UDP, JITTER_TARGET_MS)
+
+BLOCK_MS = 5               # Generator write size, also the timestamp resolution on the sender side
+TONE_MS = 20
+TONE_HZ = 1000
+TONE_AMPLITUDE = 16384     # -6 dBFS
+DETECT_THRESHOLD = 4096    # -18 dBFS, well above codec noise but below the tone
+FRAME_BYTES = CHANNELS * 2
+RESULT_VERSION = 1
+
+if hasattr(sys, '_MEIPASS'):
+    base_path = Path(sys._MEIPASS)
+else:
+    base_path = Path(__file__).parent.resolve()
+
+
+def find_ffmpeg():
+    """Prefer the bundled ffmpeg, fall back to one on PATH."""
+    bundled = base_path / 'ffmpeg' / 'bin' / ('ffmpeg.exe' if platform.system() == 'Windows' else 'ffmpeg')
+    if bundled.exists():
+        return str(bundled)
+    return shutil.which('ffmpeg')
+
+
+class ToneGenerator:
+    """Write real-time paced s16le stereo PCM with a tone burst every ``interval_ms``."""
+
+    def __init__(self, interval_ms):
+        self.interval_ms = interval_ms
+        self.injected = []
+        block_frames = SAMPLE_RATE * BLOCK_MS // 1000
+        self.silence = bytes(block_frames * FRAME_BYTES)
+        tone_frames = SAMPLE_RATE * TONE_MS // 1000
+        samples = array.array('h')
+        for i in range(tone_frames):
+            value = int(TONE_AMPLITUDE * math.sin(2 * math.pi * TONE_HZ * i / SAMPLE_RATE))
+            samples.extend((value, value))
+        if sys.byteorder == 'big':
+            samples.byteswap()
+        tone = samples.tobytes()
+        self.tone_blocks = [tone[i:i + len(self.silence)] for i in range(0, len(tone), len(self.silence))]
+
+    def run(self, out, duration):
+        blocks_per_tone = self.interval_ms // BLOCK_MS
+        total_blocks = int(duration * 1000 // BLOCK_MS)
+        start = time.monotonic()
+        for block in range(total_blocks):
+            deadline = start + block * BLOCK_MS / 1000.0
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            position = block % blocks_per_tone
+            if position < len(self.tone_blocks):
+                data = self.tone_blocks[position]
+                if position == 0:
+                    self.injected.append(time.monotonic())
+            else:
+                data = self.silence
+            out.write(data)
+            out.flush()
+        out.close()
+
+
+class ToneDetector:
+    """Find tone onsets in decoded s16le stereo PCM as it arrives."""
+
+    def __init__(self, interval_ms):
+        self.holdoff = interval_ms / 2000.0
+        self.detected = []
+        self.pending = b''
+        self.frames = 0
+        self.last_onset_frame = None
+
+    def feed(self, data):
+        arrived = time.monotonic()
+        data = self.pending + data
+        usable = len(data) - len(data) % FRAME_BYTES
+        self.pending = data[usable:]
+        samples = array.array('h')
+        samples.frombytes(data[:usable])
+        if sys.byteorder == 'big':
+            samples.byteswap()
+        left = samples[0::2]
+        # Cheap C-level check first, only scan sample by sample when a tone is present
+        if left and max(max(left), -min(left)) >= DETECT_THRESHOLD:
+            holdoff_frames = int(self.holdoff * SAMPLE_RATE)
+            for index, value in enumerate(left):
+                if abs(value) < DETECT_THRESHOLD:
+                    continue
+                frame = self.frames + index
+                if self.last_onset_frame is None or frame - self.last_onset_frame > holdoff_frames:
+                    self.last_onset_frame = frame
+                    self.detected.append(arrived)
+        self.frames += len(left)
+
+
+class _DetectorSink:
+    # Stands in for the decoder's stdin in --direct mode.
+    def __init__(self, detector):
+        self.detector = detector
+        self.closed = threading.Event()
+
+    def write(self, data):
+        self.detector.feed(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed.set()
+
+
+def match_latencies(injected, detected, interval_ms):
+    """Pair each detection with the latest injection before it that is still unmatched."""
+    latencies = []
+    used = set()
+    window = interval_ms / 1000.0
+    for seen in detected:
+        candidates = [i for i, sent in enumerate(injected) if sent <= seen and i not in used]
+        if not candidates:
+            continue
+        best = candidates[-1]
+        if seen - injected[best] < window:
+            used.add(best)
+            latencies.append((seen - injected[best]) * 1000.0)
+    return latencies
+
+
+def summarize(latencies):
+    if not latencies:
+        return None
+    ordered = sorted(latencies)
+
+    def percentile(p):
+        rank = (len(ordered) - 1) * p / 100.0
+        low = int(rank)
+        high = min(low + 1, len(ordered) - 1)
+        return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+    diffs = [abs(b - a) for a, b in zip(latencies, latencies[1:])]
+    return {
+        'min': round(ordered[0], 2),
+        'mean': round(statistics.fmean(ordered), 2),
+        'p50': round(percentile(50), 2),
+        'p95': round(percentile(95), 2),
+        'p99': round(percentile(99), 2),
+        'max': round(ordered[-1], 2),
+        'stdev': round(statistics.pstdev(ordered), 2),
+        # Mean difference between consecutive tones, like RTP interarrival jitter
+        'jitter': round(statistics.fmean(diffs), 2) if diffs else 0.0,
+    }
+
+
+def run_benchmark(codec=CODEC_PCM, transport=TRANSPORT_TCP, duration=10.0, interval_ms=250,
+                  jitter_ms=JITTER_TARGET_MS, direct=False, ffmpeg=None):
+    header = StreamHeader(codec)
+    detector = ToneDetector(interval_ms)
+    generator = ToneGenerator(interval_ms)
+    processes = []
+    finished = threading.Event()
+
+    if not direct and ffmpeg is None:
+        raise RuntimeError('ffmpeg not found, pass --ffmpeg or use --direct')
+
+    def read_decoder(pipe):
+        for data in iter(lambda: pipe.read1(4096), b''):
+            detector.feed(data)
+        finished.set()
+
+    def open_sink(stream_header):
+        if direct:
+            return _DetectorSink(detector)
+        cmd = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-fflags', 'nobuffer', '-flags', 'low_delay',
+               *stream_header.profile.decoder_input_args(stream_header), '-i', 'pipe:0',
+               '-f', 's16le', '-ar', str(SAMPLE_RATE), '-ac', str(CHANNELS), '-flush_packets', '1', 'pipe:1']
+        decoder = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        processes.append(decoder)
+        threading.Thread(target=read_decoder, args=(decoder.stdout,), daemon=True).start()
+        return decoder.stdin
+
+    if transport == TRANSPORT_UDP:
+        receiver = RtpReceiver(0, bind_address='127.0.0.1', target_ms=jitter_ms, idle_timeout=2.0)
+        sender_cls = RtpSender
+    else:
+        receiver = StreamReceiver(0, bind_address='127.0.0.1')
+        sender_cls = StreamSender
+    port = receiver.listen()
+    receiver.start(open_sink)
+
+    if direct:
+        read_fd, write_fd = os.pipe()
+        source, generator_out = open(read_fd, 'rb', buffering=0), open(write_fd, 'wb', buffering=0)
+    else:
+        cmd = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-fflags', 'nobuffer',
+               '-f', 's16le', '-ar', str(SAMPLE_RATE), '-ac', str(CHANNELS), '-i', 'pipe:0',
+               *header.profile.encoder_output_args(), '-flush_packets', '1', 'pipe:1']
+        encoder = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        processes.append(encoder)
+        source, generator_out = encoder.stdout, encoder.stdin
+
+    sender = sender_cls('127.0.0.1', port, header=header)
+    sender.start(source)
+    started = time.monotonic()
+    try:
+        generator.run(generator_out, duration)
+        sender.closed.wait(10)
+        receiver.closed.wait(10)
+        if not direct:
+            finished.wait(10)
+    finally:
+        sender.stop()
+        receiver.stop()
+        for process in processes:
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    latencies = match_latencies(generator.injected, detector.detected, interval_ms)
+    result = {
+        'benchmark': 'latency',
+        'version': RESULT_VERSION,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'config': {
+            'codec': codec,
+            'transport': transport,
+            'duration_s': duration,
+            'interval_ms': interval_ms,
+            'jitter_target_ms': jitter_ms if transport == TRANSPORT_UDP else None,
+            'direct': direct,
+        },
+        'elapsed_s': round(time.monotonic() - started, 2),
+        'tones_sent': len(generator.injected),
+        'tones_detected': len(latencies),
+        'latency_ms': summarize(latencies),
+        'samples_ms': [round(value, 2) for value in latencies],
+        'sender': sender.stats.snapshot(),
+        'receiver': receiver.stats.snapshot(),
+    }
+    if transport == TRANSPORT_UDP:
+        result['jitter_buffer'] = receiver.jitter.snapshot()
+    return result
+
+
+def check_regression(result, baseline, max_regression_ms):
+    """Return a message if p95 latency got worse than the baseline allows, else None."""
+    current = (result.get('latency_ms') or {}).get('p95')
+    previous = (baseline.get('latency_ms') or {}).get('p95')
+    if current is None:
+        return 'no tones were detected'
+    if previous is not None and current - previous > max_regression_ms:
+        return f'p95 latency {current} ms exceeds baseline {previous} ms by more than {max_regression_ms} ms'
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure end-to-end latency of the streaming pipeline over loopback.')
+    parser.add_argument('--codec', choices=list(CODECS), default=CODEC_PCM)
+    parser.add_argument('--transport', choices=[TRANSPORT_TCP, TRANSPORT_UDP], default=TRANSPORT_TCP)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of audio to send')
+    parser.add_argument('--interval', type=int, default=250, help='milliseconds between tone bursts')
+    parser.add_argument('--jitter-ms', type=int, default=JITTER_TARGET_MS, help='jitter buffer target for UDP')
+    parser.add_argument('--direct', action='store_true', help='skip ffmpeg, measure the transport only')
+    parser.add_argument('--ffmpeg', default=None, help='path to ffmpeg (default: bundled or PATH)')
+    parser.add_argument('--json', dest='json_path', help='write the result to this file instead of stdout')
+    parser.add_argument('--baseline', help='previous result to compare against')
+    parser.add_argument('--max-regression-ms', type=float, default=5.0)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format='%(asctime)s %(levelname)s:%(message)s')
+    if args.interval < TONE_MS * 2 or args.interval % BLOCK_MS:
+        parser.error(f'--interval must be a multiple of {BLOCK_MS} and at least {TONE_MS * 2}')
+    if args.direct and args.codec != CODEC_PCM:
+        parser.error('--direct sends raw PCM, it can only be combined with --codec pcm')
+
+    try:
+        result = run_benchmark(args.codec, args.transport, args.duration, args.interval,
+                               args.jitter_ms, args.direct, None if args.direct else (args.ffmpeg or find_ffmpeg()))
+    except RuntimeError as e:
+        parser.error(str(e))
+
+    output = json.dumps(result, indent=2)
+    if args.json_path:
+        Path(args.json_path).write_text(output + '\n')
+    else:
+        print(output)
+
+    stats = result['latency_ms']
+    if stats:
+        print(f"{args.codec}/{args.transport}: {result['tones_detected']}/{result['tones_sent']} tones, "
+              f"p50 {stats['p50']} ms, p95 {stats['p95']} ms, p99 {stats['p99']} ms, jitter {stats['jitter']} ms",
+              file=sys.stderr)
+
+    failure = None
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        failure = check_regression(result, baseline, args.max_regression_ms)
+    elif stats is None:
+        failure = 'no tones were detected'
+    if failure:
+        print(f'FAIL: {failure}', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
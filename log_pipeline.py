@@ -0,0 +1,241 @@
+"""Logging for Audio Streamer and Audio Receiver.
+
+:func:`setup_logging` puts a QueueHandler on the root logger, so a thread
+that logs only appends the record to a queue; one QueueListener thread
+formats and writes them to a log file that is rotated by size. A chatty
+ffmpeg can no longer hold up whatever thread reads its pipe on disk I/O, and
+the log no longer grows without limit.
+
+:class:`FfmpegLog` reads an ffmpeg's stderr, turns each line into an event
+(progress with the bitrate, capture buffer overruns, reconnects, I/O
+errors, timestamp trouble or a plain message), keeps counters of them and
+logs them through the ``ffmpeg`` logger, whose :class:`RateLimitFilter` lets
+only a few copies of the same message through every few seconds.
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+import re
+import threading
+import time
+
+LOG_MAX_BYTES = 2 * 1024 * 1024
+LOG_BACKUPS = 3
+RATE_WINDOW_S = 10.0
+RATE_BURST = 3                    # Copies of one message logged per window, the rest are only counted
+RATE_MAX_KEYS = 256               # Distinct messages remembered before stale ones are forgotten
+MAX_LINE_BYTES = 4096             # ffmpeg output without a line break is cut here
+
+FFMPEG_LOGGER = 'ffmpeg'
+
+FFMPEG_PROGRESS = 'progress'      # {'size_kb', 'position_s', 'bitrate_kbps', 'speed'}, None where ffmpeg says N/A
+FFMPEG_XRUN = 'xrun'              # Capture buffer overrun, audio was dropped
+FFMPEG_RECONNECT = 'reconnect'
+FFMPEG_IO_ERROR = 'io_error'
+FFMPEG_TIMESTAMP = 'timestamp'    # Non-monotonic or backwards timestamps
+FFMPEG_MESSAGE = 'message'        # Anything else
+
+_PROGRESS = re.compile(r'size=\s*(?P<size>\d+\s*ki?B|N/A).*?time=\s*(?P<time>[\d:.]+|N/A)'
+                       r'.*?bitrate=\s*(?P<bitrate>[\d.]+|N/A)(?:kbits/s)?(?:.*?speed=\s*(?P<speed>[\d.e+]+)x)?', re.I)
+_XRUN = re.compile(r'real-time buffer .*too full|frame dropped|overrun|xrun', re.I)
+_RECONNECT = re.compile(r'will reconnect|reconnecting', re.I)
+_IO_ERROR = re.compile(r'broken pipe|connection (?:reset|refused|timed out)|error writing|i/o error', re.I)
+_TIMESTAMP = re.compile(r'non[- ]?monoton|backward in time|timestamp discontinuity', re.I)
+_SOURCE = re.compile(r'^\[(?P<source>[^\]@]+?)(?: @ [0-9a-fA-Fx]+)?\]\s*')
+_LEVELS = {
+    FFMPEG_PROGRESS: logging.DEBUG,
+    FFMPEG_XRUN: logging.WARNING,
+    FFMPEG_RECONNECT: logging.WARNING,
+    FFMPEG_IO_ERROR: logging.ERROR,
+    FFMPEG_TIMESTAMP: logging.WARNING,
+}
+_NUMBERS = re.compile(r'\d+(?:\.\d+)?')
+
+_listener = None
+
+
+def setup_logging(path, level, fmt, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS):
+    """Send every record to ``path`` through a queue and a writer thread; returns the listener."""
+    global _listener
+    if _listener is not None:
+        return _listener
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+    handler.setFormatter(logging.Formatter(fmt))
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(level)
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    logging.getLogger(FFMPEG_LOGGER).addFilter(RateLimitFilter())
+    _listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Write out whatever is still queued; call before ``os._exit``, which skips atexit."""
+    global _listener
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+class RateLimitFilter(logging.Filter):
+    """Let ``burst`` copies of a message through per ``window`` seconds and count the rest.
+
+    Numbers are ignored when comparing, so overrun lines that only differ in
+    a percentage are copies. The first copy let through after some were
+    held back says how many.
+    """
+
+    def __init__(self, window=RATE_WINDOW_S, burst=RATE_BURST, clock=time.monotonic):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self.clock = clock
+        self.suppressed = 0
+        self._seen = {}           # key -> [window start, copies in this window, held back]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.levelno, _NUMBERS.sub('#', record.getMessage()))
+        now = self.clock()
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry is None or now - entry[0] >= self.window:
+                held_back = entry[2] if entry else 0
+                self._seen[key] = [now, 1, 0]
+                if len(self._seen) > RATE_MAX_KEYS:
+                    self._seen = {k: v for k, v in self._seen.items() if now - v[0] < self.window}
+            else:
+                entry[1] += 1
+                if entry[1] > self.burst:
+                    entry[2] += 1
+                    self.suppressed += 1
+                    return False
+                held_back = 0
+        if held_back:
+            record.msg = f'{record.getMessage()} ({held_back} more like it not logged)'
+            record.args = ()
+        return True
+
+
+def _seconds(clock):
+    # ffmpeg's HH:MM:SS.ss
+    try:
+        hours, minutes, seconds = clock.split(':')
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except ValueError:
+        return None
+
+
+def _number(text):
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_ffmpeg_line(line):
+    """Return ``(kind, fields)`` for one line of ffmpeg's stderr, None for a blank one.
+
+    ``fields`` always has the ``text`` and, when ffmpeg named one, the
+    ``source`` (``dshow``, ``aac``...) of the message.
+    """
+    text = line.strip()
+    if not text:
+        return None
+    fields = {'text': text}
+    match = _SOURCE.match(text)
+    if match:
+        fields['source'] = match.group('source').strip()
+    match = _PROGRESS.search(text)
+    if match:
+        fields.update(size_kb=_number(match.group('size').rstrip('kKiB ')), position_s=_seconds(match.group('time')),
+                      bitrate_kbps=_number(match.group('bitrate')), speed=_number(match.group('speed')))
+        return FFMPEG_PROGRESS, fields
+    for kind, pattern in ((FFMPEG_XRUN, _XRUN), (FFMPEG_RECONNECT, _RECONNECT),
+                          (FFMPEG_IO_ERROR, _IO_ERROR), (FFMPEG_TIMESTAMP, _TIMESTAMP)):
+        if pattern.search(text):
+            return kind, fields
+    return FFMPEG_MESSAGE, fields
+
+
+class FfmpegLog:
+    """Events, counters and rate-limited log records from one ffmpeg's stderr.
+
+    One instance can follow several processes in turn (an encoder that is
+    restarted, say), so the counters cover all of them. ``on_event(kind,
+    fields)`` is called on the reading thread.
+    """
+
+    def __init__(self, name, on_event=None):
+        self.name = name
+        self.on_event = on_event
+        self.logger = logging.getLogger(FFMPEG_LOGGER)
+        self.counts = dict.fromkeys((FFMPEG_XRUN, FFMPEG_RECONNECT, FFMPEG_IO_ERROR, FFMPEG_TIMESTAMP,
+                                     FFMPEG_MESSAGE), 0)
+        self.progress = None
+        self.last_error = None
+
+    def start(self, pipe):
+        thread = threading.Thread(target=self.follow, args=(pipe,), name=f'{self.name}-stderr', daemon=True)
+        thread.start()
+        return thread
+
+    def follow(self, pipe):
+        # Progress lines end in a carriage return, not a line break, so readline() is no use
+        pending = b''
+        try:
+            while True:
+                data = pipe.read1(MAX_LINE_BYTES)
+                if not data:
+                    break
+                *lines, pending = re.split(rb'[\r\n]', pending + data)
+                for line in lines:
+                    self.feed(line.decode(errors='replace'))
+                if len(pending) > MAX_LINE_BYTES:
+                    self.feed(pending.decode(errors='replace'))
+                    pending = b''
+        except (OSError, ValueError):
+            pass
+        finally:
+            if pending:
+                self.feed(pending.decode(errors='replace'))
+            pipe.close()
+
+    def feed(self, line):
+        event = parse_ffmpeg_line(line)
+        if event is None:
+            return
+        kind, fields = event
+        if kind == FFMPEG_PROGRESS:
+            self.progress = fields
+        else:
+            self.counts[kind] += 1
+        level = _LEVELS.get(kind)
+        if level is None:
+            level = logging.ERROR if 'error' in fields['text'].lower() else logging.WARNING
+        if level >= logging.ERROR:
+            self.last_error = fields['text']
+        self.logger.log(level, '[%s] %s', self.name, fields['text'], extra={'ffmpeg_event': kind})
+        if self.on_event:
+            self.on_event(kind, fields)
+
+    def stats(self):
+        progress = self.progress or {}
+        return {
+            'xruns': self.counts[FFMPEG_XRUN],
+            'reconnects': self.counts[FFMPEG_RECONNECT],
+            'io_errors': self.counts[FFMPEG_IO_ERROR],
+            'timestamp_warnings': self.counts[FFMPEG_TIMESTAMP],
+            'messages': self.counts[FFMPEG_MESSAGE],
+            'bitrate_kbps': progress.get('bitrate_kbps'),
+            'speed': progress.get('speed'),
+            'last_error': self.last_error,
+        }
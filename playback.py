@@ -0,0 +1,399 @@
+"""In-process playback for Audio Receiver, instead of piping into ffplay.
+
+ffplay runs with ``-infbuf``, an unbounded input buffer nobody can see into,
+so over a long session latency only ever grows. :class:`PlaybackEngine`
+keeps the received audio in a fixed-size PCM ring (see
+:class:`capture.RingBuffer`) between the transport and the sound card, and
+the sink takes one block at a time from it. The ring's fill level is the
+latency: the engine starts playing once ``target_ms`` is buffered and then
+holds it there. The sender's sound card runs on its own clock, a little
+faster or slower than ours, so :class:`DriftEstimator` compares the audio
+received with the audio played, and every block takes that many more or
+fewer input frames (one frame dropped or repeated every few thousand, which
+nobody hears), plus a small correction towards the target. Only when the
+level still climbs far above the target (a burst after a network stall) is
+the oldest audio dropped at once.
+
+PCM streams go into the ring as they are; compressed ones are decoded by an
+ffmpeg per stream (:class:`audio_mixer.DecoderSink`). Sinks:
+:class:`PyAudioSink` plays through the default output device with the
+optional ``pyaudio`` (or ``pyaudiowpatch``) package; :class:`NullSink` and
+:class:`WavSink` only consume the audio in real time, for machines without a
+sound card.
+"""
+import collections
+import logging
+import threading
+import time
+import wave
+
+from capture import RingBuffer, SAMPLE_BYTES
+from stream_format import CHANNELS, CODEC_PCM, SAMPLE_RATE
+
+PLAYBACK_BLOCK_MS = 10
+PLAYBACK_TARGET_MS = 40           # Latency held by the engine, and what a trim goes back to
+PLAYBACK_TARGET_MIN_MS = 10
+PLAYBACK_TARGET_MAX_MS = 250
+PLAYBACK_TRIM_MS = 80             # More than this above the target and the oldest audio is dropped
+PLAYBACK_RING_MS = 500            # Hard bound on buffered audio, anything more is dropped on arrival
+
+DRIFT_WINDOW_S = 30.0             # Audio compared to estimate the sender's clock rate
+DRIFT_MIN_S = 5.0                 # No estimate before this much has played
+DRIFT_CHECKPOINT_S = 0.5
+FILL_SMOOTHING = 0.02             # Per block, so network jitter doesn't steer the rate
+CORRECTION_S = 10.0               # A fill level off target is worked off over about this long
+MAX_RATE_ADJUST = 0.005           # +/-0.5 %, like the mixer
+
+
+def _pyaudio():
+    try:
+        import pyaudio
+    except ImportError:
+        try:
+            import pyaudiowpatch as pyaudio  # Same API, also installed for WASAPI capture
+        except ImportError:
+            return None
+    return pyaudio
+
+
+class _ClockSink:
+    # Takes a block every block period on its own thread, like a sound card would
+
+    def __init__(self):
+        self.error = None
+        self.blocks = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, render, sample_rate, channels, block_frames):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self._open()
+        self._thread = threading.Thread(target=self._run, args=(render, block_frames), name='playback', daemon=True)
+        self._thread.start()
+
+    def _open(self):
+        pass
+
+    def _run(self, render, block_frames):
+        block_s = block_frames / self.sample_rate
+        deadline = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                self._consume(render(block_frames))
+                self.blocks += 1
+                deadline += block_s
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                elif delay < -5 * block_s:
+                    deadline = time.monotonic()  # Fell well behind; don't burst to catch up
+        except (OSError, ValueError) as e:
+            self.error = e
+            logging.error('Playback output failed: %s', e)
+
+    def _consume(self, data):
+        pass
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(1.0)
+        self._close()
+
+    def _close(self):
+        pass
+
+
+class NullSink(_ClockSink):
+    """Plays into nothing, at the speed of a sound card."""
+
+    name = 'null'
+
+
+class WavSink(_ClockSink):
+    """Writes what would have been played to a WAV file."""
+
+    name = 'wav'
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.file = None
+
+    def _open(self):
+        self.file = wave.open(self.path, 'wb')
+        self.file.setnchannels(self.channels)
+        self.file.setsampwidth(SAMPLE_BYTES)
+        self.file.setframerate(self.sample_rate)
+
+    def _consume(self, data):
+        self.file.writeframesraw(data)
+
+    def _close(self):
+        if self.file is not None:
+            self.file.close()  # Fills in the sizes in the header
+            self.file = None
+
+
+class PyAudioSink:
+    """The default output device, pulling blocks from the engine in PortAudio's callback."""
+
+    name = 'PortAudio'
+
+    @staticmethod
+    def available():
+        return _pyaudio() is not None
+
+    def __init__(self, device_index=None):
+        self.device_index = device_index
+        self.error = None
+        self.blocks = 0
+        self.device_underruns = 0
+        self.audio = None
+        self.stream = None
+
+    def start(self, render, sample_rate, channels, block_frames):
+        pyaudio = _pyaudio()
+
+        def callback(in_data, frame_count, time_info, status):
+            if status & pyaudio.paOutputUnderflow:
+                self.device_underruns += 1
+            self.blocks += 1
+            return render(frame_count), pyaudio.paContinue
+
+        self.audio = pyaudio.PyAudio()
+        try:
+            self.stream = self.audio.open(format=pyaudio.paInt16, channels=channels, rate=sample_rate, output=True,
+                                          output_device_index=self.device_index, frames_per_buffer=block_frames,
+                                          stream_callback=callback)
+        except Exception:
+            self.stop()
+            raise
+
+    def stop(self):
+        if self.stream is not None:
+            try:
+                self.stream.stop_stream()
+                self.stream.close()
+            except Exception as e:
+                logging.debug('Closing the output stream failed: %s', e)
+            self.stream = None
+        if self.audio is not None:
+            self.audio.terminate()
+            self.audio = None
+
+
+def default_sink():
+    return PyAudioSink() if PyAudioSink.available() else None
+
+
+class DriftEstimator:
+    """The sender's clock rate relative to ours, from frames received per frame played.
+
+    Both are counted in audio frames, received ones on the sender's clock and
+    played ones on the output device's, so no wall clock is involved and
+    network jitter averages out over the window. Only audio actually played
+    counts (not the silence while the buffer refills, not what was trimmed),
+    so pauses and bursts don't skew it. A new sender has a new clock:
+    :meth:`reset` for every stream.
+    """
+
+    def __init__(self, sample_rate, window_s=DRIFT_WINDOW_S, min_s=DRIFT_MIN_S, checkpoint_s=DRIFT_CHECKPOINT_S):
+        self.window_frames = int(sample_rate * window_s)
+        self.min_frames = int(sample_rate * min_s)
+        self.checkpoint_frames = int(sample_rate * checkpoint_s)
+        self.checkpoints = collections.deque()
+        self.ratio = None
+
+    def reset(self):
+        self.checkpoints.clear()
+        self.ratio = None
+
+    def update(self, received, played):
+        """Feed the running totals; returns the current ratio, or None while there is too little to go on."""
+        if self.checkpoints and played - self.checkpoints[-1][1] < self.checkpoint_frames:
+            return self.ratio
+        self.checkpoints.append((received, played))
+        while len(self.checkpoints) > 2 and played - self.checkpoints[1][1] >= self.window_frames:
+            self.checkpoints.popleft()
+        if played - self.checkpoints[0][1] >= self.min_frames:
+            # Least-squares slope rather than the two ends, so a burst at either end doesn't swing it
+            count = len(self.checkpoints)
+            mean_received = sum(point[0] for point in self.checkpoints) / count
+            mean_played = sum(point[1] for point in self.checkpoints) / count
+            covariance = sum((r - mean_received) * (p - mean_played) for r, p in self.checkpoints)
+            variance = sum((p - mean_played) ** 2 for _, p in self.checkpoints)
+            self.ratio = covariance / variance
+        return self.ratio
+
+    def ppm(self):
+        return round((self.ratio - 1.0) * 1e6) if self.ratio is not None else None
+
+
+def stretch_block(data, taken, frames, frame_bytes):
+    """``taken`` frames of ``data`` as ``frames`` frames, single frames repeated or dropped evenly over the block."""
+    count = abs(frames - taken)
+    if not count:
+        return data
+    step = max(taken // (count + 1), 1) * frame_bytes
+    parts = []
+    start = 0
+    for i in range(1, count + 1):
+        cut = i * step
+        parts.append(data[start:cut])
+        if frames > taken:
+            parts.append(data[cut - frame_bytes:cut])
+        else:
+            cut += frame_bytes
+        start = cut
+    parts.append(data[start:])
+    return b''.join(parts)
+
+
+class _EngineInput:
+    # What the transport (or a decoder) writes PCM into; closing it leaves the engine running
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.closed = False
+
+    def alive(self):
+        return not self.closed and self.engine.running
+
+    def write(self, data):
+        self.engine.write(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class PlaybackEngine:
+    """A bounded PCM buffer between the decoder and ``sink``, held at ``target_ms``.
+
+    :meth:`write` may be called from any thread (the writers take turns on a
+    lock); :meth:`render` runs on the sink's thread and never blocks, so the
+    audio callback is never held up by the network. The engine outlives the
+    streams: :meth:`input` gives a writable for each new stream and closing
+    that leaves the engine playing silence until the next one.
+    """
+
+    def __init__(self, sink, sample_rate=SAMPLE_RATE, channels=CHANNELS, block_ms=PLAYBACK_BLOCK_MS,
+                 target_ms=PLAYBACK_TARGET_MS, trim_ms=PLAYBACK_TRIM_MS, ring_ms=PLAYBACK_RING_MS):
+        self.sink = sink
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frame_bytes = channels * SAMPLE_BYTES
+        self.block_frames = sample_rate * block_ms // 1000
+        self.target_frames = sample_rate * target_ms // 1000
+        self.max_frames = self.target_frames + max(sample_rate * trim_ms // 1000, self.block_frames)
+        self.ring = RingBuffer(self.frame_bytes * max(sample_rate * ring_ms // 1000, self.max_frames),
+                               self.frame_bytes)
+        self.drift = DriftEstimator(sample_rate)
+        self.rate = 1.0           # Input frames taken per frame played
+        self._fill = 0.0          # Smoothed fill level in frames
+        self._phase = 0.0         # Fractional input frames carried over to the next block
+        self.running = False
+        self.primed = False
+        self.frames_received = 0
+        self.underruns = 0
+        self.trims = 0
+        self.frames_played = 0
+        self.frames_trimmed = 0
+        self._new_session = False
+        self._write_lock = threading.Lock()
+
+    def start(self):
+        self.sink.start(self.render, self.sample_rate, self.channels, self.block_frames)
+        self.running = True
+        logging.info('Playing through %s: %d ms blocks, %d ms target, %d ms max', self.sink.name,
+                     self._ms(self.block_frames), self._ms(self.target_frames), self._ms(self.max_frames))
+        return self
+
+    def stop(self):
+        self.running = False
+        self.sink.stop()
+        logging.info('Playback stopped: %s', self.stats())
+
+    def input(self, header, ffmpeg_exe=None, creationflags=0):
+        """A writable for one stream described by ``header``; compressed streams get an ffmpeg decoder."""
+        target = _EngineInput(self)
+        self.new_session()
+        if header.codec == CODEC_PCM and header.sample_rate == self.sample_rate and header.channels == self.channels:
+            return target
+        from audio_mixer import DecoderSink
+        return DecoderSink(ffmpeg_exe, header, target, creationflags)
+
+    def new_session(self):
+        """A new sender is on, possibly into the running input: its clock has to be measured afresh."""
+        # Picked up by render(), the only thread that updates the estimator
+        self._new_session = True
+
+    def write(self, data):
+        with self._write_lock:
+            self.frames_received += self.ring.write(data) // self.frame_bytes
+
+    def render(self, frames):
+        """Return ``frames`` frames to play now; silence while the buffer refills."""
+        size = frames * self.frame_bytes
+        if self._new_session:
+            self._new_session = False
+            self.drift.reset()
+        buffered = self.ring.fill() // self.frame_bytes
+        if not self.primed:
+            if buffered < self.target_frames:
+                return bytes(size)
+            self.primed = True
+            self._fill = float(buffered)
+            self._phase = 0.0
+        if buffered > self.max_frames:
+            # Too much latency piled up at once: skip the oldest audio back to the target
+            dropped = self.ring.discard((buffered - self.target_frames) * self.frame_bytes)
+            self.frames_trimmed += dropped // self.frame_bytes
+            self.trims += 1
+            buffered = self._fill = self.target_frames
+        taken = self._frames_to_take(frames, buffered)
+        data = self.ring.read(taken * self.frame_bytes)
+        if len(data) < taken * self.frame_bytes:
+            # Only what came out of the ring was played, the rest of the block is silence
+            self.frames_played += len(data) // self.frame_bytes
+            self.underruns += 1
+            self.primed = False  # Wait for the target again instead of stuttering block by block
+            return data + bytes(size - len(data))
+        self.frames_played += frames
+        self.drift.update(self.frames_received - self.frames_trimmed, self.frames_played)
+        return stretch_block(data, taken, frames, self.frame_bytes)
+
+    def _frames_to_take(self, frames, buffered):
+        # Follow the sender's clock, plus a little more or less to bring the level back to the target
+        self._fill += FILL_SMOOTHING * (buffered - self._fill)
+        drift = self.drift.ratio - 1.0 if self.drift.ratio is not None else 0.0
+        error = (self._fill - self.target_frames) / (self.sample_rate * CORRECTION_S)
+        self.rate = 1.0 + max(-MAX_RATE_ADJUST, min(MAX_RATE_ADJUST, drift + error))
+        wanted = frames * self.rate + self._phase
+        taken = int(wanted)
+        self._phase = wanted - taken
+        return taken
+
+    def _ms(self, frames):
+        return frames * 1000 // self.sample_rate
+
+    def buffer_ms(self):
+        return round(self.ring.fill() / self.frame_bytes * 1000 / self.sample_rate, 1)
+
+    def stats(self):
+        return {
+            'sink': self.sink.name,
+            'buffer_ms': self.buffer_ms(),
+            'target_ms': self._ms(self.target_frames),
+            'drift_ppm': self.drift.ppm(),
+            'rate_ppm': round((self.rate - 1.0) * 1e6),
+            'underruns': self.underruns,
+            'trims': self.trims,
+            'trimmed_ms': self._ms(self.frames_trimmed),
+            'overruns': self.ring.overruns,
+            'played_s': round(self.frames_played / self.sample_rate, 3),
+        }
@@ -0,0 +1,158 @@
+"""Make VB-Cable's playback side the default output without leaving the process.
+
+Audio Streamer captures whatever Windows plays, so before a stream starts
+``CABLE Input`` has to be the default playback device at full volume,
+unmuted. ``SetPlayBack.exe`` does that by starting PowerShell, loading
+AudioDeviceCmdlets and calling ``Set-AudioDevice`` three times, which is
+seconds of .NET start-up while the user waits. :func:`set_default_playback`
+does the same in-process through the undocumented but long-stable
+IPolicyConfig COM interface (what the Sound control panel itself uses) and
+the device's IAudioEndpointVolume.
+
+The backend is pluggable like in :mod:`device_watcher`:
+:class:`PolicyConfigBackend` on Windows and :class:`FakeBackend`, which only
+keeps a dictionary of devices, so the logic can be exercised on any platform.
+When no native backend is available, or Windows refuses,
+:func:`set_default_playback_with_fallback` runs the caller's fallback, which
+is SetPlayBack.exe in Audio Streamer.
+"""
+import logging
+
+from preflight import VB_CABLE_PLAYBACK
+
+ROLES = (0, 1, 2)                 # ERole eConsole, eMultimedia, eCommunications, like Set-AudioDevice
+FLOW_RENDER = 0                   # EDataFlow.eRender
+STATE_ACTIVE = 1                  # DEVICE_STATE.ACTIVE
+
+
+class PolicyConfigBackend:
+    """IPolicyConfig and IAudioEndpointVolume through pycaw/comtypes."""
+
+    name = 'IPolicyConfig'
+
+    @staticmethod
+    def available():
+        try:
+            import pycaw.api.policyconfig
+        except ImportError:  # Not Windows, or a pycaw without the policy-config interface
+            return False
+        return True
+
+    def __enter__(self):
+        from comtypes import CoInitialize
+        CoInitialize()
+        return self
+
+    def __exit__(self, *exc):
+        from comtypes import CoUninitialize
+        CoUninitialize()
+        return False
+
+    def find_playback(self, name):
+        from pycaw.pycaw import AudioUtilities
+        for device in AudioUtilities.GetAllDevices(FLOW_RENDER, STATE_ACTIVE):
+            if device.FriendlyName == name:
+                return device.id
+        return None
+
+    def _policy_config(self):
+        import comtypes
+        from pycaw.api.policyconfig import IPolicyConfig
+        from pycaw.constants import CLSID_CPolicyConfigClient
+        try:
+            return comtypes.CoCreateInstance(CLSID_CPolicyConfigClient, IPolicyConfig, comtypes.CLSCTX_ALL)
+        except (OSError, comtypes.COMError):
+            # Windows Vista/7 only have the older vtable layout
+            from pycaw.api.policyconfig import IPolicyConfigVista
+            return comtypes.CoCreateInstance(CLSID_CPolicyConfigClient, IPolicyConfigVista, comtypes.CLSCTX_ALL)
+
+    def set_default(self, device_id, roles=ROLES):
+        policy_config = self._policy_config()
+        for role in roles:
+            policy_config.SetDefaultEndpoint(device_id, role)
+
+    def _endpoint_volume(self, device_id):
+        import comtypes
+        from ctypes import POINTER, cast
+        from pycaw.pycaw import AudioUtilities, IAudioEndpointVolume
+        device = AudioUtilities.GetDeviceEnumerator().GetDevice(device_id)
+        interface = device.Activate(IAudioEndpointVolume._iid_, comtypes.CLSCTX_INPROC_SERVER, None)
+        return cast(interface, POINTER(IAudioEndpointVolume))
+
+    def set_volume(self, device_id, level, mute):
+        volume = self._endpoint_volume(device_id)
+        volume.SetMasterVolumeLevelScalar(level, None)
+        volume.SetMute(1 if mute else 0, None)
+
+
+class FakeBackend:
+    """A backend over a ``{name: device_id}`` dictionary that records what it was told to do."""
+
+    name = 'fake'
+
+    def __init__(self, devices=None):
+        self.devices = dict(devices or {})
+        self.default = {}         # role -> device_id
+        self.volume = {}          # device_id -> (level, mute)
+        self.fail = None          # Set to an exception to make the next call raise it
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def _check(self):
+        if self.fail is not None:
+            error, self.fail = self.fail, None
+            raise error
+
+    def find_playback(self, name):
+        self._check()
+        return self.devices.get(name)
+
+    def set_default(self, device_id, roles=ROLES):
+        self._check()
+        for role in roles:
+            self.default[role] = device_id
+
+    def set_volume(self, device_id, level, mute):
+        self._check()
+        self.volume[device_id] = (level, mute)
+
+
+def default_backend():
+    return PolicyConfigBackend() if PolicyConfigBackend.available() else None
+
+
+def set_default_playback(name=VB_CABLE_PLAYBACK, backend=None, level=1.0):
+    """Make ``name`` the default playback device for every role, at ``level``, unmuted.
+
+    Returns the device id. Raises LookupError when there is no such active
+    device and whatever the backend raised when Windows refused; both mean
+    the caller should try SetPlayBack.exe instead.
+    """
+    backend = backend or default_backend()
+    if backend is None:
+        raise LookupError('No native audio policy backend on this system')
+    with backend:
+        device_id = backend.find_playback(name)
+        if device_id is None:
+            raise LookupError(f'Playback device {name!r} not found')
+        backend.set_default(device_id)
+        backend.set_volume(device_id, level, mute=False)
+    logging.debug('Made %s the default playback device using %s', name, backend.name)
+    return device_id
+
+
+def set_default_playback_with_fallback(fallback, name=VB_CABLE_PLAYBACK, backend=None, level=1.0):
+    """:func:`set_default_playback`, or ``fallback()`` (SetPlayBack.exe in the streamer) when that fails.
+
+    Returns ``(ok, device_id)``. The id is only known when the native call
+    worked; otherwise ``ok`` is whatever ``fallback`` returned.
+    """
+    try:
+        return True, set_default_playback(name, backend, level)
+    except Exception as e:
+        logging.warning('Could not set the default playback device natively (%s), falling back', e)
+    return bool(fallback()), None
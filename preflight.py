@@ -0,0 +1,126 @@
+"""Cached audio pre-flight state for Audio Streamer.
+
+Before capturing, Audio Streamer needs the VB-Cable capture device to exist
+and the cable's playback side to be the default output at full volume,
+unmuted; :mod:`playback_device` (or ``SetPlayBack.exe`` as a fallback) takes
+care of the latter. :class:`PreflightCache` remembers the last answer so a
+restart only pays for a dictionary lookup. Any device change
+reported by :class:`device_watcher.DeviceWatcher` makes the answer stale, and
+it is checked again in the background shortly after, so the next Start is
+usually still instant.
+"""
+import logging
+import threading
+import time
+
+from device_watcher import EVENT_DEFAULT_CHANGED
+
+VB_CABLE_CAPTURE = "CABLE Output (VB-Audio Virtual Cable)"
+VB_CABLE_PLAYBACK = "CABLE Input (VB-Audio Virtual Cable)"
+FULL_VOLUME = 0.99                # SetPlayBack sets 100%, allow for rounding
+RECHECK_DELAY = 0.5               # Let a burst of device events settle first
+
+
+def _endpoint_volume(device, raw):
+    volume = getattr(device, 'EndpointVolume', None)
+    if volume is not None:
+        return volume
+    import comtypes
+    from ctypes import POINTER, cast
+    from pycaw.pycaw import IAudioEndpointVolume
+    interface = raw.Activate(IAudioEndpointVolume._iid_, comtypes.CLSCTX_INPROC_SERVER, None)
+    return cast(interface, POINTER(IAudioEndpointVolume))
+
+
+def _read_audio_state(capture_device, playback_device):
+    # Returns plain values only, so no COM object outlives the caller's CoUninitialize
+    from pycaw.pycaw import AudioUtilities
+    capture_present = any(device.FriendlyName == capture_device for device in AudioUtilities.GetAllDevices())
+    raw = AudioUtilities.GetSpeakers()
+    device = raw if hasattr(raw, 'FriendlyName') else AudioUtilities.CreateDevice(raw)  # Older pycaw
+    is_default = device.FriendlyName == playback_device
+    volume_ok = False
+    if is_default:
+        volume = _endpoint_volume(device, raw)
+        volume_ok = volume.GetMasterVolumeLevelScalar() >= FULL_VOLUME and not volume.GetMute()
+    return {
+        'capture_present': capture_present,
+        'playback_default': is_default,
+        'playback_volume_ok': volume_ok,
+        'playback_id': (getattr(device, 'id', None) or raw.GetId()) if is_default else None,
+    }
+
+
+def query_audio_state(capture_device=VB_CABLE_CAPTURE, playback_device=VB_CABLE_PLAYBACK):
+    """Ask Windows for the current state; works on any thread."""
+    from comtypes import CoInitialize, CoUninitialize
+    CoInitialize()
+    try:
+        return _read_audio_state(capture_device, playback_device)
+    finally:
+        CoUninitialize()
+
+
+class PreflightCache:
+    """The last known audio pre-flight state, until a device change says otherwise."""
+
+    def __init__(self, capture_device=VB_CABLE_CAPTURE, playback_device=VB_CABLE_PLAYBACK):
+        self.capture_device = capture_device
+        self.playback_device = playback_device
+        self.state = None  # None while stale
+        self.playback_id = None
+        self._lock = threading.Lock()
+        self._recheck = None
+
+    def check(self):
+        """Query the state now and cache it. A failed query is not cached."""
+        started = time.perf_counter()
+        try:
+            state = query_audio_state(self.capture_device, self.playback_device)
+        except Exception as e:
+            logging.error('Error checking audio devices: %s', e)
+            return {'capture_present': False, 'playback_default': False, 'playback_volume_ok': False,
+                    'playback_id': None}
+        with self._lock:
+            self.state = state
+            if state['playback_id']:
+                self.playback_id = state['playback_id']
+        logging.debug('Audio pre-flight checked in %.0f ms: %s', (time.perf_counter() - started) * 1000, state)
+        return state
+
+    def current(self):
+        with self._lock:
+            state = self.state
+        return state if state is not None else self.check()
+
+    def capture_present(self):
+        return self.current()['capture_present']
+
+    def playback_ready(self):
+        state = self.current()
+        return state['playback_default'] and state['playback_volume_ok']
+
+    def mark_playback_set(self, playback_id=None):
+        # The cable was just made the default, no need to ask Windows again
+        with self._lock:
+            if playback_id:
+                self.playback_id = playback_id
+            if self.state is not None:
+                self.state = dict(self.state, playback_default=True, playback_volume_ok=True)
+
+    def invalidate(self, event=None):
+        """Forget the state; ``event`` is the DeviceEvent that caused it, if any."""
+        if event is not None and event.kind == EVENT_DEFAULT_CHANGED and event.device_id == self.playback_id:
+            return  # The cable became the default, normally because run_setplayback just made it so
+        with self._lock:
+            self.state = None
+            if self._recheck is not None:
+                self._recheck.cancel()
+            self._recheck = threading.Timer(RECHECK_DELAY, self.check)
+            self._recheck.daemon = True
+            self._recheck.start()
+
+    def stop(self):
+        with self._lock:
+            if self._recheck is not None:
+                self._recheck.cancel()
@@ -0,0 +1,213 @@
+"""Start, track and stop exactly the child processes the app started.
+
+Cleaning up with ``taskkill /F /IM ffmpeg.exe`` killed every ffmpeg, ffplay
+and ffprobe on the machine, other people's pipelines included, and still
+missed nothing in particular. :class:`ProcessSupervisor` only knows the
+processes it started itself. On Windows they are also put in a Job Object
+that kills them when it is closed, which happens as well when the app dies
+without cleaning up; on POSIX each child gets its own process group, so a
+signal reaches anything it started in turn.
+
+Stopping is graceful first (stdin closed, which ends ffmpeg and ffplay fed
+from a pipe, or a terminate), then forced after a bounded wait.
+:meth:`ProcessSupervisor.stop_all` does that for every child in parallel, so
+shutdown takes as long as the slowest child rather than the sum of them, and
+reports how long it took.
+"""
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+STOP_TIMEOUT = 2.0                # Graceful wait before a child is killed
+KILL_TIMEOUT = 1.0                # Wait after the kill
+
+_WINDOWS = sys.platform == 'win32'
+
+
+class WindowsJob:
+    """A Job Object with JOB_OBJECT_LIMIT_KILL_ON_JOB_CLOSE set."""
+
+    def __init__(self):
+        import ctypes
+        from ctypes import wintypes
+
+        class IoCounters(ctypes.Structure):
+            _fields_ = [(name, ctypes.c_ulonglong) for name in
+                        ('ReadOperationCount', 'WriteOperationCount', 'OtherOperationCount',
+                         'ReadTransferCount', 'WriteTransferCount', 'OtherTransferCount')]
+
+        class BasicLimitInformation(ctypes.Structure):
+            _fields_ = [('PerProcessUserTimeLimit', ctypes.c_int64), ('PerJobUserTimeLimit', ctypes.c_int64),
+                        ('LimitFlags', wintypes.DWORD), ('MinimumWorkingSetSize', ctypes.c_size_t),
+                        ('MaximumWorkingSetSize', ctypes.c_size_t), ('ActiveProcessLimit', wintypes.DWORD),
+                        ('Affinity', ctypes.c_size_t), ('PriorityClass', wintypes.DWORD),
+                        ('SchedulingClass', wintypes.DWORD)]
+
+        class ExtendedLimitInformation(ctypes.Structure):
+            _fields_ = [('BasicLimitInformation', BasicLimitInformation), ('IoInfo', IoCounters),
+                        ('ProcessMemoryLimit', ctypes.c_size_t), ('JobMemoryLimit', ctypes.c_size_t),
+                        ('PeakProcessMemoryUsed', ctypes.c_size_t), ('PeakJobMemoryUsed', ctypes.c_size_t)]
+
+        self.kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+        self.kernel32.CreateJobObjectW.restype = wintypes.HANDLE
+        self.kernel32.AssignProcessToJobObject.argtypes = (wintypes.HANDLE, wintypes.HANDLE)
+        self.kernel32.CloseHandle.argtypes = (wintypes.HANDLE,)
+        self.handle = self.kernel32.CreateJobObjectW(None, None)
+        if not self.handle:
+            raise ctypes.WinError(ctypes.get_last_error())
+        info = ExtendedLimitInformation()
+        info.BasicLimitInformation.LimitFlags = 0x2000  # JOB_OBJECT_LIMIT_KILL_ON_JOB_CLOSE
+        if not self.kernel32.SetInformationJobObject(self.handle, 9,  # JobObjectExtendedLimitInformation
+                                                     ctypes.byref(info), ctypes.sizeof(info)):
+            error = ctypes.WinError(ctypes.get_last_error())
+            self.close()
+            raise error
+
+    def assign(self, process):
+        import ctypes
+        if not self.kernel32.AssignProcessToJobObject(self.handle, int(process._handle)):
+            raise ctypes.WinError(ctypes.get_last_error())
+
+    def close(self):
+        # Kills whatever is still in the job
+        handle, self.handle = self.handle, None
+        if handle:
+            self.kernel32.CloseHandle(handle)
+
+
+def close_stdin_or_terminate(process):
+    """The default graceful stop: end of input for a child fed through a pipe, a terminate otherwise."""
+    if process.stdin is not None and not process.stdin.closed:
+        process.stdin.close()
+    elif _WINDOWS:
+        process.terminate()
+    else:
+        os.killpg(process.pid, signal.SIGTERM)
+
+
+class ProcessSupervisor:
+    """Owns the children started through :meth:`spawn` until they are stopped or exit."""
+
+    def __init__(self, use_job=_WINDOWS):
+        self.use_job = use_job
+        self.job = None
+        self.killed = 0
+        self._children = {}       # pid -> (process, label, graceful)
+        self._lock = threading.Lock()
+
+    def spawn(self, args, label, graceful=close_stdin_or_terminate, **popen_kwargs):
+        """``subprocess.Popen(args, **popen_kwargs)``, tracked under ``label``."""
+        if not _WINDOWS:
+            popen_kwargs.setdefault('start_new_session', True)  # Own process group
+        process = subprocess.Popen(args, **popen_kwargs)
+        if self.use_job:
+            self._assign_job(process, label)
+        with self._lock:
+            self._reap()
+            self._children[process.pid] = (process, label, graceful)
+        logging.debug('Started %s (pid %s)', label, process.pid)
+        return process
+
+    def _assign_job(self, process, label):
+        try:
+            if self.job is None:
+                self.job = WindowsJob()
+            self.job.assign(process)
+        except OSError as e:
+            # Older Windows can't nest jobs; the child is still tracked and stopped by pid
+            logging.warning('Could not add %s to the job object: %s', label, e)
+            self.use_job = False
+
+    def _reap(self):
+        # Under the lock: forget children that exited on their own
+        for pid in [pid for pid, (process, _, _) in self._children.items() if process.poll() is not None]:
+            del self._children[pid]
+
+    def children(self):
+        with self._lock:
+            self._reap()
+            return [(process, label) for process, label, _ in self._children.values()]
+
+    def stop(self, process, graceful=None, timeout=STOP_TIMEOUT, kill_timeout=KILL_TIMEOUT):
+        """Stop one child gracefully, kill it if it is still running after ``timeout``; returns the exit code.
+
+        Returns None if the child survived the kill as well.
+        """
+        if process is None:
+            return None
+        with self._lock:
+            entry = self._children.pop(process.pid, None)
+        label = entry[1] if entry else 'process'
+        if graceful is None:
+            graceful = entry[2] if entry else close_stdin_or_terminate
+        if process.poll() is None:
+            try:
+                graceful(process)
+            except (OSError, ValueError) as e:
+                logging.debug('Graceful stop of %s failed: %s', label, e)
+        try:
+            return process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            pass
+        logging.warning('%s (pid %s) did not stop within %.1f s, killing it', label, process.pid, timeout)
+        self.killed += 1
+        try:
+            if _WINDOWS:
+                process.kill()
+            else:
+                os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        try:
+            return process.wait(kill_timeout)
+        except subprocess.TimeoutExpired:
+            logging.error('%s (pid %s) is still running after being killed', label, process.pid)
+            return None
+
+    def stop_all(self, timeout=STOP_TIMEOUT, kill_timeout=KILL_TIMEOUT):
+        """Stop every child in parallel; returns ``{'stopped', 'killed', 'elapsed_s'}``."""
+        started = time.perf_counter()
+        killed = self.killed
+        children = self.children()
+        threads = [threading.Thread(target=self.stop, args=(process, None, timeout, kill_timeout),
+                                    name=f'stop-{label}', daemon=True) for process, label in children]
+        for thread in threads:
+            thread.start()
+        deadline = started + timeout + kill_timeout
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.perf_counter()))
+        report = {'stopped': len(children), 'killed': self.killed - killed,
+                  'elapsed_s': round(time.perf_counter() - started, 3)}
+        if children:
+            logging.info('Stopped %d child processes in %.0f ms (%d killed)', report['stopped'],
+                         report['elapsed_s'] * 1000, report['killed'])
+        return report
+
+    def shutdown(self, timeout=STOP_TIMEOUT, kill_timeout=KILL_TIMEOUT):
+        """:meth:`stop_all`, then close the job so nothing of ours outlives the app."""
+        report = self.stop_all(timeout, kill_timeout)
+        job, self.job = self.job, None
+        if job is not None:
+            job.close()
+        return report
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_supervisor():
+    """The supervisor shared by everything in this process."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = ProcessSupervisor()
+        return _default
+
+
+def spawn(args, label, graceful=close_stdin_or_terminate, **popen_kwargs):
+    return default_supervisor().spawn(args, label, graceful, **popen_kwargs)
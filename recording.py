@@ -0,0 +1,339 @@
+"""Record what Audio Receiver gets without decoding or re-encoding it.
+
+:class:`RecordingTap` sits between the transport and the decoder. Every chunk
+is written to the decoder and appended to the recording unchanged, so
+recording costs file writes instead of a second ffmpeg and a lossy MP3
+transcode. MPEG-TS and Ogg streams are kept in their own container; raw PCM
+gets a WAV header whose sizes are filled in when a segment is closed.
+
+Recordings are cut into fixed-length segments kept in a
+:class:`RecordingStore`. Each closed segment gets a line in ``index.jsonl``
+(start and end wall-clock time, size, codec), so a multi-day capture can be
+played from any point with a binary search instead of scanning files, a crash
+costs at most the open segment, and old segments can be evicted by age or
+total size.
+"""
+import bisect
+import json
+import logging
+import os
+import struct
+import time
+from datetime import datetime
+
+from stream_format import CODEC_PCM, ogg_pages
+
+WAV_HEADER = struct.Struct('<4sI4s4sIHHIIHH4sI')
+WAV_UNKNOWN_SIZE = 0xFFFFFFFF  # What streaming writers use until the length is known
+
+SEGMENT_SECONDS = 300              # Five minute segments
+GAP_SECONDS = 2.0                  # A pause this long (sender gone) starts a new segment
+RETENTION_MAX_AGE_DAYS = 14
+RETENTION_MAX_BYTES = 4 * 1024 ** 3
+INDEX_FILE = 'index.jsonl'
+PLAYLIST_FILE = 'playback.ffconcat'
+
+
+def wav_header(sample_rate, channels, data_size=None, bits=16):
+    block_align = channels * bits // 8
+    if data_size is None:
+        riff_size = data_size = WAV_UNKNOWN_SIZE
+    else:
+        data_size = min(data_size, WAV_UNKNOWN_SIZE - WAV_HEADER.size)
+        riff_size = WAV_HEADER.size - 8 + data_size
+    return WAV_HEADER.pack(b'RIFF', riff_size, b'WAVE', b'fmt ', 16, 1, channels, sample_rate,
+                           sample_rate * block_align, block_align, bits, b'data', data_size)
+
+
+class RecordingStore:
+    """A directory of recording segments and the time index that describes them."""
+
+    def __init__(self, directory, max_age_days=RETENTION_MAX_AGE_DAYS, max_bytes=RETENTION_MAX_BYTES):
+        self.directory = directory
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self.entries = []
+        self.starts = []
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    def load(self):
+        entries = []
+        broken = False
+        try:
+            with open(self.index_path, 'r') as file:
+                for line in file:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        broken = True  # Half-written last line after a crash
+        except FileNotFoundError:
+            pass
+        present = [entry for entry in entries if os.path.exists(self.path_for(entry))]
+        if broken or len(present) != len(entries):
+            # Before anything is appended, or the next line would run on from the broken one
+            self._set_entries(present)
+            self._rewrite_index()
+        self._set_entries(present + self._orphans(present))
+
+    def _orphans(self, entries):
+        # Segments that were still open when the app went down: index them from their name and mtime
+        known = {entry['file'] for entry in entries}
+        orphans = []
+        for name in os.listdir(self.directory):
+            if not name.startswith('seg_') or name in known:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                start = datetime.strptime(name[4:19], '%Y%m%d_%H%M%S').timestamp()
+            except ValueError:
+                continue
+            entry = {'file': name, 'start': start, 'end': max(start, os.path.getmtime(path)),
+                     'bytes': os.path.getsize(path), 'codec': None, 'session': None}
+            logging.info('Indexing unfinished recording segment %s', name)
+            orphans.append(entry)
+            self._append_line(entry)
+        return orphans
+
+    def _set_entries(self, entries):
+        self.entries = sorted(entries, key=lambda entry: entry['start'])
+        self.starts = [entry['start'] for entry in self.entries]
+
+    def path_for(self, entry):
+        return os.path.join(self.directory, entry['file'])
+
+    def new_segment_path(self, start, extension):
+        stamp = datetime.fromtimestamp(start).strftime('%Y%m%d_%H%M%S')
+        name = f'seg_{stamp}.{extension}'
+        counter = 1
+        while os.path.exists(os.path.join(self.directory, name)):
+            name = f'seg_{stamp}_{counter}.{extension}'
+            counter += 1
+        return os.path.join(self.directory, name)
+
+    def _append_line(self, entry):
+        with open(self.index_path, 'a') as file:
+            file.write(json.dumps(entry) + '\n')
+
+    def add(self, entry):
+        self._append_line(entry)
+        position = bisect.bisect_right(self.starts, entry['start'])
+        self.entries.insert(position, entry)
+        self.starts.insert(position, entry['start'])
+        self.enforce_retention()
+
+    def enforce_retention(self, now=None):
+        now = now or time.time()
+        total = sum(entry['bytes'] for entry in self.entries)
+        keep_from = 0
+        for entry in self.entries:
+            too_old = self.max_age_days and now - entry['end'] > self.max_age_days * 86400
+            too_big = self.max_bytes and total > self.max_bytes
+            if not (too_old or too_big):
+                break
+            try:
+                os.remove(self.path_for(entry))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning('Could not delete old recording %s: %s', entry['file'], e)
+                break
+            total -= entry['bytes']
+            keep_from += 1
+        if keep_from:
+            logging.info('Deleted %d old recording segments', keep_from)
+            self._set_entries(self.entries[keep_from:])
+            self._rewrite_index()
+
+    def _rewrite_index(self):
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            for entry in self.entries:
+                file.write(json.dumps(entry) + '\n')
+        os.replace(temp_path, self.index_path)
+
+    def locate(self, when):
+        """Return ``(index, offset_seconds)`` of the segment playing at ``when``, or None.
+
+        A time in a gap between segments resolves to the start of the next one.
+        """
+        position = bisect.bisect_right(self.starts, when) - 1
+        if position < 0:
+            return (0, 0.0) if self.entries else None
+        entry = self.entries[position]
+        if when <= entry['end']:
+            return position, when - entry['start']
+        if position + 1 < len(self.entries):
+            return position + 1, 0.0
+        return None
+
+    def last_session_start(self):
+        # Where "play the last recording" starts: the first segment of the newest session
+        if not self.entries:
+            return None
+        session = self.entries[-1].get('session')
+        start = self.entries[-1]['start']
+        for entry in reversed(self.entries):
+            if entry.get('session') != session:
+                break
+            start = entry['start']
+        return start
+
+    def write_playlist(self, when):
+        """Write an ffconcat playlist that plays from ``when`` onwards, or return None.
+
+        The playlist stops where the codec changes, because the concat demuxer
+        needs the same stream parameters in every file.
+        """
+        located = self.locate(when)
+        if located is None:
+            return None
+        position, offset = located
+        codec = self.entries[position].get('codec')
+        lines = ['ffconcat version 1.0']
+        for entry in self.entries[position:]:
+            if entry.get('codec') != codec:
+                break
+            lines.append("file '%s'" % self.path_for(entry).replace("'", "'\\''"))
+            if entry is self.entries[position] and offset > 0:
+                lines.append(f'inpoint {offset:.3f}')
+        path = os.path.join(self.directory, PLAYLIST_FILE)
+        with open(path, 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        return path
+
+
+class _Segment:
+    # One open segment file.
+    def __init__(self, store, header, start, session):
+        self.header = header
+        self.start = start
+        self.end = start
+        self.session = session
+        self.bytes = 0
+        self.wav = header.codec == CODEC_PCM
+        self.path = store.new_segment_path(start, header.profile.extension)
+        self.file = open(self.path, 'wb')
+        if self.wav:
+            self.file.write(wav_header(header.sample_rate, header.channels))
+
+    def write(self, data, now):
+        self.file.write(data)
+        self.bytes += len(data)
+        self.end = now
+
+    def close(self):
+        if self.wav:
+            self.file.seek(0)
+            self.file.write(wav_header(self.header.sample_rate, self.header.channels, self.bytes))
+        self.file.close()
+        return {'file': os.path.basename(self.path), 'start': round(self.start, 3), 'end': round(self.end, 3),
+                'bytes': os.path.getsize(self.path), 'codec': self.header.codec, 'session': self.session}
+
+
+class RecordingTap:
+    """A sink that passes everything on to ``sink`` and records a copy in ``store``.
+
+    Segments are cut every ``segment_seconds`` and after a pause, always on a
+    boundary the container allows: a PCM frame, an MPEG-TS packet or an Ogg
+    page. Every Ogg segment starts with the stream's header pages so it plays
+    on its own. A failing recording (disk full, file locked) is logged and
+    dropped; the audio keeps playing. Closing the tap closes ``sink`` and
+    finishes the open segment.
+    """
+
+    def __init__(self, sink, store, header, segment_seconds=SEGMENT_SECONDS):
+        self.sink = sink
+        self.store = store
+        self.header = header
+        self.segment_seconds = segment_seconds
+        self.session = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.align = header.profile.align
+        self.ogg = header.profile.ogg_pages
+        self.ogg_pending = b''
+        self.ogg_headers = []
+        self.written = 0  # Total bytes recorded, for the alignment of the next cut
+        self.segment = None
+        self.cut_pending = True
+        self.recording = True
+        self.last_write = None
+        logging.info('Recording %s to %s in %d s segments', header.profile.label, store.directory, segment_seconds)
+
+    def write(self, data):
+        self.sink.write(data)
+        if not self.recording:
+            return
+        try:
+            self._record(data, time.time())
+        except OSError as e:
+            logging.error('Recording stopped: %s', e)
+            self.recording = False
+            self._close_segment()
+
+    def flush(self):
+        self.sink.flush()
+
+    def close(self):
+        try:
+            self.sink.close()
+        finally:
+            if self.ogg and self.ogg_pending and self.segment:
+                self.segment.write(self.ogg_pending, time.time())
+            self._close_segment()
+            self.recording = False
+
+    def _due(self, now):
+        if self.segment is None:
+            return True
+        return now - self.segment.start >= self.segment_seconds or now - self.last_write > GAP_SECONDS
+
+    def _record(self, data, now):
+        self.cut_pending = self.cut_pending or self._due(now)
+        self.last_write = now
+        if self.ogg:
+            self._record_ogg_pages(data, now)
+            return
+        cut = (-self.written) % self.align
+        self.written += len(data)
+        if self.cut_pending and cut <= len(data):
+            # Finish the frame or TS packet in the old segment, then start the next one
+            if cut:
+                self.segment.write(data[:cut], now)
+                data = data[cut:]
+            self._roll(now)
+        self.segment.write(data, now)
+
+    def _record_ogg_pages(self, data, now):
+        data = self.ogg_pending + data
+        end = 0
+        for offset, length, granule in ogg_pages(data):
+            page = data[offset:offset + length]
+            end = offset + length
+            if granule == 0 and len(self.ogg_headers) < 2:
+                self.ogg_headers.append(page)  # OpusHead and OpusTags, repeated in every segment
+                continue
+            if self.cut_pending:
+                self._roll(now)
+                self.segment.write(b''.join(self.ogg_headers), now)
+            self.segment.write(page, now)
+        self.ogg_pending = data[end:]
+
+    def _roll(self, now):
+        self._close_segment()
+        self.segment = _Segment(self.store, self.header, now, self.session)
+        self.cut_pending = False
+
+    def _close_segment(self):
+        segment, self.segment = self.segment, None
+        if segment is None:
+            return
+        try:
+            entry = segment.close()
+        except OSError as e:
+            logging.error('Could not finish recording segment %s: %s', segment.path, e)
+            return
+        if entry['bytes']:
+            self.store.add(entry)
+        else:
+            os.remove(segment.path)
@@ -0,0 +1,116 @@
+"""Startup timing and background initialisation for Audio Streamer and Audio Receiver.
+
+Both apps show their window first and finish the slow parts of startup
+(pycaw/COM, checking the ffmpeg binaries, device checks) on worker threads.
+:class:`StartupTrace` records how long each phase took, measured from the
+moment this module was imported, and logs one summary line once the app is
+ready, so a slow import or init step shows up in the log instead of as a
+vague "it starts slowly".
+
+Import this module first so the zero point is as close to process start as possible.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_T0 = time.perf_counter()
+BACKGROUND_WORKERS = 3
+
+
+class StartupTrace:
+    """Named phases with their start and end, in milliseconds since the zero point."""
+
+    def __init__(self, app_name):
+        self.app_name = app_name
+        self.phases = []
+        self.reported = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def now_ms():
+        return (time.perf_counter() - _T0) * 1000
+
+    def add(self, name, start_ms, end_ms=None):
+        end_ms = self.now_ms() if end_ms is None else end_ms
+        with self._lock:
+            # Not logged here: the first phases end before the app has configured logging
+            self.phases.append((name, start_ms, end_ms, threading.current_thread().name))
+
+    def mark(self, name, since_ms=0.0):
+        """Close a phase that started at ``since_ms`` (the zero point by default) now."""
+        self.add(name, since_ms)
+        return self.now_ms()
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def report(self):
+        """Log every phase on one line, once."""
+        with self._lock:
+            if self.reported:
+                return
+            self.reported = True
+            phases = sorted(self.phases, key=lambda phase: phase[1])
+        parts = [f'{name} {end - start:.0f} ms' + ('' if thread == 'MainThread' else ' (bg)')
+                 for name, start, end, thread in phases]
+        logging.info('%s startup %.0f ms: %s', self.app_name, self.now_ms(), ', '.join(parts))
+
+
+class _Phase:
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = self.trace.now_ms()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add(self.name, self.start)
+        return False
+
+
+class BackgroundInit:
+    """Run named startup tasks on worker threads and hand the results to the UI thread.
+
+    ``schedule(callback)`` must run ``callback`` on the UI thread (for Tk:
+    :meth:`ui_bus.UiBus.call`). Each ``on_done(result)`` is
+    called there once its task finished; a task that raised is logged and its
+    ``on_done`` gets None. When every task is done the trace is reported.
+    """
+
+    def __init__(self, trace, schedule, workers=BACKGROUND_WORKERS):
+        self.trace = trace
+        self.schedule = schedule
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='startup')
+        self._lock = threading.Lock()
+
+    def submit(self, name, task, on_done=None):
+        with self._lock:
+            self.pending += 1
+        self._executor.submit(self._run, name, task, on_done)
+
+    def _run(self, name, task, on_done):
+        result = None
+        try:
+            with self.trace.phase(name):
+                result = task()
+        except Exception as e:
+            logging.error('Startup task %s failed: %s', name, e)
+        self.schedule(lambda: self._finish(on_done, result))
+
+    def _finish(self, on_done, result):
+        # On the UI thread
+        if on_done is not None:
+            try:
+                on_done(result)
+            except Exception as e:
+                logging.error('Startup step failed: %s', e)
+        with self._lock:
+            self.pending -= 1
+            done = self.pending == 0
+        if done:
+            self._executor.shutdown(wait=False)
+            self.trace.report()
@@ -0,0 +1,157 @@
+"""Codec profiles and the stream header shared by Audio Streamer and Audio Receiver.
+
+The sender picks a profile and announces it in a small header at the start of
+every TCP connection (and periodically as an RTP config packet over UDP). The
+receiver builds its decoder command from that header, so it no longer has to
+probe the incoming bytes to find out what they are.
+"""
+import struct
+
+CODEC_PCM = 'pcm'
+CODEC_OPUS_10 = 'opus10'
+CODEC_OPUS_20 = 'opus20'
+CODEC_MP3 = 'mp3'
+DEFAULT_CODEC = CODEC_MP3
+
+SAMPLE_RATE = 48000
+CHANNELS = 2
+
+HEADER_MAGIC = b'ASTR'
+HEADER_VERSION = 1
+# magic, version, codec id, sample rate, channels, frame duration (ms)
+HEADER = struct.Struct('!4sBBIBB')
+HEADER_SIZE = HEADER.size
+
+
+class CodecProfile:
+    """Everything the two ends need to know about one codec choice."""
+
+    def __init__(self, key, codec_id, label, encoder_args, decoder_args, frame_ms=0,
+                 align=1, payload_size=1316, conceal_silence=False, restart_on_reconnect=False,
+                 ogg_pages=False, extension='ts'):
+        self.key = key
+        self.codec_id = codec_id
+        self.label = label
+        self.encoder_args = encoder_args
+        self.decoder_args = decoder_args
+        self.frame_ms = frame_ms
+        self.align = align                      # RTP payloads are cut on this boundary
+        self.payload_size = payload_size        # Bytes per RTP payload
+        self.conceal_silence = conceal_silence  # Lost RTP packets are replaced with silence
+        # Containers with header pages (Ogg) can't be joined mid-stream, so the
+        # receiver starts a new decoder for every session
+        self.restart_on_reconnect = restart_on_reconnect
+        self.ogg_pages = ogg_pages  # The sender replays the Ogg header pages to late joiners
+        self.extension = extension
+
+    def encoder_output_args(self, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+        """ffmpeg output options that produce this profile on ``pipe:1``."""
+        return [arg.format(rate=sample_rate, channels=channels, frame_ms=self.frame_ms,
+                           frame_us=self.frame_ms * 1000) for arg in self.encoder_args]
+
+    def decoder_input_args(self, header):
+        """ffmpeg/ffplay input options for a stream described by ``header``."""
+        layout = {1: 'mono', 2: 'stereo'}.get(header.channels, f'{header.channels}c')
+        return [arg.format(rate=header.sample_rate, channels=header.channels, layout=layout)
+                for arg in self.decoder_args]
+
+    def conceal(self, missing, last_payload):
+        # Only raw PCM can be patched blindly; compressed formats resync on their own.
+        if self.conceal_silence and last_payload:
+            return bytes(len(last_payload) * missing)
+        return None
+
+
+CODECS = {
+    CODEC_PCM: CodecProfile(
+        CODEC_PCM, 1, 'PCM (LAN)',
+        ['-codec:a', 'pcm_s16le', '-ar', '{rate}', '-ac', '{channels}', '-f', 's16le'],
+        ['-f', 's16le', '-sample_rate', '{rate}', '-ch_layout', '{layout}'],
+        frame_ms=5, align=CHANNELS * 2, payload_size=SAMPLE_RATE * CHANNELS * 2 * 5 // 1000,
+        conceal_silence=True, extension='wav'),
+    CODEC_OPUS_10: CodecProfile(
+        CODEC_OPUS_10, 2, 'Opus 10 ms',
+        ['-codec:a', 'libopus', '-b:a', '128k', '-application', 'lowdelay', '-frame_duration', '{frame_ms}',
+         '-ar', '{rate}', '-ac', '{channels}', '-f', 'ogg', '-page_duration', '{frame_us}'],
+        ['-f', 'ogg', '-probesize', '32', '-analyzeduration', '0'],
+        frame_ms=10, restart_on_reconnect=True, ogg_pages=True, extension='ogg'),
+    CODEC_OPUS_20: CodecProfile(
+        CODEC_OPUS_20, 3, 'Opus 20 ms',
+        ['-codec:a', 'libopus', '-b:a', '128k', '-application', 'lowdelay', '-frame_duration', '{frame_ms}',
+         '-ar', '{rate}', '-ac', '{channels}', '-f', 'ogg', '-page_duration', '{frame_us}'],
+        ['-f', 'ogg', '-probesize', '32', '-analyzeduration', '0'],
+        frame_ms=20, restart_on_reconnect=True, ogg_pages=True, extension='ogg'),
+    CODEC_MP3: CodecProfile(
+        CODEC_MP3, 4, 'MP3 192k',
+        ['-codec:a', 'libmp3lame', '-b:a', '192k', '-f', 'mpegts'],
+        ['-probesize', '32', '-analyzeduration', '0', '-f', 'mpegts'],
+        frame_ms=26, align=188, extension='ts'),
+}
+
+_BY_ID = {profile.codec_id: profile for profile in CODECS.values()}
+
+
+class StreamHeader:
+    """The few bytes that describe a stream before any audio is sent."""
+
+    def __init__(self, codec=DEFAULT_CODEC, sample_rate=SAMPLE_RATE, channels=CHANNELS, legacy=False):
+        self.codec = codec
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.legacy = legacy  # Sender predates the header and sent bare MPEG-TS
+
+    @property
+    def profile(self):
+        return CODECS[self.codec]
+
+    def pack(self):
+        return HEADER.pack(HEADER_MAGIC, HEADER_VERSION, self.profile.codec_id,
+                           self.sample_rate, self.channels, self.profile.frame_ms)
+
+    @classmethod
+    def unpack(cls, data):
+        """Parse a header, or return None if ``data`` doesn't start with one."""
+        if len(data) < HEADER_SIZE or not data.startswith(HEADER_MAGIC):
+            return None
+        _, version, codec_id, sample_rate, channels, _ = HEADER.unpack_from(data)
+        profile = _BY_ID.get(codec_id)
+        if profile is None:
+            raise ValueError(f'Unknown codec id {codec_id} (header version {version})')
+        return cls(profile.key, sample_rate, channels)
+
+    def __eq__(self, other):
+        return (isinstance(other, StreamHeader) and
+                (self.codec, self.sample_rate, self.channels) == (other.codec, other.sample_rate, other.channels))
+
+    def __repr__(self):
+        return f'StreamHeader({self.codec!r}, {self.sample_rate}, {self.channels})'
+
+
+def ogg_pages(data):
+    """Yield ``(offset, length, granule position)`` for every complete Ogg page in ``data``."""
+    offset = 0
+    while len(data) - offset >= 27:
+        if data[offset:offset + 4] != b'OggS':
+            found = data.find(b'OggS', offset + 1)
+            offset = found if found >= 0 else len(data) - 3
+            continue
+        segments = data[offset + 26]
+        if len(data) - offset < 27 + segments:
+            return
+        length = 27 + segments + sum(data[offset + 27:offset + 27 + segments])
+        if len(data) - offset < length:
+            return
+        yield offset, length, int.from_bytes(data[offset + 6:offset + 14], 'little')
+        offset += length
+
+
+def legacy_header():
+    """Header assumed for a sender that sends bare MPEG-TS/MP3 without announcing it."""
+    return StreamHeader(CODEC_MP3, legacy=True)
+
+
+def codec_for_label(label):
+    for key, profile in CODECS.items():
+        if profile.label == label:
+            return key
+    return DEFAULT_CODEC
@@ -0,0 +1,1407 @@
+"""Network transport shared by Audio Streamer and Audio Receiver.
+
+ffmpeg no longer owns the socket. The sender reads the encoded stream from
+ffmpeg's stdout (``pipe:1``) and pushes it over its own TCP connection; the
+receiver accepts that connection itself and feeds the decoder through stdin.
+Each direction is a small two-stage pump (read -> bounded queue -> write) so
+socket buffer sizes, batching and backpressure are under our control and the
+throughput and queueing delay of every stage can be measured.
+
+As an alternative to the single TCP stream there is a UDP mode carrying RTP
+packets (RFC 3550 header, MPEG-TS payload as in RFC 2250). A lost datagram
+only costs its own payload instead of stalling everything behind it, and the
+receiver's adaptive jitter buffer keeps the playout delay bounded.
+"""
+import collections
+import ipaddress
+import logging
+import queue
+import random
+import socket
+import struct
+import threading
+import time
+
+from stream_format import HEADER_MAGIC, HEADER_SIZE, StreamHeader, legacy_header, ogg_pages
+
+DEFAULT_PORT = 6005
+CHUNK_SIZE = 1316                 # 7 MPEG-TS packets, matches a typical RTP payload
+MAX_BATCH_BYTES = 8 * CHUNK_SIZE  # Upper bound for one coalesced socket/pipe write
+QUEUE_CHUNKS = 64                 # Chunks allowed in flight before the reader blocks
+SOCKET_BUFFER_SIZE = 64 * 1024    # Small kernel buffers keep queued audio short
+CONNECT_TIMEOUT = 5.0
+
+TRANSPORT_TCP = 'tcp'
+TRANSPORT_UDP = 'udp'
+TRANSPORT_MULTICAST = 'multicast'
+TRANSPORTS = {TRANSPORT_TCP: 'TCP', TRANSPORT_UDP: 'UDP (RTP)', TRANSPORT_MULTICAST: 'UDP multicast'}
+MULTICAST_GROUP = '239.255.60.5'  # Organisation-local scope, port stays DEFAULT_PORT
+MULTICAST_TTL = 1                 # Stay on the local network segment
+
+RTP_HEADER = struct.Struct('!BBHII')
+RTP_VERSION = 2
+RTP_PAYLOAD_MP2T = 33             # Static payload type for MPEG-TS (RFC 3551)
+RTP_CLOCK_RATE = 90000
+TS_PACKET_SIZE = 188
+UDP_BUFFER_SIZE = 256 * 1024
+RTP_PAYLOAD_DYNAMIC = 96          # PCM and Opus/Ogg payloads
+RTP_PAYLOAD_CONFIG = 127          # Carries the stream header, doesn't use a sequence number
+RTP_CONFIG_INTERVAL = 1.0         # Repeat the header so a receiver can join mid-stream
+DSCP_EXPEDITED = 0xB8             # EF, honoured by managed switches and QoS policies
+JITTER_TARGET_MS = 40             # Default playout delay added by the jitter buffer
+JITTER_MIN_MS = 10
+JITTER_MAX_MS = 250
+UDP_IDLE_TIMEOUT = 5.0            # Same as the old ffmpeg TCP timeout
+MAX_SENDERS = 4                   # Concurrent senders accepted by MultiReceiver
+STALL_GAP = 0.2                   # A TCP stream pausing this long has run the decoder dry
+
+_STOP = object()
+
+
+class TransportStats:
+    """Thread-safe counters for the read and write stage of a pump."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.bytes_read = 0
+        self.chunks_read = 0
+        self.bytes_written = 0
+        self.writes = 0
+        self.queue_delay_total = 0.0
+        self.queue_delay_max = 0.0
+        self.queue_depth = 0
+        self.chunks_dropped = 0
+        self.underruns = 0
+        self.last_activity = None
+
+    def record_read(self, nbytes):
+        with self._lock:
+            self.bytes_read += nbytes
+            self.chunks_read += 1
+            self.queue_depth += 1
+            self.last_activity = time.monotonic()
+
+    def record_write(self, nbytes, queue_delays):
+        # One entry in ``queue_delays`` per chunk that left the queue.
+        with self._lock:
+            self.bytes_written += nbytes
+            self.writes += 1
+            self.queue_depth -= len(queue_delays)
+            self.queue_delay_total += sum(queue_delays)
+            self.queue_delay_max = max(self.queue_delay_max, max(queue_delays, default=0.0))
+
+    def record_drop(self, chunks):
+        with self._lock:
+            self.chunks_dropped += chunks
+            self.queue_depth -= chunks
+
+    def record_underrun(self):
+        with self._lock:
+            self.underruns += 1
+
+    def snapshot(self):
+        """Return a plain dict of the counters plus derived rates."""
+        with self._lock:
+            elapsed = max(time.monotonic() - self.started, 1e-6)
+            delivered = self.chunks_read - self.queue_depth - self.chunks_dropped
+            avg_delay = self.queue_delay_total / delivered if delivered else 0.0
+            return {
+                'elapsed_s': round(elapsed, 3),
+                'bytes_read': self.bytes_read,
+                'chunks_read': self.chunks_read,
+                'bytes_written': self.bytes_written,
+                'writes': self.writes,
+                'read_kbps': round(self.bytes_read * 8 / elapsed / 1000, 1),
+                'write_kbps': round(self.bytes_written * 8 / elapsed / 1000, 1),
+                'queue_depth': self.queue_depth,
+                'chunks_dropped': self.chunks_dropped,
+                'underruns': self.underruns,
+                'avg_queue_delay_ms': round(avg_delay * 1000, 2),
+                'max_queue_delay_ms': round(self.queue_delay_max * 1000, 2),
+                'idle_s': round(time.monotonic() - self.last_activity, 3) if self.last_activity else None,
+            }
+
+
+def idle_counters():
+    """Counters of a receiver that has no sender, see :meth:`StreamReceiver.counters`."""
+    return {'connected': False, 'bytes': 0, 'packets': 0, 'buffer_ms': None, 'underruns': 0,
+            'late': 0, 'dropped': 0, 'lost': 0, 'idle_s': None}
+
+
+def sum_counters(counters):
+    """Combine the counters of concurrent sessions into one set."""
+    total = idle_counters()
+    for item in counters:
+        total['connected'] = total['connected'] or item['connected']
+        for key in ('bytes', 'packets', 'underruns', 'late', 'dropped', 'lost'):
+            total[key] += item[key]
+        for key in ('buffer_ms', 'idle_s'):
+            # The emptiest buffer and the most recent packet say the most
+            if item[key] is not None and (total[key] is None or item[key] < total[key]):
+                total[key] = item[key]
+    return total
+
+
+class _Pump:
+    """Move chunks from ``read_chunk`` to ``write_chunk`` through a bounded queue.
+
+    The reader blocks when the queue is full, which pushes backpressure onto the
+    source (ffmpeg's pipe or the TCP window). The writer drains every queued
+    chunk up to ``max_batch_bytes`` into a single write.
+    """
+
+    def __init__(self, name, read_chunk, write_chunk, stats, on_finished,
+                 queue_chunks=QUEUE_CHUNKS, max_batch_bytes=MAX_BATCH_BYTES):
+        self.name = name
+        self.read_chunk = read_chunk
+        self.write_chunk = write_chunk
+        self.stats = stats
+        self.on_finished = on_finished
+        self.max_batch_bytes = max_batch_bytes
+        self.queue = queue.Queue(maxsize=queue_chunks)
+        self.stopped = threading.Event()
+        self.error = None
+        self.reader_thread = threading.Thread(target=self._read_loop, name=f'{name}-read', daemon=True)
+        self.writer_thread = threading.Thread(target=self._write_loop, name=f'{name}-write', daemon=True)
+
+    def start(self):
+        self.reader_thread.start()
+        self.writer_thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _read_loop(self):
+        try:
+            while not self.stopped.is_set():
+                data = self.read_chunk()
+                if not data:
+                    break
+                self.stats.record_read(len(data))
+                if not self._put((time.monotonic(), data)):
+                    break
+        except (OSError, ValueError) as e:
+            if not self.stopped.is_set():
+                self.error = e
+                logging.debug('%s reader stopped: %s', self.name, e)
+        finally:
+            # The writer may be blocked in get(); make sure it wakes up.
+            try:
+                self.queue.put_nowait(_STOP)
+            except queue.Full:
+                self.stopped.set()
+
+    def _write_loop(self):
+        try:
+            while True:
+                try:
+                    item = self.queue.get(timeout=0.2)
+                except queue.Empty:
+                    if self.stopped.is_set():
+                        break
+                    continue
+                if item is _STOP:
+                    break
+                batch = [item]
+                size = len(item[1])
+                while size < self.max_batch_bytes:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        self.stopped.set()
+                        break
+                    batch.append(item)
+                    size += len(item[1])
+                now = time.monotonic()
+                self.write_chunk(b''.join(data for _, data in batch))
+                self.stats.record_write(size, [now - queued for queued, _ in batch])
+                if self.stopped.is_set() and self.queue.empty():
+                    break
+        except (OSError, ValueError) as e:
+            if not self.stopped.is_set():
+                self.error = e
+                logging.debug('%s writer stopped: %s', self.name, e)
+        finally:
+            self.stopped.set()
+            self.on_finished(self)
+
+
+def _reader_for(source, chunk_size):
+    # read1() returns whatever is already buffered instead of waiting for a full
+    # chunk, which keeps a low-bitrate encoder from being held back.
+    read = getattr(source, 'read1', None) or source.read
+    return lambda: read(chunk_size)
+
+
+class LiveSource:
+    """Keep reading ``pipe`` no matter what the network is doing.
+
+    The encoder must never block on its stdout, otherwise the capture device
+    overruns and stale audio piles up in the pipe. While nothing is
+    subscribed the data is discarded, and a subscriber that falls behind loses
+    its oldest chunks instead of stalling the pipe. Chunks are cut on
+    ``align`` byte boundaries so dropping one never splits an MPEG-TS packet
+    or a PCM frame.
+
+    With ``ogg_pages`` the stream is cut into whole Ogg pages instead, and the
+    header pages at the start of the stream are kept so every subscriber gets
+    them first. That lets a receiver join an Ogg/Opus stream that is already
+    running.
+    """
+
+    def __init__(self, pipe, align=1, chunk_size=CHUNK_SIZE, max_queued=QUEUE_CHUNKS, ogg_pages=False):
+        self.pipe = pipe
+        self.align = align
+        self.chunk_size = chunk_size
+        self.max_queued = max_queued
+        self.ogg_pages = ogg_pages
+        self.header_pages = []
+        self._headers_done = False
+        self.subscriptions = []
+        self.lock = threading.Lock()
+        self.eof = threading.Event()
+        self.on_eof = None
+        self.bytes_read = 0
+        self.bytes_discarded = 0
+
+    def start(self):
+        threading.Thread(target=self._run, name='live-source', daemon=True).start()
+        return self
+
+    def _run(self):
+        read = _reader_for(self.pipe, self.chunk_size)
+        pending = b''
+        try:
+            while True:
+                data = read()
+                if not data:
+                    break
+                self.bytes_read += len(data)
+                pending += data
+                if self.ogg_pages:
+                    usable = self._ogg_boundary(pending)
+                else:
+                    usable = len(pending) - len(pending) % self.align
+                if not usable:
+                    continue
+                chunk, pending = pending[:usable], pending[usable:]
+                with self.lock:
+                    if self.ogg_pages and not self._headers_done:
+                        self._collect_header_pages(chunk)
+                    subscriptions = list(self.subscriptions)
+                if not subscriptions:
+                    self.bytes_discarded += len(chunk)
+                for subscription in subscriptions:
+                    subscription._offer(chunk)
+        except (OSError, ValueError) as e:
+            logging.debug('Live source stopped: %s', e)
+        finally:
+            self.eof.set()
+            with self.lock:
+                subscriptions = list(self.subscriptions)
+            for subscription in subscriptions:
+                subscription._offer(None)
+            if self.on_eof:
+                self.on_eof(self)
+
+    def _ogg_boundary(self, data):
+        end = 0
+        for offset, length, _ in ogg_pages(data):
+            end = offset + length
+        return end
+
+    def _collect_header_pages(self, chunk):
+        # Header pages (OpusHead, OpusTags) are the ones before the first audio, granule 0.
+        for offset, length, granule in ogg_pages(chunk):
+            if granule != 0:
+                self._headers_done = True
+                return
+            self.header_pages.append(chunk[offset:offset + length])
+
+    def subscribe(self, max_queued=None):
+        """Return a file-like reader that sees the stream from this moment on."""
+        subscription = _Subscription(self, max_queued or self.max_queued)
+        with self.lock:
+            if self.header_pages:
+                subscription._offer(b''.join(self.header_pages))
+            self.subscriptions.append(subscription)
+        if self.eof.is_set():
+            subscription._offer(None)
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self.lock:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+
+
+class _Subscription:
+    # Bounded drop-oldest queue between a LiveSource and one consumer.
+    def __init__(self, source, max_queued):
+        self.source = source
+        self.max_queued = max_queued
+        self.queue = collections.deque()
+        self.cond = threading.Condition()
+        self.dropped = 0
+        self.finished = False
+
+    def _offer(self, chunk):
+        with self.cond:
+            if chunk is None:
+                self.finished = True
+            else:
+                if len(self.queue) >= self.max_queued:
+                    self.queue.popleft()
+                    self.dropped += 1
+                self.queue.append(chunk)
+            self.cond.notify()
+
+    def read1(self, size=-1):
+        # Whole chunks are returned regardless of ``size`` to keep the alignment.
+        with self.cond:
+            while not self.queue and not self.finished:
+                self.cond.wait()
+            return self.queue.popleft() if self.queue else b''
+
+    read = read1
+
+    def close(self):
+        self.source._unsubscribe(self)
+        self._offer(None)
+
+
+def _tune_socket(sock, sndbuf=None, rcvbuf=None):
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if sndbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+    if rcvbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+
+
+def _tcp_listener(bind_address, port, rcvbuf, backlog=1):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # Set before accept() so the accepted socket inherits the window size.
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    listener.bind((bind_address, port))
+    listener.listen(backlog)
+    return listener
+
+
+class StreamSender:
+    """Connect to a receiver and forward everything read from ``source``.
+
+    ``header`` (a :class:`stream_format.StreamHeader`) is sent before any
+    audio. ``on_closed(sender, error)`` is called from a worker thread once the
+    connection has gone away, either because the source reached EOF, the
+    socket failed or :meth:`stop` was called.
+    """
+
+    def __init__(self, host, port=DEFAULT_PORT, on_closed=None, header=None, sndbuf=SOCKET_BUFFER_SIZE,
+                 chunk_size=CHUNK_SIZE, queue_chunks=QUEUE_CHUNKS, connect_timeout=CONNECT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.on_closed = on_closed
+        self.header = header
+        self.sndbuf = sndbuf
+        self.chunk_size = chunk_size
+        self.queue_chunks = queue_chunks
+        self.connect_timeout = connect_timeout
+        self.stats = TransportStats()
+        self.connect_ms = None    # TCP handshake time, about one round trip
+        self.sock = None
+        self.pump = None
+        self.connected = threading.Event()
+        self.closed = threading.Event()
+        self._stopping = False
+        self._lock = threading.Lock()
+
+    def start(self, source):
+        threading.Thread(target=self._run, args=(source,), name='sender-connect', daemon=True).start()
+
+    def _run(self, source):
+        try:
+            started = time.perf_counter()
+            sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+            self.connect_ms = (time.perf_counter() - started) * 1000
+            sock.settimeout(None)
+            _tune_socket(sock, sndbuf=self.sndbuf)
+            if self.header is not None:
+                sock.sendall(self.header.pack())
+        except OSError as e:
+            logging.debug('Could not connect to receiver %s:%s: %s', self.host, self.port, e)
+            self._finish(e)
+            return
+        with self._lock:
+            if self._stopping:
+                sock.close()
+                self._finish(None)
+                return
+            self.sock = sock
+            logging.debug('Connected to receiver %s:%s', self.host, self.port)
+            self.connected.set()
+            self.stats = TransportStats()
+            self.pump = _Pump('sender', _reader_for(source, self.chunk_size), sock.sendall,
+                              self.stats, self._on_pump_finished, queue_chunks=self.queue_chunks)
+            self.pump.start()
+
+    def _on_pump_finished(self, pump):
+        if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+        self._finish(pump.error)
+
+    def _finish(self, error):
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        logging.debug('Sender transport closed (%s): %s', error or 'clean', self.stats.snapshot())
+        if self.on_closed:
+            self.on_closed(self, error)
+
+    def stop(self, timeout=2.0):
+        """Flush what is already queued, then close the connection."""
+        with self._lock:
+            self._stopping = True
+            pump = self.pump
+        if pump is None:
+            return
+        pump.writer_thread.join(timeout)
+        pump.stop()
+        if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def is_connected(self):
+        return self.pump is not None and not self.closed.is_set()
+
+
+class StreamReceiver:
+    """Listen for one sender connection and forward its bytes into a sink.
+
+    The listening socket is bound in :meth:`listen` so a busy port is reported
+    to the caller immediately. Once a sender has connected and its stream
+    header has been read, ``open_sink(header)`` is called to get a binary
+    writable (normally the decoder's stdin). A sender that doesn't send a
+    header is treated as legacy MPEG-TS. The sink is closed when the
+    connection ends so a decoder run with ``-autoexit`` shuts down the same way
+    it did when ffplay owned the socket.
+
+    ``listener`` is an already listening socket to accept from instead of
+    binding one; it is left open for the next session (see
+    :class:`StandbyReceiver`).
+    """
+
+    def __init__(self, port=DEFAULT_PORT, bind_address='0.0.0.0', on_closed=None,
+                 rcvbuf=SOCKET_BUFFER_SIZE, chunk_size=CHUNK_SIZE, queue_chunks=QUEUE_CHUNKS, listener=None):
+        self.port = port
+        self.bind_address = bind_address
+        self.on_closed = on_closed
+        self.rcvbuf = rcvbuf
+        self.chunk_size = chunk_size
+        self.queue_chunks = queue_chunks
+        self.stats = TransportStats()
+        self.listener = listener
+        self._owns_listener = listener is None
+        self.error = None
+        self.conn = None
+        self.peer = None
+        self.pump = None
+        self.sink = None
+        self.header = None
+        self.closed = threading.Event()
+        self._stopping = False
+
+    def listen(self):
+        self.listener = _tcp_listener(self.bind_address, self.port, self.rcvbuf)
+        self.port = self.listener.getsockname()[1]
+        return self.port
+
+    def start(self, open_sink):
+        if self.listener is None:
+            self.listen()
+        self.open_sink = open_sink
+        threading.Thread(target=self._accept, name='receiver-accept', daemon=True).start()
+
+    def _read_header(self, conn):
+        # Returns the header and any stream bytes that were read past it.
+        data = b''
+        conn.settimeout(CONNECT_TIMEOUT)
+        try:
+            while len(data) < HEADER_SIZE:
+                chunk = conn.recv(HEADER_SIZE - len(data))
+                if not chunk:
+                    break
+                data += chunk
+                if data[:len(HEADER_MAGIC)] != HEADER_MAGIC[:len(data)]:
+                    break  # Bare MPEG-TS from an older sender
+        finally:
+            conn.settimeout(None)
+        header = StreamHeader.unpack(data)
+        if header is None:
+            logging.info('No stream header from sender, assuming legacy MPEG-TS')
+            return legacy_header(), data
+        return header, data[HEADER_SIZE:]
+
+    def _accept(self):
+        try:
+            conn, peer = self.listener.accept()
+        except OSError as e:
+            if not self._stopping:
+                logging.error('Receiver accept failed: %s', e)
+            self._finish(None if self._stopping else e)
+            return
+        finally:
+            if self._owns_listener:
+                self.listener.close()
+        _tune_socket(conn, rcvbuf=self.rcvbuf)
+        self.conn, self.peer = conn, peer
+        logging.info('Sender connected from %s:%s', *peer)
+        self.stats = TransportStats()
+        try:
+            self.header, leftover = self._read_header(conn)
+            logging.info('Incoming stream: %s', self.header)
+            self.sink = self.open_sink(self.header)
+            if leftover:
+                self.sink.write(leftover)
+        except (OSError, ValueError) as e:
+            logging.error('Could not start session with %s:%s: %s', *peer, e)
+            conn.close()
+            self._finish(e)
+            return
+
+        def read():
+            data = conn.recv(self.chunk_size)
+            last = self.stats.last_activity
+            if data and last is not None and time.monotonic() - last > STALL_GAP:
+                self.stats.record_underrun()
+            return data
+
+        def write(data):
+            self.sink.write(data)
+            self.sink.flush()
+
+        self.pump = _Pump('receiver', read, write,
+                          self.stats, self._on_pump_finished, queue_chunks=self.queue_chunks)
+        self.pump.start()
+        if self._stopping:
+            self.stop()
+
+    def _on_pump_finished(self, pump):
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+        self._finish(pump.error)
+
+    def _finish(self, error):
+        if self.closed.is_set():
+            return
+        self.error = error
+        self.closed.set()
+        try:
+            if self.sink:
+                self.sink.close()
+        except OSError:
+            pass
+        logging.info('Receiver transport closed (%s): %s', error or 'clean', self.stats.snapshot())
+        if self.on_closed:
+            self.on_closed(self, error)
+
+    def counters(self):
+        """Cumulative counters for this session, cheap enough to poll every second.
+
+        ``buffer_ms`` is the audio buffered ahead of playout, or None when it
+        can't be seen: over TCP it sits inside the decoder, which is why a
+        pause of more than ``STALL_GAP`` is counted as an underrun instead.
+        """
+        stats = self.stats.snapshot()
+        return {'connected': self.header is not None and not self.closed.is_set(),
+                'bytes': stats['bytes_read'], 'packets': stats['chunks_read'], 'buffer_ms': None,
+                'underruns': stats['underruns'], 'late': 0, 'dropped': stats['chunks_dropped'], 'lost': 0,
+                'idle_s': stats['idle_s']}
+
+    def stop(self):
+        self._stopping = True
+        if self.pump:
+            self.pump.stop()
+        for sock in (self.conn, self.listener if self._owns_listener else None):
+            if sock is None:
+                continue
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+
+def pack_rtp(seq, timestamp, ssrc, payload, marker=False, payload_type=RTP_PAYLOAD_MP2T):
+    """Build one RTP packet with a fixed 12 byte header."""
+    return RTP_HEADER.pack(RTP_VERSION << 6, (0x80 if marker else 0) | payload_type,
+                           seq & 0xFFFF, timestamp & 0xFFFFFFFF, ssrc) + payload
+
+
+def unpack_rtp(packet):
+    """Return ``(seq, timestamp, ssrc, marker, payload_type, payload)`` or None if invalid."""
+    if len(packet) < RTP_HEADER.size:
+        return None
+    first, second, seq, timestamp, ssrc = RTP_HEADER.unpack_from(packet)
+    if first >> 6 != RTP_VERSION:
+        return None
+    offset = RTP_HEADER.size + 4 * (first & 0x0F)
+    return seq, timestamp, ssrc, bool(second & 0x80), second & 0x7F, packet[offset:]
+
+
+def _unwrap(value, reference, bits):
+    # Map a wrapping counter onto the integer closest to ``reference``.
+    span = 1 << bits
+    candidate = (reference & ~(span - 1)) | value
+    if candidate - reference > span // 2:
+        candidate -= span
+    elif reference - candidate > span // 2:
+        candidate += span
+    return candidate
+
+
+class JitterBuffer:
+    """Reorder RTP packets and release them at a steady playout delay.
+
+    The playout time of a packet is its sender timestamp mapped onto the local
+    clock (using the smallest transit time seen over the last few seconds) plus
+    the target delay. With ``adaptive`` the target follows the RFC 3550
+    interarrival jitter estimate but never drops below ``target_ms`` or exceeds
+    ``max_ms``. Packets that arrive after their slot has been played are counted
+    as late and dropped; gaps are skipped once the next packet is due, and
+    ``conceal(missing, last_payload)`` may return filler bytes for them.
+    """
+
+    def __init__(self, target_ms=JITTER_TARGET_MS, min_ms=JITTER_MIN_MS, max_ms=JITTER_MAX_MS,
+                 adaptive=True, clock_rate=RTP_CLOCK_RATE, conceal=None, window_s=2.0):
+        self.base_target = max(min_ms, min(target_ms, max_ms)) / 1000.0
+        self.min_delay = min_ms / 1000.0
+        self.max_delay = max_ms / 1000.0
+        self.adaptive = adaptive
+        self.clock_rate = clock_rate
+        self.conceal = conceal
+        self.window_s = window_s
+        self.lock = threading.Lock()
+        self.reset()
+        self.late = 0
+        self.lost = 0
+        self.dropped = 0
+        self.received = 0
+
+    def reset(self):
+        self.packets = {}
+        self.next_seq = None
+        self.highest_seq = None
+        self.last_ts = None
+        self.transits = collections.deque()
+        self.offset = None
+        self.prev_transit = None
+        self.jitter = 0.0
+        self.target = self.base_target
+        self.last_payload = b''
+
+    def _due(self, ts):
+        return ts / self.clock_rate + self.offset + self.target
+
+    def push(self, seq, timestamp, payload, arrival=None):
+        arrival = time.monotonic() if arrival is None else arrival
+        with self.lock:
+            if self.highest_seq is None or abs(_unwrap(seq, self.highest_seq, 16) - self.highest_seq) > 3000:
+                # First packet or the sender restarted: start a fresh timeline.
+                if self.highest_seq is not None:
+                    logging.info('RTP sequence jumped, resetting jitter buffer')
+                self.reset()
+                self.highest_seq = seq
+                self.next_seq = seq
+                self.last_ts = timestamp
+            seq = _unwrap(seq, self.highest_seq, 16)
+            timestamp = _unwrap(timestamp, self.last_ts, 32)
+            self.received += 1
+            if seq < self.next_seq or seq in self.packets:
+                self.late += 1
+                return False
+            if seq > self.highest_seq:
+                self.highest_seq = seq
+                self.last_ts = timestamp
+
+            transit = arrival - timestamp / self.clock_rate
+            if self.prev_transit is not None:
+                self.jitter += (abs(transit - self.prev_transit) - self.jitter) / 16.0
+            self.prev_transit = transit
+            while self.transits and self.transits[-1][1] >= transit:
+                self.transits.pop()
+            self.transits.append((arrival, transit))
+            while self.transits[0][0] < arrival - self.window_s:
+                self.transits.popleft()
+            self.offset = self.transits[0][1]
+            if self.adaptive:
+                self.target = max(self.base_target, min(3.0 * self.jitter, self.max_delay))
+
+            self.packets[seq] = (timestamp, payload, arrival)
+            # Hold latency bounded: anything scheduled beyond max_delay pushes the oldest out.
+            while self.packets and self._due(self.packets[min(self.packets)][0]) < arrival - self.max_delay:
+                self._drop_oldest()
+            return True
+
+    def _drop_oldest(self):
+        seq = min(self.packets)
+        del self.packets[seq]
+        self.dropped += 1
+        self.next_seq = seq + 1
+
+    def pop_ready(self, now=None):
+        """Return ``(ready, wait)``.
+
+        ``ready`` is a list of ``(payload, arrival)`` due for playout, where
+        concealment filler has an arrival of None; ``wait`` is the number of
+        seconds until the next buffered packet is due, or None when empty.
+        """
+        now = time.monotonic() if now is None else now
+        out = []
+        with self.lock:
+            while self.packets:
+                head = self.next_seq if self.next_seq in self.packets else min(self.packets)
+                timestamp, payload, arrival = self.packets[head]
+                due = self._due(timestamp)
+                if due > now:
+                    return out, due - now
+                if head != self.next_seq:
+                    missing = head - self.next_seq
+                    self.lost += missing
+                    filler = self.conceal(missing, self.last_payload) if self.conceal else None
+                    if filler:
+                        out.append((filler, None))
+                del self.packets[head]
+                out.append((payload, arrival))
+                self.last_payload = payload
+                self.next_seq = head + 1
+        return out, None
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'depth': len(self.packets),
+                'buffered_ms': round(max(self._due(max(ts for ts, _, _ in self.packets.values())) - time.monotonic(),
+                                         0.0) * 1000, 1) if self.packets else 0.0,
+                'target_ms': round(self.target * 1000, 1),
+                'jitter_ms': round(self.jitter * 1000, 2),
+                'received': self.received,
+                'late': self.late,
+                'lost': self.lost,
+                'dropped': self.dropped,
+            }
+
+
+def _udp_socket(sndbuf=None, rcvbuf=None):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if sndbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+    if rcvbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_TOS, DSCP_EXPEDITED)
+    except (AttributeError, OSError):
+        pass
+    return sock
+
+
+def is_multicast(host):
+    try:
+        return ipaddress.ip_address(host).is_multicast
+    except ValueError:
+        return False
+
+
+def _udp_listener(bind_address, port, rcvbuf, multicast_group=None):
+    sock = _udp_socket(rcvbuf=rcvbuf)
+    if multicast_group:
+        # Several receivers on one machine may listen to the same group
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((bind_address, port))
+    if multicast_group:
+        interface = '0.0.0.0' if bind_address in ('', '0.0.0.0') else bind_address
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                        socket.inet_aton(multicast_group) + socket.inet_aton(interface))
+    sock.settimeout(0.5)
+    return sock
+
+
+class RtpSender:
+    """Packetize ``source`` into RTP over UDP.
+
+    Payloads are cut on the codec's alignment (188 bytes for MPEG-TS, one
+    sample frame for PCM) so a lost datagram never splits a unit the decoder
+    needs whole. Timestamps come from the local clock at the moment the data
+    left the encoder, which is what the receiver's jitter buffer schedules
+    playout against. The stream header goes out as a config packet at the
+    start and every ``RTP_CONFIG_INTERVAL`` seconds; an empty packet with the
+    marker bit set tells the receiver the stream ended.
+    """
+
+    def __init__(self, host, port=DEFAULT_PORT, on_closed=None, header=None, sndbuf=UDP_BUFFER_SIZE):
+        self.host = host
+        self.port = port
+        self.on_closed = on_closed
+        self.header = header or legacy_header()
+        profile = self.header.profile
+        self.align = profile.align
+        self.payload_size = profile.payload_size - profile.payload_size % profile.align
+        self.payload_type = RTP_PAYLOAD_MP2T if profile.align == TS_PACKET_SIZE else RTP_PAYLOAD_DYNAMIC
+        self.sndbuf = sndbuf
+        self.ssrc = random.getrandbits(32)
+        self.seq = random.getrandbits(16)
+        self.stats = TransportStats()
+        self.sock = None
+        self.connected = threading.Event()
+        self.closed = threading.Event()
+        self._stopping = False
+        self._last_config = 0.0
+        self.thread = None
+
+    def start(self, source):
+        self.sock = _udp_socket(sndbuf=self.sndbuf)
+        if is_multicast(self.host):
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, MULTICAST_TTL)
+        self.connected.set()  # Connectionless, there is nothing to wait for
+        self.thread = threading.Thread(target=self._run, args=(source,), name='rtp-sender', daemon=True)
+        self.thread.start()
+
+    def _send(self, payload, read_at, marker=False):
+        timestamp = int(read_at * RTP_CLOCK_RATE)
+        self.sock.sendto(pack_rtp(self.seq, timestamp, self.ssrc, payload, marker, self.payload_type),
+                         (self.host, self.port))
+        self.seq = (self.seq + 1) & 0xFFFF
+        return len(payload)
+
+    def _send_config(self, now):
+        # Config packets reuse the current sequence number so they never look like loss.
+        self.sock.sendto(pack_rtp(self.seq, int(now * RTP_CLOCK_RATE), self.ssrc, self.header.pack(),
+                                  payload_type=RTP_PAYLOAD_CONFIG), (self.host, self.port))
+        self._last_config = now
+
+    def _run(self, source):
+        read = _reader_for(source, self.payload_size)
+        pending = b''
+        error = None
+        try:
+            self._send_config(time.monotonic())
+            while not self._stopping:
+                data = read()
+                if not data:
+                    break
+                read_at = time.monotonic()
+                self.stats.record_read(len(data))
+                if read_at - self._last_config >= RTP_CONFIG_INTERVAL:
+                    self._send_config(read_at)
+                pending += data
+                usable = len(pending) - len(pending) % self.align
+                sent = 0
+                for offset in range(0, usable, self.payload_size):
+                    sent += self._send(pending[offset:min(offset + self.payload_size, usable)], read_at)
+                pending = pending[usable:]
+                self.stats.record_write(sent, [time.monotonic() - read_at])
+            self._send(b'', time.monotonic(), marker=True)
+        except (OSError, ValueError) as e:
+            if not self._stopping:
+                error = e
+                logging.error('RTP sender stopped: %s', e)
+        finally:
+            self.sock.close()
+            self.closed.set()
+            logging.debug('RTP sender closed (%s): %s', error or 'clean', self.stats.snapshot())
+            if self.on_closed:
+                self.on_closed(self, error)
+
+    def stop(self, timeout=2.0):
+        if self.thread:
+            self.thread.join(timeout)
+        self._stopping = True
+
+    def is_connected(self):
+        return self.thread is not None and not self.closed.is_set()
+
+
+class RtpReceiver:
+    """Receive RTP over UDP, smooth it through a :class:`JitterBuffer` and write to a sink.
+
+    Nothing is played until a config packet with the stream header arrives;
+    then ``open_sink(header)`` is called and playout starts. There is no
+    connection to lose, so a session ends when the sender's end marker
+    arrives, the sender switches to a different stream format, or nothing has
+    been received for ``idle_timeout`` seconds. Like :class:`StreamReceiver`
+    the sink is closed when the session ends, and ``sock`` can be a socket
+    bound elsewhere that outlives the session. With ``multicast_group`` the
+    socket joins that group instead of only taking unicast packets.
+    """
+
+    def __init__(self, port=DEFAULT_PORT, bind_address='0.0.0.0', on_closed=None,
+                 target_ms=JITTER_TARGET_MS, max_ms=JITTER_MAX_MS, adaptive=True,
+                 rcvbuf=UDP_BUFFER_SIZE, idle_timeout=UDP_IDLE_TIMEOUT, sock=None, multicast_group=None):
+        self.port = port
+        self.bind_address = bind_address
+        self.multicast_group = multicast_group
+        self.on_closed = on_closed
+        self.rcvbuf = rcvbuf
+        self.idle_timeout = idle_timeout
+        self.jitter = JitterBuffer(target_ms=target_ms, max_ms=max_ms, adaptive=adaptive)
+        self.stats = TransportStats()
+        self.sock = sock
+        self._owns_sock = sock is None
+        self.sink = None
+        self.header = None
+        self.peer = None
+        self.playout_thread = None
+        self.closed = threading.Event()
+        self.ended = threading.Event()
+        self.wakeup = threading.Event()
+        self._stopping = False
+        self.error = None
+
+    def listen(self):
+        self.sock = _udp_listener(self.bind_address, self.port, self.rcvbuf, self.multicast_group)
+        self.port = self.sock.getsockname()[1]
+        return self.port
+
+    def start(self, open_sink):
+        if self.sock is None:
+            self.listen()
+        self.open_sink = open_sink
+        threading.Thread(target=self._receive_loop, name='rtp-receive', daemon=True).start()
+
+    def _on_config(self, payload):
+        header = StreamHeader.unpack(payload)
+        if header is None:
+            return True
+        if self.header is None:
+            logging.info('Incoming stream: %s', header)
+            self.header = header
+            self.jitter.conceal = header.profile.conceal
+            self.sink = self.open_sink(header)
+            self.playout_thread = threading.Thread(target=self._playout_loop, name='rtp-playout', daemon=True)
+            self.playout_thread.start()
+        elif header != self.header:
+            logging.info('Sender switched to %s, ending session', header)
+            return False
+        return True
+
+    def _receive_loop(self):
+        last_packet = None
+        try:
+            while not self._stopping and not self.ended.is_set():
+                try:
+                    packet, peer = self.sock.recvfrom(65536)
+                except socket.timeout:
+                    if last_packet and time.monotonic() - last_packet > self.idle_timeout:
+                        logging.info('No RTP packets for %.1fs, ending session', self.idle_timeout)
+                        break
+                    continue
+                parsed = unpack_rtp(packet)
+                if parsed is None:
+                    continue
+                seq, timestamp, ssrc, marker, payload_type, payload = parsed
+                if self.peer != peer:
+                    self.peer = peer
+                    logging.info('RTP stream from %s:%s', *peer)
+                last_packet = time.monotonic()
+                if payload_type == RTP_PAYLOAD_CONFIG:
+                    if not self._on_config(payload):
+                        break
+                    continue
+                if self.header is None:
+                    continue  # Wait for the config packet before playing anything
+                if marker and not payload:
+                    logging.info('Sender ended the RTP stream')
+                    break
+                dropped = self.jitter.dropped
+                if self.jitter.push(seq, timestamp, payload, last_packet):
+                    self.stats.record_read(len(payload))
+                    if self.jitter.dropped != dropped:
+                        self.stats.record_drop(self.jitter.dropped - dropped)
+                    self.wakeup.set()
+        except (OSError, ValueError) as e:
+            if not self._stopping:
+                self.error = e
+                logging.error('RTP receive failed: %s', e)
+        finally:
+            self.ended.set()
+            self.wakeup.set()
+            if self.playout_thread is None:
+                self._finish()
+
+    def _playout_loop(self):
+        playing = False
+        try:
+            while not self._stopping:
+                ready, wait = self.jitter.pop_ready()
+                if ready:
+                    data = b''.join(payload for payload, _ in ready)
+                    self.sink.write(data)
+                    self.sink.flush()
+                    now = time.monotonic()
+                    self.stats.record_write(len(data), [now - arrival for _, arrival in ready if arrival is not None])
+                    playing = True
+                    continue
+                if self.ended.is_set() and wait is None:
+                    break
+                if wait is None and playing:
+                    # The jitter buffer ran dry while the sender was still there
+                    self.stats.record_underrun()
+                    playing = False
+                self.wakeup.clear()
+                self.wakeup.wait(min(wait, 0.05) if wait is not None else 0.05)
+        except (OSError, ValueError) as e:
+            if not self._stopping:
+                self.error = e
+                logging.error('RTP playout failed: %s', e)
+        finally:
+            self._finish()
+
+    def _finish(self):
+        if self.closed.is_set():
+            return
+        self._stopping = True
+        if self._owns_sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        try:
+            if self.sink:
+                self.sink.close()
+        except OSError:
+            pass
+        self.closed.set()
+        logging.info('RTP receiver closed (%s): %s %s', self.error or 'clean',
+                     self.stats.snapshot(), self.jitter.snapshot())
+        if self.on_closed:
+            self.on_closed(self, self.error)
+
+    def counters(self):
+        """Like :meth:`StreamReceiver.counters`, with ``buffer_ms`` from the jitter buffer."""
+        stats = self.stats.snapshot()
+        jitter = self.jitter.snapshot()
+        return {'connected': self.header is not None and not self.closed.is_set(),
+                'bytes': stats['bytes_read'], 'packets': jitter['received'], 'buffer_ms': jitter['buffered_ms'],
+                'underruns': stats['underruns'], 'late': jitter['late'], 'dropped': jitter['dropped'],
+                'lost': jitter['lost'], 'idle_s': stats['idle_s']}
+
+    def stop(self):
+        self._stopping = True
+        self.wakeup.set()
+
+
+class _SessionSink:
+    """The part of a long-lived sink that one session gets to see.
+
+    Closing it only ends the session; the sink behind it stays open. A sender
+    that vanishes mid-frame is padded out to the profile's alignment so the
+    next session starts on a frame boundary.
+    """
+
+    def __init__(self, sink, align):
+        self.sink = sink
+        self.align = align
+        self.written = 0
+        self.failed = False
+
+    def write(self, data):
+        try:
+            self.sink.write(data)
+        except (OSError, ValueError):
+            self.failed = True
+            raise
+        self.written += len(data)
+
+    def flush(self):
+        try:
+            self.sink.flush()
+        except (OSError, ValueError):
+            self.failed = True
+            raise
+
+    def close(self):
+        partial = self.written % self.align
+        if partial and not self.failed:
+            try:
+                self.sink.write(bytes(self.align - partial))
+                self.sink.flush()
+            except (OSError, ValueError):
+                self.failed = True
+
+
+class StandbyReceiver:
+    """Accept one sender session after another without giving up the port.
+
+    The socket is bound once in :meth:`listen` and each session runs through
+    a fresh :class:`StreamReceiver` or :class:`RtpReceiver` sharing it, so the
+    next sender is accepted as soon as the previous one has gone. The sink
+    outlives the sessions: ``open_sink(header)`` is only called again when the
+    stream format changes, the codec can't be joined mid-stream, the previous
+    sink failed or ``sink_alive()`` returns False. A replaced sink is closed,
+    the last one is closed by :meth:`stop`.
+
+    ``on_session(receiver, header)`` and ``on_session_end(receiver, error)`` are
+    called from worker threads; ``closed`` is only set once :meth:`stop` has
+    been called or the socket itself failed.
+    """
+
+    def __init__(self, transport=TRANSPORT_TCP, port=DEFAULT_PORT, bind_address='0.0.0.0',
+                 on_session=None, on_session_end=None, on_closed=None, sink_alive=None,
+                 multicast_group=MULTICAST_GROUP, **options):
+        self.transport = transport
+        self.multicast_group = multicast_group  # Only used by TRANSPORT_MULTICAST
+        self.port = port
+        self.bind_address = bind_address
+        self.on_session = on_session
+        self.on_session_end = on_session_end
+        self.on_closed = on_closed
+        self.sink_alive = sink_alive
+        self.options = options  # Passed on to every StreamReceiver/RtpReceiver
+        self.sock = None
+        self.receiver = None
+        self.sink = None
+        self.session_sink = None
+        self.header = None
+        self.sessions = 0
+        self.error = None
+        self.closed = threading.Event()
+        self._stopping = False
+        self._lock = threading.Lock()
+
+    def listen(self):
+        if self.transport == TRANSPORT_MULTICAST:
+            self.sock = _udp_listener(self.bind_address, self.port, self.options.get('rcvbuf', UDP_BUFFER_SIZE),
+                                      self.multicast_group)
+        elif self.transport == TRANSPORT_UDP:
+            self.sock = _udp_listener(self.bind_address, self.port, self.options.get('rcvbuf', UDP_BUFFER_SIZE))
+        else:
+            self.sock = _tcp_listener(self.bind_address, self.port, self.options.get('rcvbuf', SOCKET_BUFFER_SIZE))
+        self.port = self.sock.getsockname()[1]
+        return self.port
+
+    def start(self, open_sink):
+        if self.sock is None:
+            self.listen()
+        self.open_sink = open_sink
+        threading.Thread(target=self._run, name='standby-receiver', daemon=True).start()
+
+    @property
+    def stats(self):
+        receiver = self.receiver
+        return receiver.stats if receiver else TransportStats()
+
+    def counters(self):
+        # Counters start over with every session
+        receiver = self.receiver
+        return receiver.counters() if receiver else idle_counters()
+
+    def _new_receiver(self):
+        if self.transport != TRANSPORT_TCP:
+            return RtpReceiver(self.port, self.bind_address, sock=self.sock, **self.options)
+        return StreamReceiver(self.port, self.bind_address, listener=self.sock, **self.options)
+
+    def _open_session_sink(self, header):
+        with self._lock:
+            reusable = (self.sink is not None and header == self.header
+                        and not header.profile.restart_on_reconnect
+                        and not (self.session_sink and self.session_sink.failed)
+                        and (self.sink_alive is None or self.sink_alive()))
+            if reusable:
+                logging.info('Reusing the running decoder for %s', header)
+            else:
+                self._close_sink()
+                self.sink = self.open_sink(header)
+                self.header = header
+            self.session_sink = _SessionSink(self.sink, header.profile.align)
+            self.sessions += 1
+        if self.on_session:
+            self.on_session(self, header)
+        return self.session_sink
+
+    def _close_sink(self):
+        sink, self.sink = self.sink, None
+        if sink is None:
+            return
+        try:
+            sink.close()
+        except OSError:
+            pass
+
+    def _run(self):
+        try:
+            while not self._stopping:
+                receiver = self._new_receiver()
+                with self._lock:
+                    if self._stopping:
+                        break
+                    self.receiver = receiver
+                receiver.start(self._open_session_sink)
+                receiver.closed.wait()
+                if self.on_session_end and receiver.header is not None:
+                    self.on_session_end(self, receiver.error)
+                if receiver.error is not None and receiver.peer is None and not self._stopping:
+                    # Nobody connected, so the socket itself is broken
+                    self.error = receiver.error
+                    break
+                if not self._stopping:
+                    logging.info('Waiting for the next sender on port %s', self.port)
+        finally:
+            self._stopping = True
+            self._shutdown_socket()
+            with self._lock:
+                self._close_sink()
+            self.closed.set()
+            if self.on_closed:
+                self.on_closed(self, self.error)
+
+    def _shutdown_socket(self):
+        if self.sock is None:
+            return
+        if self.transport == TRANSPORT_TCP:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)  # Wakes up a pending accept()
+            except OSError:
+                pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def stop(self):
+        with self._lock:
+            self._stopping = True
+            receiver = self.receiver
+        if receiver:
+            receiver.stop()
+        self._shutdown_socket()
+
+
+class MultiReceiver:
+    """Accept up to ``max_sessions`` TCP senders at the same time on one port.
+
+    Every connection gets its own :class:`StreamReceiver` on the shared
+    listener, and one of them is always waiting in accept() while there is
+    room for another sender. ``open_sink(receiver, header)`` is called for
+    each new session and its sink is closed when that session ends.
+    ``on_session(receiver, header)`` and ``on_session_end(receiver, error)``
+    are called from worker threads.
+    """
+
+    def __init__(self, port=DEFAULT_PORT, bind_address='0.0.0.0', max_sessions=MAX_SENDERS,
+                 on_session=None, on_session_end=None, on_closed=None, **options):
+        self.port = port
+        self.bind_address = bind_address
+        self.max_sessions = max_sessions
+        self.on_session = on_session
+        self.on_session_end = on_session_end
+        self.on_closed = on_closed
+        self.options = options  # Passed on to every StreamReceiver
+        self.listener = None
+        self.waiting = None
+        self.receivers = []
+        self.error = None
+        self.closed = threading.Event()
+        self._stopping = False
+        self._lock = threading.Lock()
+
+    def listen(self):
+        self.listener = _tcp_listener(self.bind_address, self.port, self.options.get('rcvbuf', SOCKET_BUFFER_SIZE),
+                                      backlog=self.max_sessions)
+        self.port = self.listener.getsockname()[1]
+        return self.port
+
+    def start(self, open_sink):
+        if self.listener is None:
+            self.listen()
+        self.open_sink = open_sink
+        self._arm()
+
+    def _arm(self):
+        with self._lock:
+            if self._stopping or self.waiting is not None:
+                return
+            if len(self.receivers) >= self.max_sessions:
+                logging.info('%d senders connected, not accepting more', len(self.receivers))
+                return
+            receiver = StreamReceiver(self.port, self.bind_address, on_closed=self._on_receiver_closed,
+                                      listener=self.listener, **self.options)
+            self.waiting = receiver
+        receiver.start(lambda header: self._open_session_sink(receiver, header))
+
+    def _open_session_sink(self, receiver, header):
+        with self._lock:
+            if self.waiting is receiver:
+                self.waiting = None
+            self.receivers.append(receiver)
+        self._arm()
+        if self.on_session:
+            self.on_session(receiver, header)
+        return self.open_sink(receiver, header)
+
+    def _on_receiver_closed(self, receiver, error):
+        with self._lock:
+            if self.waiting is receiver:
+                self.waiting = None
+            if receiver in self.receivers:
+                self.receivers.remove(receiver)
+            broken = error is not None and receiver.peer is None and not self._stopping
+        if receiver.header is not None and self.on_session_end:
+            self.on_session_end(receiver, error)
+        if broken:
+            # Nobody connected, so the listener itself failed
+            self.error = error
+            self.stop()
+        else:
+            self._arm()
+
+    @property
+    def sessions(self):
+        with self._lock:
+            return list(self.receivers)
+
+    def counters(self):
+        return sum_counters(receiver.counters() for receiver in self.sessions)
+
+    def stop(self):
+        with self._lock:
+            if self._stopping:
+                return
+            self._stopping = True
+            receivers = self.receivers + ([self.waiting] if self.waiting else [])
+        for receiver in receivers:
+            receiver.stop()
+        if self.listener:
+            try:
+                self.listener.shutdown(socket.SHUT_RDWR)  # Wakes up a pending accept()
+            except OSError:
+                pass
+            try:
+                self.listener.close()
+            except OSError:
+                pass
+        self.closed.set()
+        if self.on_closed:
+            self.on_closed(self, self.error)
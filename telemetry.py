@@ -0,0 +1,162 @@
+"""Stream health telemetry for Audio Receiver.
+
+:class:`Telemetry` polls a receiver's cumulative counters (see
+``StreamReceiver.counters``) once a second on its own thread and turns them
+into a sample: byte and packet rates, buffered audio, underruns, late,
+dropped and lost packets in the last interval, the time since the last
+packet and, where the receiver measures it, the sender's clock drift. Each
+sample is judged against fixed thresholds, which is what drives the
+receiver's health indicator instead of the status text, and appended to a
+rolling JSON-lines metrics log.
+"""
+import collections
+import json
+import logging
+import logging.handlers
+import threading
+import time
+from datetime import datetime
+
+SAMPLE_INTERVAL = 1.0
+HISTORY_SAMPLES = 300             # Five minutes kept in memory
+METRICS_LOG_BYTES = 1024 * 1024
+METRICS_LOG_BACKUPS = 3
+
+HEALTH_WAITING = 'waiting'        # Listening, no sender
+HEALTH_GOOD = 'good'
+HEALTH_DEGRADED = 'degraded'
+HEALTH_BAD = 'bad'
+
+SILENCE_DEGRADED_S = 0.5          # No packet for this long is audible as a gap
+SILENCE_BAD_S = 2.0
+LOSS_DEGRADED = 0.005             # Late, dropped or lost share of the packets in one interval
+LOSS_BAD = 0.05
+UNDERRUNS_BAD = 3                 # Per interval
+BUFFER_LOW_MS = 5                 # Anything less and the next hiccup is an underrun
+RECOVER_SAMPLES = 3               # Good samples in a row before the indicator goes back to green
+
+COUNTER_KEYS = ('bytes', 'packets', 'underruns', 'late', 'dropped', 'lost')
+
+
+def classify(sample):
+    """Return ``(health, reason)`` for one sample."""
+    if not sample['connected']:
+        return HEALTH_WAITING, 'No sender'
+    silence = sample['since_last_packet_s']
+    problems = sample['late'] + sample['dropped'] + sample['lost']
+    loss = problems / max(sample['packets'] + sample['lost'], 1)
+    if silence is not None and silence >= SILENCE_BAD_S:
+        return HEALTH_BAD, f'No packets for {silence:.1f} s'
+    if loss >= LOSS_BAD:
+        return HEALTH_BAD, f'{loss:.0%} packets late or lost'
+    if sample['underruns'] >= UNDERRUNS_BAD:
+        return HEALTH_BAD, f"{sample['underruns']} underruns"
+    if silence is not None and silence >= SILENCE_DEGRADED_S:
+        return HEALTH_DEGRADED, f'No packets for {silence:.1f} s'
+    if loss >= LOSS_DEGRADED:
+        return HEALTH_DEGRADED, f'{loss:.1%} packets late or lost'
+    if sample['underruns']:
+        return HEALTH_DEGRADED, f"{sample['underruns']} underrun{'s' if sample['underruns'] > 1 else ''}"
+    if sample['buffer_ms'] is not None and sample['buffer_ms'] < BUFFER_LOW_MS and sample['packets']:
+        return HEALTH_DEGRADED, 'Buffer running low'
+    return HEALTH_GOOD, ''
+
+
+def metrics_logger(path, max_bytes=METRICS_LOG_BYTES, backups=METRICS_LOG_BACKUPS):
+    """A logger writing bare JSON lines to ``path``, rotated by size, kept out of the app log."""
+    logger = logging.getLogger('audio_receiver.metrics')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    if not logger.handlers:
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+    return logger
+
+
+class Telemetry:
+    """Sample ``counters()`` every ``interval`` seconds off the UI thread.
+
+    ``on_sample(sample)`` is called from the sampling thread; the UI should
+    post it to its :class:`ui_bus.UiBus`. :attr:`latest` and :meth:`history`
+    can be read from any thread. The health in a sample gets worse as soon as
+    a threshold is crossed but only recovers after ``RECOVER_SAMPLES`` good
+    samples, so the indicator doesn't flicker on a marginal link.
+    """
+
+    def __init__(self, counters, interval=SAMPLE_INTERVAL, history=HISTORY_SAMPLES, logger=None, on_sample=None):
+        self.counters = counters
+        self.interval = interval
+        self.logger = logger
+        self.on_sample = on_sample
+        self.samples = collections.deque(maxlen=history)
+        self.latest = None
+        self._previous = None
+        self._previous_at = None
+        self._health = HEALTH_WAITING
+        self._good_streak = 0
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._run, name='telemetry', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def history(self):
+        with self._lock:
+            return list(self.samples)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                sample = self.sample()
+            except Exception as e:
+                logging.error('Telemetry sampling failed: %s', e)
+                continue
+            if self.logger:
+                self.logger.info(json.dumps(sample))
+            if self.on_sample:
+                self.on_sample(sample)
+
+    def sample(self):
+        """Take one sample now; normally called by the sampling thread."""
+        counters = self.counters()
+        now = time.monotonic()
+        previous = self._previous or counters
+        elapsed = now - self._previous_at if self._previous_at else self.interval
+        # A new session starts its counters over; count nothing for that interval
+        deltas = {key: max(counters[key] - previous[key], 0) for key in COUNTER_KEYS}
+        self._previous, self._previous_at = counters, now
+        sample = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'connected': counters['connected'],
+            'kbps': round(deltas['bytes'] * 8 / elapsed / 1000, 1),
+            'packets_per_s': round(deltas['packets'] / elapsed, 1),
+            'buffer_ms': counters['buffer_ms'],
+            'since_last_packet_s': counters['idle_s'],
+            'drift_ppm': counters.get('drift_ppm'),  # Only known with in-process playback
+            'packets': deltas['packets'],
+            'underruns': deltas['underruns'],
+            'late': deltas['late'],
+            'dropped': deltas['dropped'],
+            'lost': deltas['lost'],
+        }
+        health, reason = classify(sample)
+        sample['health'] = self._smooth(health)
+        sample['reason'] = reason if sample['health'] == health else 'Recovering'
+        with self._lock:
+            self.samples.append(sample)
+            self.latest = sample
+        return sample
+
+    def _smooth(self, health):
+        if health != HEALTH_GOOD or self._health in (HEALTH_WAITING, HEALTH_GOOD):
+            self._health = health
+            self._good_streak = 0
+            return health
+        self._good_streak += 1
+        if self._good_streak >= RECOVER_SAMPLES:
+            self._health = HEALTH_GOOD
+        return self._health
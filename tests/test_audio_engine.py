@@ -0,0 +1,28 @@
+"""Reconnect backoff of the sender session."""
+import audio_engine
+from audio_engine import RECONNECT_BASE_DELAY, RECONNECT_MAX_DELAY, reconnect_delay
+
+
+def test_the_delay_doubles_up_to_the_cap(monkeypatch):
+    # Without jitter: the upper end of each range, then the lower end
+    monkeypatch.setattr(audio_engine.random, 'uniform', lambda low, high: high)
+    longest = [reconnect_delay(attempt) for attempt in range(6)]
+    assert longest == [RECONNECT_BASE_DELAY * 2 ** attempt for attempt in range(4)] + [RECONNECT_MAX_DELAY] * 2
+    monkeypatch.setattr(audio_engine.random, 'uniform', lambda low, high: low)
+    assert [reconnect_delay(attempt) for attempt in range(6)] == [delay / 2 for delay in longest]
+
+
+def test_the_delay_is_jittered_within_its_bounds():
+    for attempt in (0, 2, 10):
+        ceiling = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** attempt)
+        delays = [reconnect_delay(attempt) for _ in range(500)]
+        assert all(ceiling / 2 <= delay <= ceiling for delay in delays)
+        # Spread over the range, so senders that lost the same receiver drift apart
+        assert len(set(delays)) > 400
+        assert max(delays) - min(delays) > ceiling * 0.4
+
+
+def test_a_receiver_gone_for_hours_keeps_the_cap():
+    # At 0.25 to 0.5 s a try, attempt 1100 comes after seven to nine minutes
+    for attempt in (1100, 100000):
+        assert RECONNECT_MAX_DELAY / 2 <= reconnect_delay(attempt) <= RECONNECT_MAX_DELAY
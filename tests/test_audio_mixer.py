@@ -0,0 +1,91 @@
+"""The mixer without numpy: the array fallback against a sample-by-sample reference, and gains per sender."""
+import array
+import math
+import random
+import sys
+
+from audio_mixer import FRAME_BYTES, MAX_GAIN, Mixer, MixerSource, _dbfs, _mix_array
+from stream_format import CHANNELS
+
+FRAMES = 480
+
+
+def pcm(samples):
+    data = array.array('h', samples)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data.tobytes()
+
+
+def block(frames, gain, amplitude=8000, seed=0):
+    rng = random.Random(seed)
+    return (MixerSource(f'source {seed}'), pcm(rng.randint(-amplitude, amplitude) for _ in range(frames * CHANNELS)),
+            frames, gain)
+
+
+def reference(blocks):
+    # The obvious loop, for blocks that need no stretching
+    mix = [0] * (FRAMES * CHANNELS)
+    for _, data, _, gain in blocks:
+        for i, value in enumerate(array.array('h', data)):
+            mix[i] += int(value * gain)
+    return pcm(max(-32768, min(32767, value)) for value in mix)
+
+
+def test_the_fallback_matches_the_reference():
+    blocks = [block(FRAMES, 1.0, seed=1), block(FRAMES, 0.5, seed=2), block(FRAMES, 1.5, seed=3)]
+    assert _mix_array(blocks, FRAMES) == reference(blocks)
+
+
+def test_the_sum_is_clipped():
+    loud = [block(FRAMES, 2.0, amplitude=32767, seed=seed) for seed in range(3)]
+    mixed = array.array('h', _mix_array(loud, FRAMES))
+    assert mixed.tobytes() == reference(loud)
+    assert max(mixed) == 32767 and min(mixed) == -32768
+
+
+def test_levels_are_measured_after_the_gain():
+    source, data, frames, _ = block(FRAMES, 0.5, seed=4)
+    _mix_array([(source, data, frames, 0.5)], FRAMES)
+    samples = [value * 0.5 for value in array.array('h', data)]
+    rms = math.sqrt(sum(value * value for value in samples) / len(samples))
+    assert abs(source.level_db - _dbfs(rms / 32768)) < 1e-9
+    assert abs(source.peak_db - _dbfs(max(map(abs, samples)) / 32768)) < 1e-9
+
+
+def test_muted_sources_and_no_sources_give_silence():
+    silence = bytes(FRAMES * FRAME_BYTES)
+    assert _mix_array([], FRAMES) == silence
+    muted = block(FRAMES, 0.0, seed=5)
+    assert _mix_array([muted], FRAMES) == silence
+    assert muted[0].level_db == _dbfs(0)
+
+
+def test_a_resampled_block_fills_the_output_block():
+    for taken in (FRAMES - 2, FRAMES + 3):
+        assert len(_mix_array([block(taken, 1.0, seed=taken)], FRAMES)) == FRAMES * FRAME_BYTES
+
+
+def test_gains_are_remembered_by_sender():
+    mixer = Mixer(output=None)
+    first = mixer.add_source('192.168.1.20')
+    second = mixer.add_source('192.168.1.20')
+    assert (first.name, second.name) == ('192.168.1.20', '192.168.1.20 (2)')
+    assert first.sender == second.sender == '192.168.1.20'
+
+    # The slider of the second connection
+    mixer.set_gain('192.168.1.20 (2)', 0.25)
+    assert (first.gain, second.gain) == (1.0, 0.25)
+    assert mixer.gains == {'192.168.1.20': 0.25}
+
+    # The sender reconnects: a new source, whatever name it ends up with, gets the gain back
+    mixer.sources.remove(second)
+    assert mixer.add_source('192.168.1.20').gain == 0.25
+    assert mixer.add_source('192.168.1.21').gain == 1.0
+
+
+def test_the_gain_of_a_sender_not_connected_is_kept_for_later():
+    mixer = Mixer(output=None)
+    mixer.set_gain('192.168.1.30', 5.0)
+    assert mixer.gains == {'192.168.1.30': MAX_GAIN}
+    assert mixer.add_source('192.168.1.30').gain == MAX_GAIN
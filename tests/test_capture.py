@@ -0,0 +1,142 @@
+"""RingBuffer, and CaptureStream fed by the synthetic and file backends, without a sound card."""
+import array
+import sys
+import threading
+import time
+import wave
+
+from capture import CaptureStream, FileBackend, RingBuffer, SyntheticBackend, feed_encoder
+
+RATE = 48000
+CHANNELS = 2
+FRAME_BYTES = CHANNELS * 2
+
+
+def frames(first, count):
+    # Every frame carries its own index, so order and gaps show in what is read back
+    samples = array.array('h')
+    for index in range(first, first + count):
+        samples.extend([index % 32768] * CHANNELS)
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    return samples.tobytes()
+
+
+def indices(data):
+    samples = array.array('h', data)
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    return list(samples[::CHANNELS])
+
+
+def test_reads_and_writes_wrap_around_the_end():
+    ring = RingBuffer(10 * FRAME_BYTES, FRAME_BYTES)
+    written = 0
+    read = []
+    for count in (7, 6, 9, 3, 8, 10):
+        assert ring.write(frames(written, count)) == count * FRAME_BYTES
+        written += count
+        # Leave some behind, so the next write starts somewhere else in the ring
+        read += indices(ring.read((count - 1) * FRAME_BYTES))
+        read += indices(ring.read(FRAME_BYTES))
+    assert read == list(range(written))
+    assert ring.fill() == 0 and ring.write_pos == written * FRAME_BYTES
+    assert ring.overruns == 0 and ring.max_fill <= ring.capacity
+
+
+def test_a_full_ring_drops_the_newest_audio_and_counts_it():
+    ring = RingBuffer(10 * FRAME_BYTES, FRAME_BYTES)
+    assert ring.write(frames(0, 8)) == 8 * FRAME_BYTES
+    assert ring.write(frames(8, 5)) == 2 * FRAME_BYTES  # Only two fit
+    assert ring.write(frames(13, 1)) == 0
+    assert ring.overruns == 2
+    assert ring.dropped_bytes == 4 * FRAME_BYTES
+    # What was buffered is kept as it was, the oldest audio is not overwritten
+    assert indices(ring.read(ring.capacity)) == list(range(10))
+    assert ring.write(frames(14, 3)) == 3 * FRAME_BYTES
+    assert indices(ring.read(ring.capacity)) == [14, 15, 16]
+
+
+def test_only_whole_frames_go_in_and_come_out():
+    ring = RingBuffer(10 * FRAME_BYTES + 3, FRAME_BYTES)
+    assert ring.capacity == 10 * FRAME_BYTES
+    assert ring.write(frames(0, 3) + b'\x01\x02') == 3 * FRAME_BYTES  # The partial frame is left out
+    assert ring.read(FRAME_BYTES + 2) == frames(0, 1)
+    assert ring.read(FRAME_BYTES - 1) == b''
+    assert ring.discard(FRAME_BYTES + 3) == FRAME_BYTES
+    assert indices(ring.read(100)) == [2]
+    assert ring.fill() == 0
+
+
+def test_a_reader_waits_for_the_writer():
+    ring = RingBuffer(10 * FRAME_BYTES, FRAME_BYTES)
+    assert not ring.wait(0.01)
+    threading.Timer(0.05, ring.write, (frames(0, 1),)).start()
+    assert ring.wait(2)
+    assert indices(ring.read(FRAME_BYTES)) == [0]
+
+
+def test_synthetic_capture_end_to_end():
+    capture = CaptureStream(SyntheticBackend(frequency=1000, amplitude=0.5), RATE, CHANNELS,
+                            period_ms=5, buffer_ms=50).start()
+    started = time.monotonic()
+    received = bytearray()
+    while time.monotonic() - started < 0.3:
+        received += capture.read(1024)
+    capture.close()
+    received += capture.read()  # What was left, then b'' for the end
+    assert capture.read() == b''
+
+    assert len(received) % FRAME_BYTES == 0
+    # Paced like a sound card: about as much audio as time went by, in whole periods
+    seconds = len(received) / FRAME_BYTES / RATE
+    assert 0.2 < seconds < 0.4
+    assert capture.frames_captured % capture.period_frames == 0
+    samples = array.array('h', bytes(received))
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    assert samples[0::2] == samples[1::2]  # The same tone on both channels
+    assert max(samples) == int(32767 * 0.5)  # 48 samples a cycle, so the peak itself is one of them
+    stats = capture.stats()
+    assert stats['period_ms'] == 5 and stats['buffer_ms'] == 50
+    assert stats['overruns'] == 0 and stats['dropped_ms'] == 0
+
+
+def test_a_stalled_consumer_overruns_the_capture_ring():
+    capture = CaptureStream(SyntheticBackend(), RATE, CHANNELS, period_ms=5, buffer_ms=20).start()
+    time.sleep(0.2)  # Nobody reads: the 20 ms ring fills in four periods
+    stats = capture.stats()
+    capture.close()
+    assert stats['overruns'] > 0
+    assert stats['max_fill_ms'] == 20.0
+    assert 100 < stats['dropped_ms'] + stats['fill_ms'] < 260
+
+
+def test_a_file_without_loop_ends_the_capture(tmp_path):
+    path = tmp_path / 'tone.wav'
+    with wave.open(str(path), 'wb') as wav:
+        wav.setnchannels(CHANNELS)
+        wav.setsampwidth(2)
+        wav.setframerate(RATE)
+        wav.writeframes(frames(0, 1000))
+
+    class Pipe:
+        def __init__(self):
+            self.data = bytearray()
+            self.closed = threading.Event()
+
+        def write(self, data):
+            self.data += data
+
+        def flush(self):
+            pass
+
+        def close(self):
+            self.closed.set()
+
+    pipe = Pipe()
+    capture = CaptureStream(FileBackend(str(path), loop=False), RATE, CHANNELS, period_ms=2).start()
+    feed_encoder(capture, pipe)
+    assert pipe.closed.wait(2)
+    assert indices(pipe.data) == list(range(1000))
+    assert capture.eof.is_set()
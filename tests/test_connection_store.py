@@ -0,0 +1,78 @@
+"""ConnectionStore: order, eviction, the legacy import and what happens to a damaged file."""
+import json
+import os
+
+from connection_store import ConnectionStore
+
+
+def ips(store):
+    return [entry['ip'] for entry in store.entries()]
+
+
+def test_entries_come_back_most_recent_first(tmp_path):
+    path = str(tmp_path / 'connections.json')
+    store = ConnectionStore(path).load()
+    store.remember('10.0.0.1', 'Kitchen')
+    store.remember('10.0.0.2', 'Office')
+    store.remember('10.0.0.3', 'Garage')
+    store.remember('10.0.0.1', 'Kitchen speaker')  # Used again, so first, under its new name
+    store.record_connection('10.0.0.2', 'opus', 'udp', rtt_ms=12.345)
+
+    reopened = ConnectionStore(path).load()
+    assert ips(reopened) == ['10.0.0.1', '10.0.0.3', '10.0.0.2']
+    assert reopened.get('10.0.0.1')['name'] == 'Kitchen speaker'
+    office = reopened.get('10.0.0.2')
+    assert (office['connections'], office['rtt_ms']) == (1, 12.3)
+    assert reopened.preferred_settings('10.0.0.2') == ('opus', 'udp')
+    assert reopened.preferred_settings('10.0.0.3') is None
+    assert [name for name in os.listdir(tmp_path) if name.endswith('.tmp')] == []
+
+
+def test_the_least_recently_used_entry_is_dropped(tmp_path):
+    path = str(tmp_path / 'connections.json')
+    store = ConnectionStore(path, max_entries=3).load()
+    for i in range(1, 5):
+        store.remember(f'10.0.0.{i}', f'Receiver {i}')
+    assert ips(store) == ['10.0.0.4', '10.0.0.3', '10.0.0.2']
+    store.remember('10.0.0.2', 'Receiver 2')
+    store.remember('10.0.0.5', 'Receiver 5')
+    assert ips(store) == ['10.0.0.5', '10.0.0.2', '10.0.0.4']
+    assert ips(ConnectionStore(path, max_entries=3).load()) == ips(store)
+
+
+def test_a_damaged_file_is_set_aside(tmp_path):
+    path = str(tmp_path / 'connections.json')
+    with open(path, 'w') as file:
+        file.write('{"version": 1, "connections": [{"ip": ')
+    store = ConnectionStore(path).load()
+    assert store.entries() == []
+    assert not os.path.exists(path)
+    with open(path + '.corrupt') as file:
+        assert file.read().startswith('{"version": 1')
+
+    store.remember('10.0.0.1', 'Kitchen')
+    assert ips(ConnectionStore(path).load()) == ['10.0.0.1']
+
+
+def test_ip_history_is_imported_in_its_order(tmp_path):
+    path = str(tmp_path / 'connections.json')
+    legacy = str(tmp_path / 'ip_history.json')
+    with open(legacy, 'w') as file:
+        json.dump([['10.0.0.3', 'Newest'], ['10.0.0.2', 'Older'], ['10.0.0.1', 'Oldest']], file)
+
+    store = ConnectionStore(path, legacy_path=legacy).load()
+    assert [(entry['ip'], entry['name']) for entry in store.entries()] == [
+        ('10.0.0.3', 'Newest'), ('10.0.0.2', 'Older'), ('10.0.0.1', 'Oldest')]
+    # Saved right away, so the import happens once
+    os.remove(legacy)
+    assert ips(ConnectionStore(path, legacy_path=legacy).load()) == ['10.0.0.3', '10.0.0.2', '10.0.0.1']
+
+
+def test_connections_to_unsaved_receivers_are_not_remembered(tmp_path):
+    path = str(tmp_path / 'connections.json')
+    store = ConnectionStore(path).load()
+    store.remember('10.0.0.1', 'Kitchen')
+    store.record_connection('10.0.0.9', 'mp3', 'tcp', rtt_ms=3.0)
+    store.record_rtt('10.0.0.9', 3.0)
+    assert store.get('10.0.0.9') is None
+    assert ips(ConnectionStore(path).load()) == ['10.0.0.1']
@@ -0,0 +1,112 @@
+"""DeviceWatcher driven by FakeBackend, and the consumers that filter and debounce its events."""
+import threading
+import time
+
+import preflight
+from device_watcher import (EVENT_ADDED, EVENT_DEFAULT_CHANGED, EVENT_REMOVED, EVENT_STATE_CHANGED, DeviceEvent,
+                            DeviceWatcher, FakeBackend)
+from preflight import PreflightCache
+from volume_worker import MockEndpoint, VolumeWorker
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_events_reach_the_handler_in_order():
+    events = []
+    backend = FakeBackend()
+    watcher = DeviceWatcher(events.append, backend)
+    backend.fire(EVENT_ADDED, 'before-start')
+    watcher.start()
+    backend.fire(EVENT_ADDED, 'usb')
+    backend.fire(EVENT_DEFAULT_CHANGED, 'usb')
+    backend.fire(EVENT_REMOVED, 'hdmi')
+    assert events == [DeviceEvent(EVENT_ADDED, 'usb'), DeviceEvent(EVENT_DEFAULT_CHANGED, 'usb'),
+                      DeviceEvent(EVENT_REMOVED, 'hdmi')]
+
+    watcher.stop()
+    backend.fire(EVENT_ADDED, 'after-stop')
+    assert len(events) == 3
+
+
+def test_a_failing_handler_does_not_reach_the_backend():
+    calls = []
+
+    def handler(event):
+        calls.append(event)
+        raise RuntimeError('handler bug')
+
+    backend = FakeBackend()
+    DeviceWatcher(handler, backend).start()
+    backend.fire(EVENT_STATE_CHANGED, 'usb')
+    backend.fire(EVENT_STATE_CHANGED, 'usb')
+    assert len(calls) == 2
+
+
+def test_preflight_ignores_its_own_device_and_rechecks_once_per_burst(monkeypatch):
+    checks = []
+    state = {'capture_present': True, 'playback_default': True, 'playback_volume_ok': True, 'playback_id': 'cable'}
+    monkeypatch.setattr(preflight, 'query_audio_state', lambda *args: checks.append(args) or dict(state))
+    monkeypatch.setattr(preflight, 'RECHECK_DELAY', 0.1)
+    cache = PreflightCache()
+    assert cache.playback_ready() and len(checks) == 1
+    backend = FakeBackend()
+    DeviceWatcher(cache.invalidate, backend).start()
+
+    # The cable becoming the default is what run_setplayback just did, the cached answer stands
+    backend.fire(EVENT_DEFAULT_CHANGED, 'cable')
+    assert cache.state is not None
+
+    # Plugging in a headset fires one event per role and state; they make one recheck
+    for kind in (EVENT_ADDED, EVENT_STATE_CHANGED, EVENT_DEFAULT_CHANGED, EVENT_DEFAULT_CHANGED):
+        backend.fire(kind, 'headset')
+    assert cache.state is None
+    assert wait_until(lambda: cache.state is not None)
+    time.sleep(0.2)
+    assert len(checks) == 2
+    cache.stop()
+
+
+def test_a_burst_of_events_rebinds_the_speakers_once():
+    # The receiver only rebinds for default changes and for the device it is bound to
+    opened = []
+    states = []
+    bound = threading.Event()
+
+    def open_endpoint():
+        opened.append(time.monotonic())
+        return MockEndpoint()
+
+    def on_state(state):
+        states.append(state)
+        bound.set()
+
+    worker = VolumeWorker(open_endpoint, on_state, min_interval=0.2, com=False).start()
+    assert bound.wait(2)
+    speakers = 'speakers'
+
+    def on_change(event):
+        if event.kind != EVENT_DEFAULT_CHANGED and event.device_id != speakers:
+            return
+        worker.rebind()
+
+    backend = FakeBackend()
+    DeviceWatcher(on_change, backend).start()
+    backend.fire(EVENT_ADDED, 'usb')             # Someone else's device: filtered out
+    backend.fire(EVENT_STATE_CHANGED, 'usb')
+    time.sleep(0.3)
+    assert len(opened) == 1
+
+    for kind in (EVENT_DEFAULT_CHANGED, EVENT_DEFAULT_CHANGED, EVENT_STATE_CHANGED, EVENT_REMOVED):
+        backend.fire(kind, speakers)
+    assert wait_until(lambda: len(opened) == 2)
+    time.sleep(0.3)
+    worker.stop(timeout=1)
+    assert len(opened) == 2
+    assert states[-1]['rebound']
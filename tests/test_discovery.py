@@ -0,0 +1,77 @@
+"""Beacons on loopback, a port each, found and ranked by ReceiverDiscovery."""
+import time
+
+from discovery import Beacon, ReceiverDiscovery, rank
+
+
+def slow_load(delay_s, senders=0):
+    # load() runs before every answer, so sleeping in it adds to the measured round trip
+    def load():
+        time.sleep(delay_s)
+        return {'state': 'receiving' if senders else 'idle', 'senders': senders}
+    return load
+
+
+def start_beacons(specs):
+    return [Beacon(name, 5000 + i, ['mp3', 'opus20'], 'udp', load=slow_load(delay_s, senders),
+                   port=0, host='127.0.0.1').start()
+            for i, (name, delay_s, senders) in enumerate(specs)]
+
+
+def discover(beacons, **kwargs):
+    found, done = [], []
+    discovery = ReceiverDiscovery(found.append, done.append,
+                                  targets=[('127.0.0.1', beacon.port) for beacon in beacons],
+                                  interval=0.05, timeout=0.5, **kwargs).start()
+    assert discovery.done.wait(5)
+    discovery.thread.join(5)
+    return discovery, found, done
+
+
+def test_every_beacon_is_found_and_ranked_by_round_trip():
+    specs = [('slow', 0.08, 0), ('busy', 0.0, 1), ('fast', 0.0, 0), ('medium', 0.04, 0)]
+    beacons = start_beacons(specs)
+    try:
+        discovery, found, done = discover(beacons)
+    finally:
+        for beacon in beacons:
+            beacon.stop()
+
+    receivers = discovery.results()
+    assert sorted(receiver['name'] for receiver in receivers) == sorted(name for name, _, _ in specs)
+    assert [receiver['name'] for receiver in receivers] == ['fast', 'medium', 'slow', 'busy']
+    assert done == [receivers]
+    assert {receiver['name'] for receiver in found} == {name for name, _, _ in specs}
+
+    by_name = {receiver['name']: receiver for receiver in receivers}
+    for (name, delay_s, _), beacon in zip(specs, beacons):
+        receiver = by_name[name]
+        assert receiver['ip'] == '127.0.0.1'
+        assert receiver['port'] == beacon.stream_port
+        assert receiver['codecs'] == ['mp3', 'opus20'] and receiver['transport'] == 'udp'
+        assert receiver['rtt_ms'] >= delay_s * 1000
+        # Every round is answered; only the fastest answer is kept
+        assert beacon.answered == discovery.rounds
+    assert by_name['fast']['rtt_ms'] < by_name['medium']['rtt_ms'] < by_name['slow']['rtt_ms']
+    assert by_name['busy']['load'] == {'state': 'receiving', 'senders': 1}
+
+
+def test_a_silent_target_only_costs_the_timeout():
+    beacons = start_beacons([('only', 0.0, 0)])
+    silent = Beacon('silent', 5100, ['mp3'], 'udp', port=0, host='127.0.0.1').start()
+    silent.stop()  # Its port is now closed
+    try:
+        started = time.monotonic()
+        discovery, _, _ = discover(beacons + [silent], rounds=2)
+        elapsed = time.monotonic() - started
+    finally:
+        beacons[0].stop()
+    assert [receiver['name'] for receiver in discovery.results()] == ['only']
+    assert elapsed < 0.05 * 2 + 0.5 + 0.5
+
+
+def test_rank_puts_unmeasured_receivers_last_among_their_load():
+    receivers = [{'name': 'a', 'load': {}, 'rtt_ms': None},
+                 {'name': 'b', 'load': {'senders': 2}, 'rtt_ms': 1.0},
+                 {'name': 'c', 'load': {'senders': 0}, 'rtt_ms': 9.0}]
+    assert [receiver['name'] for receiver in rank(receivers)] == ['c', 'a', 'b']
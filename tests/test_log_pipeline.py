@@ -0,0 +1,95 @@
+"""RateLimitFilter on a fake clock, and parse_ffmpeg_line on lines ffmpeg really prints."""
+import logging
+
+from log_pipeline import (FFMPEG_IO_ERROR, FFMPEG_MESSAGE, FFMPEG_PROGRESS, FFMPEG_RECONNECT, FFMPEG_TIMESTAMP,
+                          FFMPEG_XRUN, RateLimitFilter, parse_ffmpeg_line)
+
+OVERRUN = ("[dshow @ 000001f8a2b3c4d0] real-time buffer [Stereo Mix (Realtek(R) Audio)] [audio input] too full "
+           "or near too full (%d%% of size: 3041280 [rtbufsize parameter])! frame dropped!")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def record(msg, *args, level=logging.WARNING):
+    return logging.LogRecord('ffmpeg', level, __file__, 1, msg, args, None)
+
+
+def test_a_burst_of_copies_is_limited_per_window():
+    clock = Clock()
+    limit = RateLimitFilter(window=10.0, burst=3, clock=clock)
+    # Only the percentage differs, so these are copies of one message
+    passed = [limit.filter(record(OVERRUN, percent)) for percent in range(100, 108)]
+    assert passed == [True] * 3 + [False] * 5
+    assert limit.suppressed == 5
+
+    # Another message, or the same one at another level, has its own count
+    assert limit.filter(record("Broken pipe"))
+    assert limit.filter(record(OVERRUN, 100, level=logging.ERROR))
+
+    clock.now += 9.9
+    assert not limit.filter(record(OVERRUN, 110))
+    clock.now += 0.1
+    first = record(OVERRUN, 111)
+    assert limit.filter(first)
+    assert first.getMessage() == OVERRUN % 111 + " (6 more like it not logged)"
+    second = record(OVERRUN, 112)
+    assert limit.filter(second)
+    assert second.getMessage() == OVERRUN % 112  # Said once, not on every copy
+
+
+def test_a_window_with_nothing_held_back_says_nothing():
+    clock = Clock()
+    limit = RateLimitFilter(window=10.0, burst=3, clock=clock)
+    assert limit.filter(record("Will reconnect in %d s", 1))
+    clock.now += 10
+    again = record("Will reconnect in %d s", 2)
+    assert limit.filter(again)
+    assert again.getMessage() == "Will reconnect in 2 s"
+    assert limit.suppressed == 0
+
+
+def test_progress_lines():
+    kind, fields = parse_ffmpeg_line("size=     256kB time=00:00:16.32 bitrate= 128.5kbits/s speed=1.00x    \r")
+    assert kind == FFMPEG_PROGRESS
+    assert (fields['size_kb'], fields['position_s'], fields['bitrate_kbps'], fields['speed']) == (256, 16.32, 128.5, 1.0)
+
+    # Newer ffmpeg says KiB and pads the speed
+    kind, fields = parse_ffmpeg_line("size=    1024KiB time=01:02:03.50 bitrate= 135.2kbits/s speed=   1x")
+    assert (fields['size_kb'], fields['position_s'], fields['speed']) == (1024, 3723.5, 1.0)
+
+    # Writing to a pipe or socket there is no size, and before the first packet no time either
+    kind, fields = parse_ffmpeg_line("size=N/A time=00:00:05.00 bitrate=N/A speed=1.01x")
+    assert kind == FFMPEG_PROGRESS
+    assert (fields['size_kb'], fields['position_s'], fields['bitrate_kbps'], fields['speed']) == (None, 5.0, None, 1.01)
+    kind, fields = parse_ffmpeg_line("size=       0kB time=N/A bitrate=N/A speed=N/A")
+    assert kind == FFMPEG_PROGRESS
+    assert (fields['size_kb'], fields['position_s'], fields['bitrate_kbps'], fields['speed']) == (0, None, None, None)
+
+
+def test_overrun_reconnect_and_error_lines():
+    kind, fields = parse_ffmpeg_line(OVERRUN % 101)
+    assert (kind, fields['source']) == (FFMPEG_XRUN, 'dshow')
+
+    kind, fields = parse_ffmpeg_line("[tcp @ 0x55d5c1a2b3c0] Will reconnect at 0 in 1 second(s), "
+                                     "error=Connection refused.")
+    assert (kind, fields['source']) == (FFMPEG_RECONNECT, 'tcp')
+
+    kind, fields = parse_ffmpeg_line("av_interleaved_write_frame(): Broken pipe")
+    assert kind == FFMPEG_IO_ERROR and 'source' not in fields
+    kind, _ = parse_ffmpeg_line("[tcp @ 0x7f3c2c0012c0] Connection to tcp://192.168.1.20:5000 failed: "
+                                "Connection refused")
+    assert kind == FFMPEG_IO_ERROR
+
+    kind, fields = parse_ffmpeg_line("[mp3 @ 0x5581e0d2c700] Application provided invalid, non monotonically "
+                                     "increasing dts to muxer in stream 0: 1234 >= 1200")
+    assert (kind, fields['source']) == (FFMPEG_TIMESTAMP, 'mp3')
+
+    kind, fields = parse_ffmpeg_line("Stream mapping:")
+    assert kind == FFMPEG_MESSAGE and fields == {'text': "Stream mapping:"}
+    assert parse_ffmpeg_line("   \r") is None
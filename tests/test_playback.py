@@ -0,0 +1,141 @@
+"""PlaybackEngine headless: render driven by hand, and a WavSink playing in real time."""
+import array
+import sys
+import time
+import wave
+
+from playback import NullSink, PlaybackEngine, WavSink
+
+RATE = 48000
+CHANNELS = 2
+
+
+def engine():
+    # render() is called directly, the sink is never started
+    return PlaybackEngine(NullSink(), sample_rate=RATE, channels=CHANNELS, block_ms=10, target_ms=40)
+
+
+def pcm(frames):
+    return b'\x01\x00' * CHANNELS * frames
+
+
+def numbered(first, count):
+    # Frame n carries n on both channels, so what was dropped shows in what is played
+    samples = array.array('h')
+    for index in range(first, first + count):
+        samples.extend([index] * CHANNELS)
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    return samples.tobytes()
+
+
+def numbers(data):
+    samples = array.array('h', data)
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    return list(samples[::CHANNELS])
+
+
+def test_only_frames_from_the_ring_count_as_played():
+    playback = engine()
+    block = playback.block_frames
+    assert playback.render(block) == bytes(block * playback.frame_bytes)  # Still filling
+    assert playback.frames_played == 0
+
+    playback.write(pcm(playback.target_frames + block // 2))
+    for _ in range(4):
+        playback.render(block)
+    assert playback.frames_played == 4 * block
+    assert playback.underruns == 0
+
+    # Half a block left: that half is played, the silence after it is not
+    data = playback.render(block)
+    assert len(data) == block * playback.frame_bytes
+    assert playback.underruns == 1
+    assert playback.frames_played == 4 * block + block // 2
+    playback.render(block)
+    assert playback.frames_played == 4 * block + block // 2
+
+
+def test_a_new_session_resets_the_drift_estimate():
+    playback = engine()
+    block = playback.block_frames
+    playback.write(pcm(playback.target_frames))
+    # The sender runs 1000 ppm fast for long enough to be measured
+    for i in range(1500):
+        playback.write(pcm(block + (1 if i % 100 < 48 else 0)))
+        playback.render(block)
+    assert playback.drift.ratio is not None
+
+    # The next sender reuses the running input, so input() is not called again
+    playback.new_session()
+    assert playback.drift.ratio is not None  # Only render() touches the estimator
+    playback.render(block)
+    assert playback.drift.ratio is None
+    assert playback.drift.ppm() is None
+
+
+def test_a_burst_above_target_and_trim_is_dropped_back_to_the_target():
+    playback = engine()
+    block = playback.block_frames
+    assert playback.max_frames == playback.target_frames + RATE * 80 // 1000  # The default trim_ms
+    playback.write(numbered(1, playback.target_frames))
+    playback.render(block)
+    assert playback.trims == 0
+
+    # A stalled connection delivers 200 ms at once
+    burst = RATE * 200 // 1000
+    first = 1 + playback.target_frames
+    playback.write(numbered(first, burst))
+    buffered = playback.target_frames - block + burst
+    assert buffered > playback.max_frames
+    played = numbers(playback.render(block))
+
+    assert playback.trims == 1
+    assert playback.frames_trimmed == buffered - playback.target_frames
+    # The oldest audio went, playing continues from the newest target_ms
+    assert played[0] == first + burst - playback.target_frames
+    assert playback.ring.fill() // playback.frame_bytes == playback.target_frames - len(set(played))
+    # Within the target, nothing more is dropped
+    playback.write(numbered(first + burst, block))
+    playback.render(block)
+    assert playback.trims == 1
+
+
+def test_the_ring_bounds_what_is_buffered():
+    playback = engine()
+    capacity = playback.ring.capacity // playback.frame_bytes
+    assert capacity == RATE * 500 // 1000  # PLAYBACK_RING_MS
+    for _ in range(20):
+        playback.write(pcm(RATE // 10))  # Two seconds, nobody playing
+    assert playback.ring.fill() // playback.frame_bytes == capacity
+    assert playback.frames_received == capacity
+    assert playback.ring.overruns == 15
+    playback.render(playback.block_frames)
+    assert playback.ring.fill() // playback.frame_bytes <= playback.target_frames
+
+
+def test_a_wav_sink_records_what_was_played(tmp_path):
+    path = str(tmp_path / 'played.wav')
+    playback = PlaybackEngine(WavSink(path), sample_rate=RATE, channels=CHANNELS, block_ms=10, target_ms=40).start()
+    chunk = RATE // 100
+    sent = 40
+    started = time.monotonic()
+    for index in range(sent):
+        # A sender in real time, 10 ms at a time
+        playback.write(numbered(1 + index * chunk, chunk))
+        time.sleep(max(0.0, started + (index + 1) * 0.01 - time.monotonic()))
+    time.sleep(0.1)  # Play out the target and run into the underrun
+    playback.stop()
+
+    with wave.open(path, 'rb') as wav:
+        assert (wav.getframerate(), wav.getnchannels(), wav.getsampwidth()) == (RATE, CHANNELS, 2)
+        recorded = numbers(wav.readframes(wav.getnframes()))
+    assert len(recorded) == playback.sink.blocks * playback.block_frames
+    audio = [number for number in recorded if number]
+    # Silence only while priming and after the end; every frame that played is in the file, in order
+    assert len(audio) == playback.frames_played
+    assert audio == sorted(audio)
+    assert audio[-1] == sent * chunk
+    assert playback.trims == 0
+    assert len(set(audio)) > 0.99 * sent * chunk
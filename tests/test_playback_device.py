@@ -0,0 +1,71 @@
+"""set_default_playback and its SetPlayBack.exe fallback against FakeBackend."""
+import pytest
+
+import playback_device
+from playback_device import ROLES, FakeBackend, set_default_playback, set_default_playback_with_fallback
+from preflight import VB_CABLE_PLAYBACK
+
+CABLE_ID = '{0.0.0.00000000}.{cable}'
+
+
+def cable_backend():
+    return FakeBackend({VB_CABLE_PLAYBACK: CABLE_ID, 'Speakers (Realtek)': '{0.0.0.00000000}.{realtek}'})
+
+
+class Fallback:
+    """Stands in for running SetPlayBack.exe."""
+
+    def __init__(self, result=True):
+        self.result = result
+        self.runs = 0
+
+    def __call__(self):
+        self.runs += 1
+        return self.result
+
+
+def test_sets_every_role_and_full_volume_unmuted():
+    backend = cable_backend()
+    assert set_default_playback(backend=backend) == CABLE_ID
+    assert backend.default == {role: CABLE_ID for role in ROLES}
+    assert backend.volume == {CABLE_ID: (1.0, False)}
+
+
+def test_unknown_device_raises_lookup_error():
+    backend = cable_backend()
+    with pytest.raises(LookupError):
+        set_default_playback('CABLE-A Input (VB-Audio Cable A)', backend)
+    assert backend.default == {} and backend.volume == {}
+
+
+def test_no_native_backend_raises_lookup_error(monkeypatch):
+    monkeypatch.setattr(playback_device, 'default_backend', lambda: None)
+    with pytest.raises(LookupError):
+        set_default_playback()
+
+
+def test_native_success_skips_the_fallback():
+    fallback = Fallback()
+    assert set_default_playback_with_fallback(fallback, backend=cable_backend()) == (True, CABLE_ID)
+    assert fallback.runs == 0
+
+
+def test_unknown_device_falls_back_to_setplayback():
+    fallback = Fallback()
+    assert set_default_playback_with_fallback(fallback, backend=FakeBackend()) == (True, None)
+    assert fallback.runs == 1
+
+
+def test_native_failure_falls_back_to_setplayback():
+    backend = cable_backend()
+    backend.fail = OSError('-2147024891 access denied')
+    fallback = Fallback()
+    assert set_default_playback_with_fallback(fallback, backend=backend) == (True, None)
+    assert fallback.runs == 1
+    assert backend.default == {}
+
+
+def test_failing_fallback_is_reported():
+    backend = cable_backend()
+    backend.fail = OSError('policy config refused')
+    assert set_default_playback_with_fallback(Fallback(result=False), backend=backend) == (False, None)
@@ -0,0 +1,50 @@
+"""ProcessSupervisor stopping real children: gracefully where they let it, killed where they don't."""
+import subprocess
+import sys
+import time
+
+import pytest
+
+from process_supervisor import ProcessSupervisor
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason="POSIX process groups and signals")
+
+
+def test_stop_all_kills_only_what_ignores_the_graceful_stop():
+    supervisor = ProcessSupervisor()
+    stubborn = supervisor.spawn(['sh', '-c', 'trap "" TERM; sleep 30'], 'stubborn')
+    reader = supervisor.spawn(['cat'], 'reader', stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+    unrelated = subprocess.Popen(['sleep', '30'])
+    try:
+        time.sleep(0.2)  # Let sh install its trap before it is signalled
+        assert {label for _, label in supervisor.children()} == {'stubborn', 'reader'}
+
+        report = supervisor.stop_all(timeout=0.5, kill_timeout=1.0)
+        assert report['stopped'] == 2
+        assert report['killed'] == 1  # cat ends on closed stdin, sh and sleep ignore SIGTERM
+        assert report['elapsed_s'] < 0.5 + 1.0
+        assert reader.returncode == 0
+        assert stubborn.returncode == -9
+        assert supervisor.children() == []
+        assert unrelated.poll() is None
+    finally:
+        unrelated.kill()
+        unrelated.wait()
+
+
+def test_stop_returns_the_exit_code_of_a_graceful_stop():
+    supervisor = ProcessSupervisor()
+    sleeper = supervisor.spawn(['sleep', '30'], 'sleeper')
+    started = time.perf_counter()
+    assert supervisor.stop(sleeper, timeout=2.0) == -15
+    assert time.perf_counter() - started < 1.0
+    assert supervisor.killed == 0
+    assert supervisor.stop(None) is None
+
+
+def test_children_that_exited_on_their_own_are_forgotten():
+    supervisor = ProcessSupervisor()
+    supervisor.spawn(['true'], 'quick').wait()
+    assert supervisor.children() == []
+    report = supervisor.stop_all()
+    assert (report['stopped'], report['killed']) == (0, 0)
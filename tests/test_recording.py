@@ -0,0 +1,130 @@
+"""RecordingStore: seeking through the time index, retention and recovery after a crash."""
+import json
+import os
+from datetime import datetime
+
+from recording import RecordingStore
+
+BASE = datetime(2026, 1, 5, 12, 0, 0).timestamp()
+DAY = 86400
+
+
+def add_segment(store, start, end, size=1000, codec='mp3', session='a'):
+    name = 'seg_' + datetime.fromtimestamp(BASE + start).strftime('%Y%m%d_%H%M%S') + '.mp3'
+    with open(os.path.join(store.directory, name), 'wb') as file:
+        file.write(b'\0' * size)
+    store.add({'file': name, 'start': BASE + start, 'end': BASE + end, 'bytes': size, 'codec': codec,
+               'session': session})
+    return name
+
+
+def index_lines(store):
+    with open(store.index_path) as file:
+        return [json.loads(line) for line in file]
+
+
+def unlimited(directory):
+    # No retention, so adding segments with old times keeps them
+    return RecordingStore(str(directory), max_age_days=0, max_bytes=0)
+
+
+def test_locate_before_inside_between_and_after_segments(tmp_path):
+    store = unlimited(tmp_path)
+    add_segment(store, 0, 300)
+    add_segment(store, 300, 600)
+    add_segment(store, 1000, 1300)  # After a pause
+
+    assert store.locate(BASE - 60) == (0, 0.0)
+    assert store.locate(BASE + 50) == (0, 50.0)
+    assert store.locate(BASE + 300) == (1, 0.0)
+    assert store.locate(BASE + 450.5) == (1, 150.5)
+    assert store.locate(BASE + 800) == (2, 0.0)
+    assert store.locate(BASE + 1300) == (2, 300.0)
+    assert store.locate(BASE + 1301) is None
+    assert unlimited(tmp_path / 'empty').locate(BASE) is None
+
+
+def test_locate_is_a_binary_search(tmp_path):
+    class CountingList(list):
+        reads = 0
+
+        def __getitem__(self, index):
+            CountingList.reads += 1
+            return super().__getitem__(index)
+
+    store = unlimited(tmp_path)
+    count = 50000
+    store._set_entries([{'file': f'seg_{i}', 'start': BASE + i * 300, 'end': BASE + i * 300 + 299, 'bytes': 1,
+                         'codec': 'mp3', 'session': 'a'} for i in range(count)])
+    store.starts = CountingList(store.starts)
+    for i in (0, 1, 12345, count - 1):
+        CountingList.reads = 0
+        assert store.locate(BASE + i * 300 + 10) == (i, 10.0)
+        assert 0 < CountingList.reads <= count.bit_length() + 1
+
+
+def test_old_segments_are_evicted_by_age(tmp_path):
+    store = unlimited(tmp_path)
+    names = [add_segment(store, day * DAY, day * DAY + 300) for day in range(-10, 0)]
+    store.max_age_days = 2
+    store.enforce_retention(now=BASE)
+
+    kept = names[-2:]
+    assert [entry['file'] for entry in store.entries] == kept
+    assert sorted(name for name in os.listdir(tmp_path) if name.startswith('seg_')) == kept
+    assert [entry['file'] for entry in index_lines(store)] == kept
+    assert store.starts == [entry['start'] for entry in store.entries]
+
+
+def test_the_oldest_segments_go_first_when_the_store_is_too_big(tmp_path):
+    store = unlimited(tmp_path)
+    names = [add_segment(store, i * 300, (i + 1) * 300, size=1000) for i in range(6)]
+    store.max_bytes = 3500
+    store.enforce_retention(now=BASE + 2000)
+
+    assert [entry['file'] for entry in store.entries] == names[3:]
+    assert [entry['file'] for entry in index_lines(store)] == names[3:]
+    assert not os.path.exists(os.path.join(tmp_path, names[2]))
+    # The rewritten index is what a restart sees
+    assert [entry['file'] for entry in unlimited(tmp_path).entries] == names[3:]
+    assert not os.path.exists(store.index_path + '.tmp')
+
+
+def test_a_restart_indexes_orphans_and_skips_what_is_gone(tmp_path):
+    store = unlimited(tmp_path)
+    kept = add_segment(store, 0, 300)
+    gone = add_segment(store, 300, 600)
+    os.remove(os.path.join(tmp_path, gone))
+    with open(store.index_path, 'a') as file:
+        file.write('{"file": "seg_2026')  # The app died halfway through a line
+
+    # The segment that was open when the app went down is not in the index
+    orphan = 'seg_' + datetime.fromtimestamp(BASE + 600).strftime('%Y%m%d_%H%M%S') + '.mp3'
+    orphan_path = os.path.join(tmp_path, orphan)
+    with open(orphan_path, 'wb') as file:
+        file.write(b'\0' * 123)
+    os.utime(orphan_path, (BASE + 700, BASE + 700))
+    open(os.path.join(tmp_path, 'seg_not_a_time.mp3'), 'wb').close()
+
+    reopened = unlimited(tmp_path)
+    assert [entry['file'] for entry in reopened.entries] == [kept, orphan]
+    entry = reopened.entries[1]
+    assert (entry['start'], entry['end'], entry['bytes'], entry['codec']) == (BASE + 600, BASE + 700, 123, None)
+    # The index is rewritten without the broken line and the missing segment, and the orphan is added
+    assert [entry['file'] for entry in index_lines(reopened)] == [kept, orphan]
+    assert [entry['file'] for entry in unlimited(tmp_path).entries] == [kept, orphan]
+
+
+def test_the_playlist_starts_at_the_offset_and_stops_at_a_codec_change(tmp_path):
+    store = unlimited(tmp_path)
+    first = add_segment(store, 0, 300)
+    second = add_segment(store, 300, 600)
+    add_segment(store, 600, 900, codec='pcm')
+
+    path = store.write_playlist(BASE + 120.25)
+    with open(path) as file:
+        lines = file.read().splitlines()
+    assert lines == ['ffconcat version 1.0',
+                     f"file '{os.path.join(str(tmp_path), first)}'", 'inpoint 120.250',
+                     f"file '{os.path.join(str(tmp_path), second)}'"]
+    assert store.write_playlist(BASE + 5000) is None
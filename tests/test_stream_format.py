@@ -0,0 +1,55 @@
+"""The stream header on the wire, and cutting an Ogg stream into pages."""
+import struct
+
+import pytest
+
+from stream_format import (CODECS, HEADER, HEADER_MAGIC, HEADER_SIZE, CODEC_MP3, CODEC_OPUS_20, StreamHeader,
+                           codec_for_label, ogg_pages)
+
+
+def ogg_page(payload, granule=0, sequence=0):
+    # 255-byte lacing values, and a shorter last one, as libogg writes them
+    lacing = [255] * (len(payload) // 255) + [len(payload) % 255]
+    return (b'OggS' + struct.pack('<BBqIII', 0, 0, granule, 1234, sequence, 0) + bytes([len(lacing)]) +
+            bytes(lacing) + payload)
+
+
+@pytest.mark.parametrize('codec', sorted(CODECS))
+def test_every_codec_survives_the_round_trip(codec):
+    header = StreamHeader(codec, 44100, 1)
+    data = header.pack()
+    assert len(data) == HEADER_SIZE and data.startswith(HEADER_MAGIC)
+    unpacked = StreamHeader.unpack(data + b'audio follows')
+    assert unpacked == header and not unpacked.legacy
+    assert (unpacked.codec, unpacked.sample_rate, unpacked.channels) == (codec, 44100, 1)
+
+
+def test_what_is_not_a_header():
+    assert StreamHeader.unpack(b'') is None
+    assert StreamHeader.unpack(StreamHeader(CODEC_MP3).pack()[:-1]) is None
+    assert StreamHeader.unpack(b'\x47' + bytes(HEADER_SIZE)) is None  # MPEG-TS from a sender without a header
+    with pytest.raises(ValueError):
+        StreamHeader.unpack(HEADER.pack(HEADER_MAGIC, 1, 99, 48000, 2, 0))
+    assert codec_for_label(CODECS[CODEC_OPUS_20].label) == CODEC_OPUS_20
+    assert codec_for_label('Something else') == CODEC_MP3
+
+
+def test_ogg_pages_are_found_whole():
+    head = ogg_page(b'OpusHead' + bytes(11))
+    tags = ogg_page(b'OpusTags' + bytes(300), sequence=1)  # Two lacing values
+    audio = ogg_page(bytes(510), granule=960, sequence=2)  # A lacing value of 0 after two of 255
+    data = head + tags + audio
+    assert list(ogg_pages(data)) == [(0, len(head), 0), (len(head), len(tags), 0),
+                                     (len(head) + len(tags), len(audio), 960)]
+
+    # A page that has not fully arrived is left for later, whichever part is missing
+    pages = list(ogg_pages(data))
+    for cut in (len(head) + 10, len(head) + 28, len(data) - 1):
+        assert list(ogg_pages(data[:cut])) == [page for page in pages if page[0] + page[1] <= cut]
+
+
+def test_ogg_pages_resync_after_garbage():
+    page = ogg_page(b'x' * 40, granule=480)
+    data = b'garbage before' + page + b'Og' + page
+    assert list(ogg_pages(data)) == [(14, len(page), 480), (14 + len(page) + 2, len(page), 480)]
+    assert list(ogg_pages(b'no pages in here at all, not one')) == []
@@ -0,0 +1,190 @@
+"""UDP/RTP transport over loopback: reordering, loss, late packets and the config packet."""
+import math
+import socket
+import struct
+import threading
+import time
+
+from stream_format import CODEC_MP3, CODEC_PCM, StreamHeader
+from stream_transport import (JitterBuffer, RTP_CLOCK_RATE, RTP_PAYLOAD_CONFIG, RTP_PAYLOAD_DYNAMIC, RtpReceiver,
+                              RtpSender, pack_rtp, unpack_rtp)
+
+PACKET_BYTES = 1316               # One MP3/MPEG-TS RTP payload, see stream_format
+PACKET_MS = 5
+
+
+class PacedSource:
+    """``count`` payloads, one every PACKET_MS, each starting with its index."""
+
+    def __init__(self, count):
+        self.count = count
+        self.index = 0
+        self.started = None
+
+    def read(self, size):
+        if self.index == self.count:
+            return b''
+        if self.started is None:
+            self.started = time.monotonic()
+        delay = self.started + self.index * PACKET_MS / 1000 - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        payload = struct.pack('!I', self.index).ljust(PACKET_BYTES, b'\0')
+        self.index += 1
+        return payload
+
+
+class CollectingSink:
+    def __init__(self, header):
+        self.header = header
+        self.data = b''
+        self.closed = threading.Event()
+
+    def write(self, data):
+        self.data += data
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed.set()
+
+    def indices(self):
+        return [struct.unpack_from('!I', self.data, offset)[0] for offset in range(0, len(self.data), PACKET_BYTES)]
+
+
+class LossyRelay:
+    """Forward RTP from the sender to the receiver, dropping, swapping and delaying chosen media packets.
+
+    Media packets are picked by the index in their payload. The first config
+    packet is dropped, so everything sent before the next one must be ignored.
+    """
+
+    def __init__(self, target, drop=(), swap=(), delay=None, delay_s=0.0):
+        self.target = target
+        self.drop = set(drop)
+        self.swap = swap          # (a, b): a is held until b has been forwarded
+        self.delay = delay
+        self.delay_s = delay_s
+        self.configs = 0
+        self.first_after_config = None
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(0.2)
+        self.port = self.sock.getsockname()[1]
+        self.out = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.held = None
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            try:
+                packet, _ = self.sock.recvfrom(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            _, _, _, _, payload_type, payload = unpack_rtp(packet)
+            if payload_type == RTP_PAYLOAD_CONFIG:
+                self.configs += 1
+                if self.configs > 1:
+                    self.out.sendto(packet, self.target)
+                continue
+            if not payload:
+                self.out.sendto(packet, self.target)  # End marker
+                continue
+            index = struct.unpack_from('!I', payload)[0]
+            if self.configs > 1 and self.first_after_config is None:
+                self.first_after_config = index
+            if index in self.drop:
+                continue
+            if index == self.delay:
+                threading.Timer(self.delay_s, self.out.sendto, (packet, self.target)).start()
+                continue
+            if self.swap and index == self.swap[0]:
+                self.held = packet
+                continue
+            self.out.sendto(packet, self.target)
+            if self.swap and index == self.swap[1]:
+                self.out.sendto(self.held, self.target)
+
+    def stop(self):
+        self.running = False
+        self.sock.close()
+        self.out.close()
+
+
+def test_loopback_reorder_loss_and_late():
+    sinks = []
+    receiver = RtpReceiver(port=0, bind_address='127.0.0.1', target_ms=80, adaptive=False, idle_timeout=3)
+    receiver.listen()
+    receiver.start(lambda header: sinks.append(CollectingSink(header)) or sinks[-1])
+    # A config packet goes out every second: the first is dropped, the second arrives around packet 200
+    relay = LossyRelay(('127.0.0.1', receiver.port), drop=(250, 251, 270), swap=(260, 261), delay=240, delay_s=0.3)
+    header = StreamHeader(CODEC_MP3)
+    sender = RtpSender('127.0.0.1', relay.port, header=header)
+    sender.start(PacedSource(340))
+
+    assert sender.closed.wait(5)
+    assert receiver.closed.wait(5)
+    relay.stop()
+
+    assert len(sinks) == 1 and sinks[0].header == header
+    start = relay.first_after_config
+    assert start is not None and 150 < start < 240
+    indices = sinks[0].indices()
+    # Nothing from before the config packet is played, the swapped pair comes out in order
+    assert indices == [i for i in range(start, 340) if i not in (240, 250, 251, 270)]
+    counters = receiver.counters()
+    assert counters['lost'] == 4              # Three dropped, one too late to play
+    assert counters['late'] == 1
+    assert counters['dropped'] == 0
+    assert receiver.jitter.snapshot()['depth'] == 0
+
+
+def test_config_packets_do_not_count_as_loss_and_a_new_format_ends_the_session():
+    sinks = []
+    receiver = RtpReceiver(port=0, bind_address='127.0.0.1', target_ms=20, adaptive=False)
+    receiver.listen()
+    receiver.start(lambda header: sinks.append(CollectingSink(header)) or sinks[-1])
+    out = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    target = ('127.0.0.1', receiver.port)
+    pcm = StreamHeader(CODEC_PCM)
+    payload = bytes(960)
+    now = time.monotonic()
+    out.sendto(pack_rtp(10, 0, 1, payload, payload_type=RTP_PAYLOAD_DYNAMIC), target)  # Before any config
+    for seq in range(10, 20):
+        timestamp = int((now + (seq - 10) * PACKET_MS / 1000) * RTP_CLOCK_RATE)
+        if seq % 3 == 0:
+            # Config packets reuse the sequence number of the next media packet
+            out.sendto(pack_rtp(seq, timestamp, 1, pcm.pack(), payload_type=RTP_PAYLOAD_CONFIG), target)
+        out.sendto(pack_rtp(seq, timestamp, 1, payload, payload_type=RTP_PAYLOAD_DYNAMIC), target)
+    time.sleep(0.2)
+    assert receiver.counters()['lost'] == 0
+    assert len(sinks[0].data) == 960 * 8      # seq 12 to 19, after the first config at 12
+
+    out.sendto(pack_rtp(20, 0, 1, StreamHeader(CODEC_MP3).pack(), payload_type=RTP_PAYLOAD_CONFIG), target)
+    assert receiver.closed.wait(2)
+    assert receiver.error is None
+    assert len(sinks) == 1 and sinks[0].closed.is_set()
+    out.close()
+
+
+def test_jitter_buffer_depth_is_bounded():
+    target_ms, max_ms = 40, 250
+    jitter = JitterBuffer(target_ms=target_ms, max_ms=max_ms, adaptive=False)
+    ticks = RTP_CLOCK_RATE * PACKET_MS // 1000
+    depths = []
+    # Nothing is ever played out, as if the decoder had stalled
+    for seq in range(1000):
+        assert jitter.push(seq, seq * ticks, b'x', arrival=seq * PACKET_MS / 1000)
+        depths.append(len(jitter.packets))
+    bound = math.ceil((target_ms + max_ms) / PACKET_MS) + 1
+    assert max(depths) <= bound
+    assert jitter.dropped == 1000 - len(jitter.packets)
+    # Playout resumes where the drops left off, without counting them as lost
+    ready, _ = jitter.pop_ready(now=1000.0)
+    assert len(ready) == len(depths) - jitter.dropped
+    assert jitter.lost == 0
@@ -0,0 +1,187 @@
+"""TCP transport over loopback: the pump, the live source feeding several senders, and a session."""
+import io
+import threading
+import time
+
+from stream_format import CODEC_PCM, StreamHeader
+from stream_transport import LiveSource, StreamReceiver, StreamSender, TransportStats, _Pump
+
+
+class Chunks:
+    """``count`` numbered chunks, then the end of the stream."""
+
+    def __init__(self, count, size=100):
+        self.chunks = [bytes([index % 256]) * size for index in range(count)]
+        self.read = 0
+
+    def __call__(self):
+        if self.read == len(self.chunks):
+            return b''
+        self.read += 1
+        return self.chunks[self.read - 1]
+
+
+def run_pump(read_chunk, write_chunk, **kwargs):
+    finished = threading.Event()
+    pump = _Pump('test', read_chunk, write_chunk, TransportStats(), lambda pump: finished.set(), **kwargs)
+    pump.start()
+    return pump, finished
+
+
+def test_the_pump_delivers_everything_in_order_and_batches_a_backlog():
+    source = Chunks(50)
+    written = []
+    gate = threading.Event()
+
+    def write(data):
+        gate.wait(2)  # Held until the reader is done, so the queue fills up
+        written.append(data)
+
+    pump, finished = run_pump(source, write, max_batch_bytes=1000)
+    while source.read < 50:
+        time.sleep(0.01)
+    gate.set()
+    assert finished.wait(2)
+    assert b''.join(written) == b''.join(source.chunks)
+    assert max(len(data) for data in written) <= 1000
+    assert len(written) < 50  # Queued chunks left in as few writes as the batch size allows
+    stats = pump.stats.snapshot()
+    assert (stats['chunks_read'], stats['bytes_written'], stats['queue_depth']) == (50, 5000, 0)
+    assert pump.error is None
+
+
+def test_a_stuck_writer_blocks_the_reader_at_the_queue_size():
+    source = Chunks(100)
+    gate = threading.Event()
+    pump, finished = run_pump(source, lambda data: gate.wait(2), queue_chunks=4, max_batch_bytes=100)
+    time.sleep(0.3)
+    # One chunk in the writer's hands, four queued and one waiting to be put
+    assert source.read == 6
+    gate.set()
+    assert finished.wait(5)
+    assert source.read == 100
+
+
+def test_a_failing_writer_ends_the_pump_with_its_error():
+    def write(data):
+        raise BrokenPipeError("receiver went away")
+
+    pump, finished = run_pump(Chunks(1000), write, queue_chunks=4)
+    assert finished.wait(2)
+    assert isinstance(pump.error, BrokenPipeError)
+    pump.reader_thread.join(2)
+    assert not pump.reader_thread.is_alive()  # The reader gives up instead of waiting on a full queue
+
+
+class Sink:
+    def __init__(self):
+        self.data = bytearray()
+        self.closed = threading.Event()
+
+    def write(self, data):
+        self.data += data
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed.set()
+
+
+def test_a_session_carries_the_header_and_every_byte():
+    audio = bytes(range(256)) * 1000
+    sink = Sink()
+    headers = []
+    closed = threading.Event()
+
+    def open_sink(header):
+        headers.append(header)
+        return sink
+
+    receiver = StreamReceiver(port=0, bind_address='127.0.0.1', on_closed=lambda receiver, error: closed.set())
+    port = receiver.listen()
+    receiver.start(open_sink)
+    sender = StreamSender('127.0.0.1', port, header=StreamHeader(CODEC_PCM))
+    sender.start(io.BytesIO(audio))
+
+    assert sink.closed.wait(5) and closed.wait(5)
+    assert headers == [StreamHeader(CODEC_PCM)]
+    assert bytes(sink.data) == audio
+    assert receiver.error is None
+    assert sender.connected.is_set() and sender.closed.wait(2)
+    assert receiver.counters()['bytes'] == len(audio)
+
+
+class SteppedPipe:
+    """An encoder's stdout that hands out one chunk each time ``step`` is released."""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.step = threading.Semaphore(0)
+
+    def read1(self, size):
+        if not self.chunks:
+            return b''
+        self.step.acquire()
+        return self.chunks.pop(0)
+
+
+def test_a_slow_subscriber_loses_its_oldest_chunks_and_holds_up_nobody():
+    chunks = [bytes([index]) * 188 for index in range(40)]
+    pipe = SteppedPipe(chunks)
+    source = LiveSource(pipe, align=188, chunk_size=188)
+    fast = source.subscribe(max_queued=2)
+    slow = source.subscribe(max_queued=4)
+    received = []
+
+    def consume():
+        # The next chunk is only read from the pipe once this one has arrived
+        while True:
+            pipe.step.release()
+            data = fast.read1()
+            if not data:
+                return
+            received.append(data)
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    source.start()
+    consumer.join(5)
+    assert not consumer.is_alive()
+    assert source.eof.is_set()
+
+    assert received == chunks and fast.dropped == 0
+    # Nothing was read from the slow one, it keeps the newest it can hold
+    assert slow.dropped == 36
+    assert [slow.read1() for _ in range(5)] == chunks[-4:] + [b'']
+
+
+def test_chunks_are_cut_on_the_alignment():
+    data = bytes(range(256)) * 10
+    pipe = io.BufferedReader(io.BytesIO(data), buffer_size=300)
+    source = LiveSource(pipe, align=188, chunk_size=300)
+    subscription = source.subscribe()
+    source.start()
+    received = []
+    while True:
+        chunk = subscription.read1()
+        if not chunk:
+            break
+        assert len(chunk) % 188 == 0
+        received.append(chunk)
+    whole = len(data) - len(data) % 188
+    assert b''.join(received) == data[:whole]  # The partial packet at the end is never passed on
+
+
+def test_a_closed_subscription_stops_receiving():
+    pipe = SteppedPipe([b'a' * 4, b'b' * 4])
+    source = LiveSource(pipe, align=4).start()
+    subscription = source.subscribe()
+    subscription.close()
+    assert subscription.read1() == b''
+    assert source.subscriptions == []
+    pipe.step.release()
+    pipe.step.release()
+    assert source.eof.wait(2)
+    assert source.bytes_discarded == 8
+    assert source.subscribe().read1() == b''  # Subscribed after the end
@@ -0,0 +1,108 @@
+"""Telemetry health: the classify thresholds, and the streak it takes to recover."""
+from telemetry import (BUFFER_LOW_MS, HEALTH_BAD, HEALTH_DEGRADED, HEALTH_GOOD, HEALTH_WAITING, LOSS_BAD,
+                       LOSS_DEGRADED, RECOVER_SAMPLES, SILENCE_BAD_S, SILENCE_DEGRADED_S, UNDERRUNS_BAD, Telemetry,
+                       classify)
+
+
+def sample(**changes):
+    values = {'connected': True, 'since_last_packet_s': 0.01, 'buffer_ms': 60, 'packets': 1000,
+              'underruns': 0, 'late': 0, 'dropped': 0, 'lost': 0}
+    values.update(changes)
+    return values
+
+
+def health(**changes):
+    return classify(sample(**changes))[0]
+
+
+def test_classify_thresholds():
+    assert classify(sample(connected=False)) == (HEALTH_WAITING, 'No sender')
+    assert classify(sample()) == (HEALTH_GOOD, '')
+
+    assert health(since_last_packet_s=SILENCE_DEGRADED_S - 0.01) == HEALTH_GOOD
+    assert classify(sample(since_last_packet_s=SILENCE_DEGRADED_S)) == (HEALTH_DEGRADED, 'No packets for 0.5 s')
+    assert health(since_last_packet_s=SILENCE_BAD_S) == HEALTH_BAD
+    assert health(since_last_packet_s=None) == HEALTH_GOOD
+
+    # Loss is the share of late, dropped and lost packets among those that were due
+    due = 1000
+    below = int(due * LOSS_DEGRADED) - 1
+    assert health(packets=due, late=below) == HEALTH_GOOD
+    assert health(packets=due - 5, lost=5) == HEALTH_DEGRADED
+    assert health(packets=due, late=25, dropped=25) == HEALTH_BAD
+    assert classify(sample(packets=due - 50, lost=50))[1] == f'{LOSS_BAD:.0%} packets late or lost'
+    assert health(packets=0, lost=1) == HEALTH_BAD
+
+    assert classify(sample(underruns=1)) == (HEALTH_DEGRADED, '1 underrun')
+    assert classify(sample(underruns=UNDERRUNS_BAD - 1)) == (HEALTH_DEGRADED, '2 underruns')
+    assert health(underruns=UNDERRUNS_BAD) == HEALTH_BAD
+
+    assert classify(sample(buffer_ms=BUFFER_LOW_MS - 1)) == (HEALTH_DEGRADED, 'Buffer running low')
+    assert health(buffer_ms=BUFFER_LOW_MS) == HEALTH_GOOD
+    assert health(buffer_ms=0, packets=0) == HEALTH_GOOD  # Nothing arrived, nothing to buffer
+    assert health(buffer_ms=None) == HEALTH_GOOD
+
+
+class Counters:
+    """Cumulative receiver counters, advanced one interval at a time."""
+
+    def __init__(self):
+        self.values = {'connected': True, 'bytes': 0, 'packets': 0, 'underruns': 0, 'late': 0, 'dropped': 0,
+                       'lost': 0, 'buffer_ms': 60, 'idle_s': 0.01}
+
+    def __call__(self):
+        return dict(self.values)
+
+    def advance(self, packets=50, **counts):
+        self.values['packets'] += packets
+        self.values['bytes'] += packets * 1000
+        for key, count in counts.items():
+            self.values[key] += count
+
+
+def test_health_drops_at_once_and_recovers_after_a_streak():
+    counters = Counters()
+    telemetry = Telemetry(counters)
+    assert telemetry.sample()['health'] == HEALTH_GOOD  # The first sample has nothing to compare with
+
+    counters.advance(underruns=1)
+    assert telemetry.sample()['health'] == HEALTH_DEGRADED
+    counters.advance(underruns=UNDERRUNS_BAD)
+    worst = telemetry.sample()
+    assert (worst['health'], worst['reason']) == (HEALTH_BAD, '3 underruns')
+
+    for _ in range(RECOVER_SAMPLES - 1):
+        counters.advance()
+        recovering = telemetry.sample()
+        assert (recovering['health'], recovering['reason']) == (HEALTH_BAD, 'Recovering')
+    counters.advance()
+    assert telemetry.sample()['health'] == HEALTH_GOOD
+
+    # A relapse in the middle of a streak starts it over
+    counters.advance(underruns=1)
+    assert telemetry.sample()['health'] == HEALTH_DEGRADED
+    counters.advance()
+    assert telemetry.sample()['health'] == HEALTH_DEGRADED
+    counters.advance(underruns=1)
+    telemetry.sample()
+    for _ in range(RECOVER_SAMPLES - 1):
+        counters.advance()
+        assert telemetry.sample()['health'] == HEALTH_DEGRADED
+    counters.advance()
+    assert telemetry.sample()['health'] == HEALTH_GOOD
+
+
+def test_a_new_session_is_good_at_once_and_counts_from_zero():
+    counters = Counters()
+    telemetry = Telemetry(counters)
+    counters.values['connected'] = False
+    assert telemetry.sample()['health'] == HEALTH_WAITING
+    counters.values['connected'] = True
+    counters.advance(packets=100)
+    first = telemetry.sample()
+    assert first['health'] == HEALTH_GOOD and first['packets'] == 100
+
+    # The receiver's counters start over with a new sender
+    counters.values.update(packets=10, bytes=10000, lost=0)
+    restarted = telemetry.sample()
+    assert restarted['packets'] == 0 and restarted['health'] == HEALTH_GOOD
@@ -0,0 +1,88 @@
+"""UiBus draining on a fake Tk root, whose timer only fires when the test says so."""
+import logging
+
+from ui_bus import EVENT_METRICS, EVENT_STATUS, UiBus
+
+
+class FakeRoot:
+    def __init__(self):
+        self.pending = []
+
+    def after(self, ms, callback):
+        self.pending.append((ms, callback))
+
+    def tick(self):
+        # Run what was scheduled so far, as one Tk timer round would
+        pending, self.pending = self.pending, []
+        for _, callback in pending:
+            callback()
+
+
+def test_latest_only_events_are_coalesced_to_the_last_one():
+    root = FakeRoot()
+    bus = UiBus(root, interval_ms=50)
+    samples, statuses = [], []
+    bus.subscribe(EVENT_METRICS, samples.append, latest_only=True)
+    bus.subscribe(EVENT_STATUS, lambda text, color: statuses.append(text))
+    bus.start()
+    assert root.pending[0][0] == 50
+
+    for i in range(5):
+        bus.post(EVENT_METRICS, i)
+        bus.post(EVENT_STATUS, f"status {i}", "green")
+    root.tick()
+    assert samples == [4]
+    assert statuses == [f"status {i}" for i in range(5)]  # Every one of these counts
+    assert bus.coalesced == 4 and bus.events == 6
+    assert len(root.pending) == 1  # Drained again on the next round
+
+
+def test_what_does_not_fit_in_a_drain_waits_for_the_next():
+    root = FakeRoot()
+    bus = UiBus(root, max_per_drain=3)
+    seen = []
+    bus.subscribe(EVENT_STATUS, lambda text, color: seen.append(text))
+    bus.start()
+    for i in range(7):
+        bus.post(EVENT_STATUS, i, None)
+
+    root.tick()
+    assert seen == [0, 1, 2]
+    root.tick()
+    assert seen == [0, 1, 2, 3, 4, 5]
+    root.tick()
+    assert seen == list(range(7))
+    root.tick()
+    assert seen == list(range(7)) and bus.events == 7
+
+
+def test_a_failing_handler_does_not_stop_the_others(caplog):
+    root = FakeRoot()
+    bus = UiBus(root)
+    seen = []
+
+    def fail(sample):
+        raise ValueError("widget gone")
+
+    bus.subscribe(EVENT_METRICS, fail)
+    bus.subscribe(EVENT_STATUS, lambda text, color: seen.append(text))
+    bus.start()
+    bus.post(EVENT_METRICS, 1)
+    bus.post(EVENT_STATUS, "after", None)
+    bus.call(seen.append, "called")
+    bus.post('unknown')
+    with caplog.at_level(logging.WARNING):
+        root.tick()
+    assert seen == ["after", "called"]
+    assert "UI event metrics failed: widget gone" in caplog.text
+    assert "No handler for UI event unknown" in caplog.text
+    assert len(root.pending) == 1  # The timer survives the failure
+
+
+def test_a_stopped_bus_does_not_drain_again():
+    root = FakeRoot()
+    bus = UiBus(root)
+    bus.start()
+    bus.stop()
+    root.tick()
+    assert root.pending == []
@@ -0,0 +1,88 @@
+"""VolumeWorker against a slow MockEndpoint: the latest value wins and endpoint calls stay bounded."""
+import math
+import time
+
+from volume_worker import MockEndpoint, VolumeWorker
+
+CALL_DELAY = 0.02                 # Per COM call, as if the audio service were busy
+MIN_INTERVAL = 0.03
+
+
+def wait_until(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def set_calls(endpoint, name):
+    return [call for call in endpoint.calls if call[0] == name]
+
+
+def test_a_drag_is_coalesced_and_the_last_value_wins():
+    endpoint = MockEndpoint(level=0.5, delay=CALL_DELAY)
+    states = []
+    worker = VolumeWorker(lambda: endpoint, states.append, min_interval=MIN_INTERVAL, com=False).start()
+    assert wait_until(lambda: states)
+
+    # A slider drag: one change per pixel, much faster than the endpoint takes them
+    values = [step / 200 for step in range(200, -1, -1)]
+    started = time.monotonic()
+    for value in values:
+        worker.set_volume(value)
+        time.sleep(0.001)
+    drag_s = time.monotonic() - started
+
+    assert wait_until(lambda: endpoint.level == values[-1] and states[-1]['volume'] == values[-1])
+    time.sleep(0.2)
+    worker.stop(timeout=1)
+
+    calls = set_calls(endpoint, 'SetMasterVolumeLevelScalar')
+    assert calls[-1] == ('SetMasterVolumeLevelScalar', values[-1])
+    # Each round trip is a set plus two reads and is spaced MIN_INTERVAL apart, plus the one in flight at the end
+    bound = math.ceil(drag_s / (CALL_DELAY * 3 + MIN_INTERVAL)) + 2
+    assert len(calls) <= bound < len(values)
+    assert worker.calls == len(calls)
+    assert worker.coalesced + len(calls) == len(values)
+    assert states[-1] == {'volume': values[-1], 'muted': False, 'rebound': False}
+
+
+def test_mute_toggles_coalesce_to_the_latest():
+    endpoint = MockEndpoint(delay=CALL_DELAY)
+    states = []
+    worker = VolumeWorker(lambda: endpoint, states.append, min_interval=MIN_INTERVAL, com=False).start()
+    assert wait_until(lambda: states)
+    for muted in (True, False, True, False, True):
+        worker.set_muted(muted)
+    assert wait_until(lambda: states[-1] and states[-1]['muted'])
+    time.sleep(0.2)
+    worker.stop(timeout=1)
+    mutes = set_calls(endpoint, 'SetMute')
+    assert mutes[-1] == ('SetMute', 1)
+    assert len(mutes) <= 2
+    assert endpoint.muted
+
+
+def test_an_endpoint_that_goes_away_is_bound_again():
+    endpoints = [MockEndpoint(), MockEndpoint()]
+    opened = []
+
+    def open_endpoint():
+        endpoint = endpoints[len(opened)]
+        opened.append(endpoint)
+        return endpoint
+
+    states = []
+    worker = VolumeWorker(open_endpoint, states.append, min_interval=0.0, com=False).start()
+    assert wait_until(lambda: states)
+    endpoints[0].SetMasterVolumeLevelScalar = lambda level, context: (_ for _ in ()).throw(OSError('device removed'))
+    worker.set_volume(0.2)
+    assert wait_until(lambda: len(states) == 2)
+    assert states[-1] is None
+    worker.set_volume(0.3)
+    assert wait_until(lambda: len(states) == 3)
+    worker.stop(timeout=1)
+    assert len(opened) == 2 and endpoints[1].level == 0.3
+    assert states[-1]['rebound']
@@ -0,0 +1,85 @@
+"""One queue for everything worker threads want to show in the Tk window.
+
+Tk is not thread-safe, and calling ``root.after`` from a worker is itself a
+Tk call. Workers instead :meth:`UiBus.post` a typed event to a plain queue,
+which never blocks and never touches Tk; the Tk thread drains the queue on a
+single timer and dispatches each event to the handler subscribed for its
+kind. Kinds subscribed with ``latest_only`` (metrics samples, say) are
+coalesced so a burst only costs one widget update per drain.
+"""
+import logging
+import queue
+
+DRAIN_INTERVAL_MS = 50
+MAX_EVENTS_PER_DRAIN = 500        # The rest waits for the next drain, so the window keeps responding
+
+EVENT_CALL = 'call'               # (callback, *args): run callback on the Tk thread
+EVENT_STATUS = 'status'           # (text, color)
+EVENT_ERROR = 'error'             # (text,)
+EVENT_STOPPED = 'stopped'         # (source, recorded): the receiver or stream that has ended
+EVENT_METRICS = 'metrics'         # (sample,)
+EVENT_SESSION = 'session'         # (session, status): a sender session's periodic status
+EVENT_MIXER = 'mixer'             # (mixer, sources): the mixer's levels and buffers
+EVENT_VOLUME = 'volume'           # (state,)
+EVENT_PLAYBACK_ENDED = 'playback_ended'  # (process,)
+
+
+class UiBus:
+    """Typed events from any thread, dispatched on the Tk thread every ``interval_ms``."""
+
+    def __init__(self, root, interval_ms=DRAIN_INTERVAL_MS, max_per_drain=MAX_EVENTS_PER_DRAIN):
+        self.root = root
+        self.interval_ms = interval_ms
+        self.max_per_drain = max_per_drain
+        self.handlers = {EVENT_CALL: lambda callback, *args: callback(*args)}
+        self.latest_only = set()
+        self.running = False
+        self.events = 0
+        self.coalesced = 0
+        self._queue = queue.SimpleQueue()
+
+    def subscribe(self, kind, handler, latest_only=False):
+        self.handlers[kind] = handler
+        if latest_only:
+            self.latest_only.add(kind)
+
+    def post(self, kind, *args):
+        """Queue an event; safe from any thread."""
+        self._queue.put((kind, args))
+
+    def call(self, callback, *args):
+        self.post(EVENT_CALL, callback, *args)
+
+    def start(self):
+        # On the Tk thread
+        self.running = True
+        self.root.after(self.interval_ms, self._drain)
+
+    def stop(self):
+        self.running = False
+
+    def _drain(self):
+        batch = []
+        try:
+            while len(batch) < self.max_per_drain:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        if self.latest_only:
+            last = {kind: index for index, (kind, _) in enumerate(batch) if kind in self.latest_only}
+            kept = [event for index, event in enumerate(batch)
+                    if event[0] not in self.latest_only or last[event[0]] == index]
+            self.coalesced += len(batch) - len(kept)
+            batch = kept
+        for kind, args in batch:
+            handler = self.handlers.get(kind)
+            if handler is None:
+                logging.warning('No handler for UI event %s', kind)
+                continue
+            try:
+                handler(*args)
+            except Exception as e:
+                logging.error('UI event %s failed: %s', kind, e)
+        self.events += len(batch)
+        if self.running:
+            self.root.after(self.interval_ms, self._drain)
@@ -0,0 +1,152 @@
+"""Speaker volume and mute for Audio Receiver, set off the UI thread.
+
+Dragging the volume slider or turning the mouse wheel produces a change per
+pixel or notch, and every ``SetMasterVolumeLevelScalar`` is a synchronous
+cross-process COM call into the audio service. Made on the Tk thread, a
+drag made the window stutter. :class:`VolumeWorker` owns the endpoint on
+its own thread (and COM apartment); the UI only records the value it wants.
+Changes that arrive while a call is in flight are folded into one, the
+latest value wins, and calls are spaced at least ``min_interval`` apart.
+After every call the state Windows actually reports is handed back.
+
+:class:`MockEndpoint` stands in for IAudioEndpointVolume where there is none.
+"""
+import logging
+import threading
+import time
+
+VOLUME_MIN_INTERVAL = 0.03        # At most about 30 COM calls a second while dragging
+
+
+class MockEndpoint:
+    """The IAudioEndpointVolume calls the worker makes, with a call log and an optional per-call delay."""
+
+    def __init__(self, level=0.5, muted=False, delay=0.0):
+        self.level = level
+        self.muted = muted
+        self.delay = delay
+        self.calls = []
+
+    def _call(self, name, *args):
+        self.calls.append((name,) + args)
+        if self.delay:
+            time.sleep(self.delay)
+
+    def GetMasterVolumeLevelScalar(self):
+        self._call('GetMasterVolumeLevelScalar')
+        return self.level
+
+    def SetMasterVolumeLevelScalar(self, level, context):
+        self._call('SetMasterVolumeLevelScalar', level)
+        self.level = level
+
+    def GetMute(self):
+        self._call('GetMute')
+        return int(self.muted)
+
+    def SetMute(self, muted, context):
+        self._call('SetMute', muted)
+        self.muted = bool(muted)
+
+
+class VolumeWorker:
+    """Apply volume and mute changes to the endpoint from ``open_endpoint()`` on one worker thread.
+
+    ``open_endpoint`` runs on the worker, so the COM object lives in the
+    worker's apartment; it is called again by :meth:`rebind` when the default
+    device changes. ``on_state(state)`` is called from the worker with
+    ``{'volume': 0..1, 'muted': bool, 'rebound': bool}`` after each bind or
+    batch of changes, or ``None`` when the endpoint can't be reached; a Tk
+    app should post it to its :class:`ui_bus.UiBus`.
+    """
+
+    def __init__(self, open_endpoint, on_state=None, min_interval=VOLUME_MIN_INTERVAL, com=True):
+        self.open_endpoint = open_endpoint
+        self.on_state = on_state
+        self.min_interval = min_interval
+        self.com = com
+        self.endpoint = None
+        self.calls = 0
+        self.coalesced = 0
+        self._volume = None       # Pending changes, None when there is nothing to do
+        self._muted = None
+        self._rebind = True
+        self._running = True
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='volume', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._wake.set()  # Bind right away
+        return self
+
+    def set_volume(self, level):
+        self._request('_volume', max(0.0, min(1.0, level)))
+
+    def set_muted(self, muted):
+        self._request('_muted', bool(muted))
+
+    def rebind(self):
+        self._request('_rebind', True)
+
+    def _request(self, name, value):
+        with self._lock:
+            if name != '_rebind' and getattr(self, name) is not None:
+                self.coalesced += 1  # Replaced before it was applied
+            setattr(self, name, value)
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        # With a timeout, wait up to that long for the endpoint to be released
+        self._running = False
+        self._wake.set()
+        if timeout is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _run(self):
+        if self.com:
+            from comtypes import CoInitialize, CoUninitialize
+            CoInitialize()
+        try:
+            last_call = 0.0
+            while True:
+                self._wake.wait()
+                if not self._running:
+                    break
+                # Let changes pile up until the previous call is min_interval old
+                delay = last_call + self.min_interval - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                self._wake.clear()
+                with self._lock:
+                    volume, muted, rebind = self._volume, self._muted, self._rebind
+                    self._volume = self._muted = None
+                    self._rebind = False
+                self._apply(volume, muted, rebind)
+                last_call = time.monotonic()
+        finally:
+            self.endpoint = None  # Released before the apartment goes away
+            if self.com:
+                CoUninitialize()
+
+    def _apply(self, volume, muted, rebind):
+        rebind = rebind or self.endpoint is None
+        try:
+            if rebind:
+                self.endpoint = self.open_endpoint()
+            if volume is not None:
+                self.endpoint.SetMasterVolumeLevelScalar(volume, None)
+                self.calls += 1
+            if muted is not None:
+                self.endpoint.SetMute(1 if muted else 0, None)
+                self.calls += 1
+            state = {'volume': self.endpoint.GetMasterVolumeLevelScalar(), 'muted': bool(self.endpoint.GetMute()),
+                     'rebound': rebind}
+        except Exception as e:
+            # The device went away; the next change or device event binds again
+            logging.error('Could not set the speaker volume: %s', e)
+            self.endpoint = None
+            state = None
+        if self.on_state:
+            self.on_state(state)